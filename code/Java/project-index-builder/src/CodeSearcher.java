@@ -15,6 +15,7 @@ import org.apache.lucene.util.BytesRef;
 
 import com.google.gson.Gson;
 import com.google.gson.JsonArray;
+import com.google.gson.JsonElement;
 import com.google.gson.JsonObject;
 
 import java.io.IOException;
@@ -23,6 +24,7 @@ import java.nio.file.Path;
 import java.util.ArrayList;
 import java.util.HashSet;
 import java.util.List;
+import java.util.Map;
 import java.util.Set;
 import java.util.TreeSet;
 
@@ -79,6 +81,28 @@ public class CodeSearcher {
         return "";
     }
 
+    /**
+     * Open a long-lived searcher session for a project.
+     * The index is opened once and reused by every call of searchBatch, close it with close().
+     * @param project Project root
+     * @param index Index path of the project
+     * @param top_k Number of results kept for each focal method
+     * @throws IOException If an error occurs while opening the index
+     */
+    public static CodeSearcher open(String project, String index, int top_k) throws IOException {
+        Path project_path = Path.of(project);
+        Path index_path = Path.of(index);
+        if (!Files.isDirectory(project_path)){
+            throw new IllegalArgumentException("project root should be a directory!");
+        }
+        if (!Files.exists(index_path)) {
+            throw new IllegalArgumentException("index_path should be a directory!");
+        }
+        CodeSearcher searchEngine = new CodeSearcher(project_path, index_path);
+        searchEngine.setTopK(top_k);
+        return searchEngine;
+    }
+
     public CodeSearcher() {
         this.index_path = null;
     }
@@ -180,6 +204,10 @@ public class CodeSearcher {
      */
     public List<QueryFormat> parseQueryString(String query) {
         JsonArray queryArray = new Gson().fromJson(query, JsonArray.class);
+        return parseQueryArray(queryArray);
+    }
+
+    private List<QueryFormat> parseQueryArray(JsonArray queryArray) {
         List<QueryFormat> queryList = new ArrayList<>();
         for (int i = 0; i < queryArray.size(); i++) {
             JsonObject queryObject = queryArray.get(i).getAsJsonObject();
@@ -298,9 +326,33 @@ public class CodeSearcher {
 
     }
 
+    /**
+     * Search queries of many focal methods with the opened index.
+     * format of batch query string:
+     * {
+     *   "<focal method key>": [<query list, same format as parseQueryString>],
+     *   ...
+     * }
+     * @return json object string: {"<focal method key>": [<result list>], ...}
+     * @throws IOException If an error occurs while searching
+     */
+    public synchronized String searchBatch(String batch_query) throws IOException {
+        JsonObject batch = new Gson().fromJson(batch_query, JsonObject.class);
+        JsonObject batch_result = new JsonObject();
+        for (Map.Entry<String, JsonElement> entry : batch.entrySet()) {
+            // results of different focal methods should not be merged
+            setResultSet();
+            List<QueryFormat> query_list = parseQueryArray(entry.getValue().getAsJsonArray());
+            for (QueryFormat query : query_list) {
+                search(query);
+            }
+            batch_result.add(entry.getKey(), getResultList());
+        }
+        return batch_result.toString();
+    }
+
     public JsonArray getResultList() {
         // transform the result set to JsonArray and only keep the top k results
-        System.out.println(this.results.size()+" results found.");
         List<ResultFormat> topResults = new ArrayList<>(this.results);
         topResults.removeIf(result -> result.score == 1);
         topResults = topResults.subList(0, Math.min(topResults.size(), this.top_k));
@@ -5,6 +5,9 @@ import org.apache.lucene.document.Field;
 import org.apache.lucene.document.SortedSetDocValuesField;
 import org.apache.lucene.document.StoredField;
 import org.apache.lucene.document.StringField;
+import org.apache.lucene.index.DirectoryReader;
+import org.apache.lucene.index.MultiTerms;
+import org.apache.lucene.index.Term;
 import org.apache.lucene.index.IndexWriter;
 import org.apache.lucene.index.IndexWriterConfig;
 import org.apache.lucene.index.IndexWriterConfig.OpenMode;
@@ -24,7 +27,10 @@ import java.io.InputStreamReader;
 import java.nio.file.Files;
 import java.nio.file.Path;
 import java.nio.file.Paths;
+import java.util.Arrays;
+import java.util.HashSet;
 import java.util.Map;
+import java.util.Set;
 
 /**
  * Index Builder class - used to add documents and build Lucene index
@@ -39,7 +45,7 @@ public class IndexBuilder {
     public static void main(String[] args) {
         int arg_len = args.length;
         if (arg_len < 3) {
-            throw new IllegalArgumentException("Arguments for IndexBuilder:<mode> <project path> <index path>");
+            throw new IllegalArgumentException("Arguments for IndexBuilder:<mode> <project path> <index path> [<changed classes> for update]");
         }
         String mode = args[0];
         Path code_path = Paths.get(args[1]);
@@ -54,8 +60,11 @@ public class IndexBuilder {
             }
             IndexBuilder builder = new IndexBuilder(code_path, index_path);
             builder.startGroup();
+        } else if (mode.equals("update")) {
+            IndexBuilder builder = new IndexBuilder(code_path, index_path);
+            builder.startUpdate(new HashSet<>(Arrays.asList(args).subList(3, arg_len)));
         } else {
-            throw new IllegalArgumentException("Usage for mode: single or group" + mode);
+            throw new IllegalArgumentException("Usage for mode: single, group or update" + mode);
         }
     }
 
@@ -72,6 +81,13 @@ public class IndexBuilder {
      * Parse the source code info from json file
      */
     protected void ParseSourceCodeInfo(Path file_path){
+        ParseSourceCodeInfo(file_path, null);
+    }
+
+    /**
+     * Parse the source code info of the selected classes, all classes if null
+     */
+    protected void ParseSourceCodeInfo(Path file_path, Set<String> classes){
         JsonObject code_info;
         try{
             code_info = loadJson(file_path).getAsJsonObject();
@@ -83,6 +99,7 @@ public class IndexBuilder {
         JsonObject source_info = code_info.getAsJsonObject("source");
         for (Map.Entry<String, JsonElement> class_entry : source_info.entrySet()) {
             String class_fqn = class_entry.getKey();
+            if (classes != null && !classes.contains(class_fqn)) continue;
             JsonObject class_info = class_entry.getValue().getAsJsonObject();
             String file = class_info.get("file").getAsString();
             JsonObject methods = class_info.get("methods").getAsJsonObject();
@@ -126,6 +143,8 @@ public class IndexBuilder {
         
         // Add non-tokenized field (for exact match)
         document.add(new StoredField("class_fqn", class_fqn));
+        // indexed class name, so that the documents of a class can be replaced
+        document.add(new StringField("class_key", class_fqn, Field.Store.NO));
         document.add(new StoredField("signature", func_sig));
         document.add(new StoredField("file", file));
         document.add(new StoredField("start", start));
@@ -179,6 +198,43 @@ public class IndexBuilder {
         return;
     }
 
+    /**
+     * replace the documents of the changed classes in an existing index, classes without code info are removed;
+     * an index built without class keys is rebuilt
+     */
+    public void startUpdate(Set<String> classes) {
+        try {
+            if (!Files.exists(index_path) || !hasClassKeys()) {
+                System.out.println("Rebuild index without class keys: " + index_path);
+                startSingle(code_info_path, index_path);
+                return;
+            }
+            this.analyzer = new StandardAnalyzer();
+            IndexWriterConfig config = new IndexWriterConfig(analyzer);
+            config.setOpenMode(OpenMode.CREATE_OR_APPEND);
+            this.directory = FSDirectory.open(index_path);
+            this.index_writer = new IndexWriter(directory, config);
+            for (String class_fqn : classes) {
+                index_writer.deleteDocuments(new Term("class_key", class_fqn));
+            }
+            ParseSourceCodeInfo(code_info_path, classes);
+            close();
+        } catch (IOException e) {
+            System.out.println("Failed while update index: " + index_path);
+            System.out.println(e.getMessage());
+        }
+        return;
+    }
+
+    private boolean hasClassKeys() throws IOException {
+        try (Directory dir = FSDirectory.open(index_path)) {
+            if (!DirectoryReader.indexExists(dir)) return false;
+            try (DirectoryReader reader = DirectoryReader.open(dir)) {
+                return reader.numDocs() == 0 || MultiTerms.getTerms(reader, "class_key") != null;
+            }
+        }
+    }
+
     public void startGroup() {
         try {
             Files.list(code_info_path).forEach(file_path -> {
@@ -9,6 +9,8 @@ import java.io.IOException;
 import java.nio.file.Files;
 import java.nio.file.Path;
 import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.List;
 
 public class PreProcessor {
     public static void main(String[] args) {
@@ -90,6 +92,37 @@ public class PreProcessor {
         return;
     }
 
+    /**
+     * extract code info and control flow graphs of the given files (relative to the project) only,
+     * used for incremental indexing, deleted files should not be given.
+     * return: {"source": {...}, "test": {...}, "import_dict": {...}, "controlflow": {...}}
+     */
+    public static String extractFiles(String project, String[] files) throws IOException {
+        Path project_dir = Paths.get(project);
+        Path source_folder = project_dir.resolve("src/main/java");
+        Path test_folder = project_dir.resolve("src/test-original/java");
+        Path jar_folder = project_dir.resolve("libs");
+        List<Path> file_paths = new ArrayList<>();
+        List<String> source_files = new ArrayList<>();
+        for (String file : files) {
+            Path file_path = project_dir.resolve(file);
+            file_paths.add(file_path);
+            if (file_path.startsWith(source_folder)) source_files.add(file_path.toString());
+        }
+        CodeInfoExtractor codeInfoExtractor = new CodeInfoExtractor();
+        JsonObject[] codeInfo = codeInfoExtractor.processFiles(source_folder, test_folder, jar_folder, file_paths);
+        JsonObject result = new JsonObject();
+        result.add("source", codeInfo[0]);
+        result.add("test", codeInfo[1]);
+        result.add("import_dict", codeInfo[2]);
+        JsonObject graph_data = new JsonObject();
+        if (!source_files.isEmpty()) {
+            graph_data = new ControlFlowGraphBuilder(source_files).buildGraph4Project();
+        }
+        result.add("controlflow", graph_data);
+        return new Gson().toJson(result);
+    }
+
     private void buildControlflowFlowGraph(Path project_dir, Path cfg_path){
         String source_path = project_dir.resolve("src/main/java").toString();
         ControlFlowGraphBuilder cfgBuilder = new ControlFlowGraphBuilder(source_path);
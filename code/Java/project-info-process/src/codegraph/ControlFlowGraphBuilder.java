@@ -34,6 +34,19 @@ public class ControlFlowGraphBuilder {
         this.gson = new Gson();
     }
 
+    /**
+     * build the model of the given source files only, e.g. the files changed since the last indexing
+     */
+    public ControlFlowGraphBuilder(List<String> source_files) {
+        Launcher launcher = new Launcher();
+        launcher.getEnvironment().setNoClasspath(true);
+        for (String file : source_files) {
+            launcher.addInputResource(file);
+        }
+        model = launcher.buildModel();
+        this.gson = new Gson();
+    }
+
     class Edge {
         int source;
         int target;
@@ -0,0 +1,159 @@
+package execute;
+
+import java.io.File;
+import java.io.IOException;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.Locale;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ConcurrentLinkedQueue;
+import java.util.regex.Matcher;
+import java.util.regex.Pattern;
+
+import javax.tools.Diagnostic;
+import javax.tools.DiagnosticCollector;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.StandardLocation;
+import javax.tools.ToolProvider;
+
+import com.google.gson.JsonArray;
+import com.google.gson.JsonObject;
+
+/**
+ * Compile test classes with javax.tools.JavaCompiler inside the running JVM.
+ * One service per project: the classpath in dependencies.txt is parsed once and shared.
+ * Each compilation borrows its own file manager from a pool, so workers compile concurrently
+ * and a returned file manager keeps its opened jars for the next compilation.
+ */
+public class CompileService {
+    private static final Map<String, CompileService> services = new ConcurrentHashMap<>();
+    private static final Pattern symbol_pattern = Pattern.compile("symbol:\\s+(\\w+) (.*)");
+
+    private final Path project_path;
+    private final JavaCompiler compiler;
+    private final List<File> classpath;
+    private final ConcurrentLinkedQueue<StandardJavaFileManager> file_managers = new ConcurrentLinkedQueue<>();
+    private final List<String> options;
+    private final File default_output;
+
+    public static CompileService forProject(String project) throws IOException {
+        Path path = Path.of(project).toAbsolutePath().normalize();
+        CompileService service = services.get(path.toString());
+        if (service == null) {
+            synchronized (services) {
+                service = services.get(path.toString());
+                if (service == null) {
+                    service = new CompileService(path);
+                    services.put(path.toString(), service);
+                }
+            }
+        }
+        return service;
+    }
+
+    /**
+     * drop the cached service, e.g. after dependencies of the project are changed
+     */
+    public static void invalidate(String project) throws IOException {
+        Path path = Path.of(project).toAbsolutePath().normalize();
+        CompileService service = services.remove(path.toString());
+        if (service != null) service.close();
+    }
+
+    private CompileService(Path project) throws IOException {
+        compiler = ToolProvider.getSystemJavaCompiler();
+        if (compiler == null) {
+            throw new IllegalStateException("No system java compiler, the JVM should be started from a JDK.");
+        }
+        project_path = project;
+        classpath = List.copyOf(parseClasspath(project.resolve("dependencies.txt")));
+        default_output = project.resolve("target/test-classes").toFile();
+        options = List.of("-encoding", "UTF-8", "-Xlint:none");
+    }
+
+    private StandardJavaFileManager borrowFileManager() throws IOException {
+        StandardJavaFileManager file_manager = file_managers.poll();
+        if (file_manager == null) {
+            file_manager = compiler.getStandardFileManager(null, Locale.ENGLISH, StandardCharsets.UTF_8);
+            file_manager.setLocation(StandardLocation.CLASS_PATH, classpath);
+        }
+        return file_manager;
+    }
+
+    private void close() throws IOException {
+        StandardJavaFileManager file_manager;
+        while ((file_manager = file_managers.poll()) != null) file_manager.close();
+    }
+
+    private List<File> parseClasspath(Path dependency_file) throws IOException {
+        List<File> classpath = new ArrayList<>();
+        if (!Files.exists(dependency_file)) return classpath;
+        String content = Files.readString(dependency_file, StandardCharsets.UTF_8).trim();
+        for (String entry : content.split(";|" + Pattern.quote(File.pathSeparator))) {
+            entry = entry.trim();
+            if (entry.isEmpty()) continue;
+            if (entry.endsWith("/*")) {
+                File[] jars = project_path.resolve(entry.substring(0, entry.length() - 2)).toFile().listFiles();
+                if (jars == null) continue;
+                for (File jar : jars) {
+                    if (jar.getName().endsWith(".jar")) classpath.add(jar);
+                }
+            } else {
+                classpath.add(project_path.resolve(entry).toFile());
+            }
+        }
+        return classpath;
+    }
+
+    /**
+     * compile one source file of the project (path relative to the project root)
+     * return: {"success": boolean, "diagnostics": [{"kind", "line", "column", "code", "message", "symbol"}]}
+     */
+    public String compile(String class_path) throws IOException {
+        return compile(class_path, null);
+    }
+
+    /**
+     * compile into another class output directory (relative to the project root), e.g. the workspace of a worker;
+     * classes of the project and libraries are shared, the output directory is not on the classpath
+     */
+    public String compile(String class_path, String output_dir) throws IOException {
+        File output = output_dir == null ? default_output : project_path.resolve(output_dir).toFile();
+        output.mkdirs();
+        DiagnosticCollector<JavaFileObject> collector = new DiagnosticCollector<>();
+        File source = project_path.resolve(class_path).toFile();
+        StandardJavaFileManager file_manager = borrowFileManager();
+        boolean success;
+        try {
+            file_manager.setLocation(StandardLocation.CLASS_OUTPUT, List.of(output));
+            Iterable<? extends JavaFileObject> units = file_manager.getJavaFileObjects(source);
+            success = compiler.getTask(null, file_manager, collector, options, null, units).call();
+        } finally {
+            file_managers.offer(file_manager);
+        }
+
+        JsonArray diagnostics = new JsonArray();
+        for (Diagnostic<? extends JavaFileObject> diagnostic : collector.getDiagnostics()) {
+            JsonObject item = new JsonObject();
+            String message = diagnostic.getMessage(Locale.ENGLISH);
+            item.addProperty("kind", diagnostic.getKind().toString().toLowerCase(Locale.ROOT));
+            item.addProperty("line", diagnostic.getLineNumber());
+            item.addProperty("column", diagnostic.getColumnNumber());
+            item.addProperty("code", diagnostic.getCode());
+            item.addProperty("message", message);
+            Matcher matcher = symbol_pattern.matcher(message);
+            if (matcher.find()) item.addProperty("symbol", matcher.group(2).trim());
+            diagnostics.add(item);
+        }
+        JsonObject result = new JsonObject();
+        result.addProperty("success", success);
+        result.add("diagnostics", diagnostics);
+        return result.toString();
+    }
+}
@@ -0,0 +1,77 @@
+package execute;
+
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.lang.reflect.Method;
+
+import org.junit.platform.engine.TestExecutionResult;
+import org.junit.platform.launcher.TestExecutionListener;
+import org.junit.platform.launcher.TestIdentifier;
+import org.junit.platform.launcher.TestPlan;
+
+/**
+ * Write one JaCoCo session per test into an execution data file.
+ * The session id of a test is its unique id; data recorded between tests (class initialization,
+ * before/after all methods) is written as a "[setup]" session.
+ * The JaCoCo agent (output=none) is accessed through reflection, so that the class has no compile dependency on it.
+ */
+public class CoverageSessionListener implements TestExecutionListener {
+    public static final String SETUP_PREFIX = "[setup]";
+
+    private final Object agent;
+    private final Method set_session_id;
+    private final Method get_execution_data;
+    private final OutputStream output;
+    private int setup_count = 0;
+
+    public CoverageSessionListener(String exec_file) throws Exception {
+        Class<?> rt = Class.forName("org.jacoco.agent.rt.RT");
+        agent = rt.getMethod("getAgent").invoke(null);
+        Class<?> agent_type = Class.forName("org.jacoco.agent.rt.IAgent");
+        set_session_id = agent_type.getMethod("setSessionId", String.class);
+        get_execution_data = agent_type.getMethod("getExecutionData", boolean.class);
+        output = new FileOutputStream(exec_file, false);
+    }
+
+    private synchronized void dump(String session_id) {
+        try {
+            set_session_id.invoke(agent, session_id);
+            byte[] data = (byte[]) get_execution_data.invoke(agent, true);
+            output.write(data);
+            output.flush();
+        } catch (Exception e) {
+            throw new IllegalStateException("Failed to dump coverage session " + session_id, e);
+        }
+    }
+
+    @Override
+    public void testPlanExecutionStarted(TestPlan plan) {
+        // drop the data of previous runs in this JVM
+        try {
+            get_execution_data.invoke(agent, true);
+        } catch (Exception e) {
+            throw new IllegalStateException("Failed to reset coverage data", e);
+        }
+    }
+
+    @Override
+    public void executionStarted(TestIdentifier identifier) {
+        if (identifier.isTest()) dump(SETUP_PREFIX + (setup_count++));
+    }
+
+    @Override
+    public void executionFinished(TestIdentifier identifier, TestExecutionResult result) {
+        if (identifier.isTest()) dump(identifier.getUniqueId());
+    }
+
+    @Override
+    public void testPlanExecutionFinished(TestPlan plan) {
+        dump(SETUP_PREFIX + (setup_count++));
+        try {
+            output.close();
+        } catch (IOException e) {
+            throw new IllegalStateException("Failed to close coverage file", e);
+        }
+    }
+}
@@ -0,0 +1,308 @@
+package execute;
+
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Path;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.TimeoutException;
+
+import org.junit.platform.engine.DiscoverySelector;
+import org.junit.platform.engine.TestExecutionResult;
+import org.junit.platform.engine.support.descriptor.MethodSource;
+import org.junit.platform.launcher.Launcher;
+import org.junit.platform.launcher.LauncherDiscoveryRequest;
+import org.junit.platform.launcher.TestExecutionListener;
+import org.junit.platform.launcher.TestIdentifier;
+import org.junit.platform.launcher.core.LauncherDiscoveryRequestBuilder;
+import org.junit.platform.launcher.core.LauncherFactory;
+
+import static org.junit.platform.engine.discovery.DiscoverySelectors.selectClass;
+import static org.junit.platform.engine.discovery.DiscoverySelectors.selectMethod;
+
+import com.google.gson.JsonArray;
+import com.google.gson.JsonElement;
+import com.google.gson.JsonObject;
+import com.google.gson.JsonParser;
+
+/**
+ * A reusable JVM that runs JUnit Platform tests on requests from stdin.
+ * request (one json per line): {"project", "classpath": [...], "classes": [...], "methods": [...], "timeout": seconds,
+ *                               "coverage_file": optional, write a JaCoCo session per test (the JVM needs the JaCoCo agent)}
+ * response (one json per line): {"status": "completed"|"timeout"|"error", "summary", "tests": [tree], "output"}
+ * The launcher is created once; test classes are loaded by a fresh class loader in every run.
+ * After a timeout the worker exits, since the running test can't be stopped safely.
+ */
+public class TestLauncherWorker {
+    // loaded by the worker, so that the engine and the tests see the same annotations
+    private static final String[] SHARED_PREFIXES = {
+        "java.", "javax.", "jdk.", "sun.", "com.sun.",
+        "org.junit.", "org.opentest4j.", "org.apiguardian.", "execute."
+    };
+    private static final int MAX_TRACE_LINES = 20;
+
+    private final Launcher launcher;
+    private final PrintStream system_out;
+    private final PrintStream system_err;
+    private final ExecutorService executor;
+
+    public static void main(String[] args) throws Exception {
+        // responses go to the real stdout, output of tests is captured per run
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, StandardCharsets.UTF_8);
+        TestLauncherWorker worker = new TestLauncherWorker();
+        BufferedReader reader = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = reader.readLine()) != null) {
+            if (line.isBlank()) continue;
+            JsonObject response;
+            boolean timeout = false;
+            try {
+                response = worker.handle(JsonParser.parseString(line).getAsJsonObject());
+                timeout = response.get("status").getAsString().equals("timeout");
+            } catch (Exception e) {
+                response = new JsonObject();
+                response.addProperty("status", "error");
+                response.addProperty("output", stackTrace(e));
+            }
+            out.println(response.toString());
+            out.flush();
+            if (timeout) System.exit(2);
+        }
+        worker.executor.shutdownNow();
+    }
+
+    public TestLauncherWorker() {
+        launcher = LauncherFactory.create();
+        system_out = System.out;
+        system_err = System.err;
+        executor = Executors.newSingleThreadExecutor(runnable -> {
+            Thread thread = new Thread(runnable, "test-runner");
+            thread.setDaemon(true);
+            return thread;
+        });
+    }
+
+    public JsonObject handle(JsonObject request) throws Exception {
+        Path project = Path.of(request.get("project").getAsString());
+        List<URL> urls = new ArrayList<>();
+        for (JsonElement entry : request.getAsJsonArray("classpath")) {
+            urls.addAll(resolveClasspath(project, entry.getAsString()));
+        }
+        List<DiscoverySelector> selectors = new ArrayList<>();
+        if (request.has("classes")) {
+            for (JsonElement name : request.getAsJsonArray("classes")) selectors.add(selectClass(name.getAsString()));
+        }
+        if (request.has("methods")) {
+            for (JsonElement name : request.getAsJsonArray("methods")) selectors.add(selectMethod(name.getAsString()));
+        }
+        long timeout = request.has("timeout") ? request.get("timeout").getAsLong() : 600;
+
+        ResultTreeListener listener = new ResultTreeListener();
+        List<TestExecutionListener> listeners = new ArrayList<>(List.of(listener));
+        if (request.has("coverage_file")) {
+            listeners.add(new CoverageSessionListener(request.get("coverage_file").getAsString()));
+        }
+        ByteArrayOutputStream captured = new ByteArrayOutputStream();
+        PrintStream capture = new PrintStream(captured, true, StandardCharsets.UTF_8);
+        IsolatedClassLoader loader = new IsolatedClassLoader(urls.toArray(new URL[0]), getClass().getClassLoader());
+        String status = "completed";
+        System.setOut(capture);
+        System.setErr(capture);
+        try {
+            Future<?> run = executor.submit(() -> {
+                Thread.currentThread().setContextClassLoader(loader);
+                try {
+                    LauncherDiscoveryRequest discovery = LauncherDiscoveryRequestBuilder.request().selectors(selectors).build();
+                    launcher.execute(discovery, listeners.toArray(new TestExecutionListener[0]));
+                } finally {
+                    Thread.currentThread().setContextClassLoader(null);
+                }
+            });
+            try {
+                run.get(timeout, TimeUnit.SECONDS);
+            } catch (TimeoutException e) {
+                status = "timeout";
+            }
+        } finally {
+            System.setOut(system_out);
+            System.setErr(system_err);
+            if (!status.equals("timeout")) loader.close();
+        }
+        JsonObject response = new JsonObject();
+        response.addProperty("status", status);
+        response.add("summary", listener.summary());
+        response.add("tests", listener.tree());
+        response.addProperty("output", captured.toString(StandardCharsets.UTF_8));
+        return response;
+    }
+
+    private static List<URL> resolveClasspath(Path project, String entry) throws Exception {
+        List<URL> urls = new ArrayList<>();
+        if (entry.endsWith("/*")) {
+            File[] jars = project.resolve(entry.substring(0, entry.length() - 2)).toFile().listFiles();
+            if (jars == null) return urls;
+            for (File jar : jars) {
+                if (jar.getName().endsWith(".jar")) urls.add(jar.toURI().toURL());
+            }
+        } else {
+            urls.add(project.resolve(entry).toFile().toURI().toURL());
+        }
+        return urls;
+    }
+
+    static String stackTrace(Throwable throwable) {
+        StringWriter writer = new StringWriter();
+        throwable.printStackTrace(new PrintWriter(writer));
+        String[] lines = writer.toString().split("\n");
+        if (lines.length <= MAX_TRACE_LINES) return writer.toString();
+        return String.join("\n", Arrays.copyOf(lines, MAX_TRACE_LINES)) + "\n\t...";
+    }
+
+    /**
+     * child-first class loader for the classes of the project under test
+     */
+    static class IsolatedClassLoader extends URLClassLoader {
+        IsolatedClassLoader(URL[] urls, ClassLoader parent) {
+            super(urls, parent);
+        }
+
+        @Override
+        protected Class<?> loadClass(String name, boolean resolve) throws ClassNotFoundException {
+            for (String prefix : SHARED_PREFIXES) {
+                if (name.startsWith(prefix)) return super.loadClass(name, resolve);
+            }
+            synchronized (getClassLoadingLock(name)) {
+                Class<?> loaded = findLoadedClass(name);
+                if (loaded == null) {
+                    try {
+                        loaded = findClass(name);
+                    } catch (ClassNotFoundException e) {
+                        return super.loadClass(name, resolve);
+                    }
+                }
+                if (resolve) resolveClass(loaded);
+                return loaded;
+            }
+        }
+    }
+
+    /**
+     * collect status, duration and exception of every test, tests that never finish stay "RUNNING"
+     */
+    static class ResultTreeListener implements TestExecutionListener {
+        private final Map<String, JsonObject> nodes = new LinkedHashMap<>();
+        private final Map<String, String> parents = new LinkedHashMap<>();
+        private final Map<String, Long> starts = new LinkedHashMap<>();
+
+        private synchronized JsonObject node(TestIdentifier identifier) {
+            String id = identifier.getUniqueId();
+            if (!nodes.containsKey(id)) {
+                JsonObject node = new JsonObject();
+                node.addProperty("id", id);
+                node.addProperty("name", identifier.getDisplayName());
+                node.addProperty("type", identifier.isTest() ? "test" : "container");
+                identifier.getSource().ifPresent(source -> {
+                    if (source instanceof MethodSource) {
+                        node.addProperty("class", ((MethodSource) source).getClassName());
+                        node.addProperty("method", ((MethodSource) source).getMethodName());
+                    }
+                });
+                nodes.put(id, node);
+                parents.put(id, identifier.getParentId().orElse(null));
+            }
+            return nodes.get(id);
+        }
+
+        @Override
+        public void executionStarted(TestIdentifier identifier) {
+            JsonObject node = node(identifier);
+            synchronized (this) {
+                node.addProperty("status", "RUNNING");
+                starts.put(identifier.getUniqueId(), System.nanoTime());
+            }
+        }
+
+        @Override
+        public void executionSkipped(TestIdentifier identifier, String reason) {
+            JsonObject node = node(identifier);
+            synchronized (this) {
+                node.addProperty("status", "SKIPPED");
+                node.addProperty("reason", reason);
+            }
+        }
+
+        @Override
+        public void executionFinished(TestIdentifier identifier, TestExecutionResult result) {
+            JsonObject node = node(identifier);
+            synchronized (this) {
+                node.addProperty("status", result.getStatus().name());
+                Long start = starts.get(identifier.getUniqueId());
+                if (start != null) node.addProperty("duration_ms", (System.nanoTime() - start) / 1_000_000);
+                result.getThrowable().ifPresent(throwable -> {
+                    JsonObject exception = new JsonObject();
+                    exception.addProperty("type", throwable.getClass().getName());
+                    exception.addProperty("message", String.valueOf(throwable.getMessage()));
+                    exception.addProperty("trace", stackTrace(throwable));
+                    node.add("exception", exception);
+                });
+            }
+        }
+
+        public synchronized JsonObject summary() {
+            int found = 0, started = 0, successful = 0, failed = 0, aborted = 0, skipped = 0;
+            for (JsonObject node : nodes.values()) {
+                if (!node.get("type").getAsString().equals("test")) continue;
+                found++;
+                String status = node.has("status") ? node.get("status").getAsString() : "";
+                if (!status.equals("SKIPPED") && !status.isEmpty()) started++;
+                switch (status) {
+                    case "SUCCESSFUL": successful++; break;
+                    case "FAILED": failed++; break;
+                    case "ABORTED": aborted++; break;
+                    case "SKIPPED": skipped++; break;
+                    default: break;
+                }
+            }
+            JsonObject summary = new JsonObject();
+            summary.addProperty("found", found);
+            summary.addProperty("started", started);
+            summary.addProperty("successful", successful);
+            summary.addProperty("failed", failed);
+            summary.addProperty("aborted", aborted);
+            summary.addProperty("skipped", skipped);
+            return summary;
+        }
+
+        public synchronized JsonArray tree() {
+            JsonArray roots = new JsonArray();
+            for (Map.Entry<String, JsonObject> entry : nodes.entrySet()) {
+                String parent = parents.get(entry.getKey());
+                JsonObject parent_node = parent == null ? null : nodes.get(parent);
+                if (parent_node == null) {
+                    roots.add(entry.getValue());
+                } else {
+                    if (!parent_node.has("children")) parent_node.add("children", new JsonArray());
+                    parent_node.getAsJsonArray("children").add(entry.getValue());
+                }
+            }
+            return roots;
+        }
+    }
+}
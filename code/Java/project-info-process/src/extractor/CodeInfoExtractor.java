@@ -322,10 +322,11 @@ public class CodeInfoExtractor extends JavaParserExtractor implements BaseImport
         return codeInfo;
     }
 
-    public JsonObject[] processProject(Path source_dir, Path test_dir, Path jar_folder) throws IOException {
-        // set type solver
+    private void setTypeSolvers(Path source_dir, Path jar_folder) throws IOException {
         JavaParserTypeSolver source_solver = new JavaParserTypeSolver(source_dir);
         addTypeSolver(source_solver);
+        if (!Files.exists(jar_folder))
+            return;
         Files.walk(jar_folder)
                 .filter(Files::isRegularFile)
                 .filter(JavaParserExtractor::isJarFile).forEach(file -> {
@@ -336,6 +337,11 @@ public class CodeInfoExtractor extends JavaParserExtractor implements BaseImport
                         System.out.println("Error: " + e.getMessage());
                     }
                 });
+    }
+
+    public JsonObject[] processProject(Path source_dir, Path test_dir, Path jar_folder) throws IOException {
+        // set type solver
+        setTypeSolvers(source_dir, jar_folder);
         // get information from source files
         JsonObject source_json = new JsonObject();
         Files.walk(source_dir)
@@ -373,4 +379,26 @@ public class CodeInfoExtractor extends JavaParserExtractor implements BaseImport
         JsonObject import_dict_json = constructImportDict();
         return new JsonObject[] { source_json, test_json, import_dict_json };
     }
+
+    /**
+     * extract the classes of the given source or test files only, types are still resolved in the whole project;
+     * the import dictionary covers the given files
+     */
+    public JsonObject[] processFiles(Path source_dir, Path test_dir, Path jar_folder, List<Path> files) throws IOException {
+        setTypeSolvers(source_dir, jar_folder);
+        if (Files.exists(test_dir))
+            addTypeSolver(new JavaParserTypeSolver(test_dir));
+        JsonObject source_json = new JsonObject();
+        JsonObject test_json = new JsonObject();
+        for (Path file : files) {
+            boolean is_test = file.startsWith(test_dir);
+            JsonObject classInfo = extractCodeInfo(file, is_test ? test_dir : source_dir);
+            if (classInfo == null)
+                continue;
+            JsonObject target = is_test ? test_json : source_json;
+            classInfo.entrySet().forEach(entry -> target.add(entry.getKey(), entry.getValue()));
+        }
+        JsonObject import_dict_json = constructImportDict();
+        return new JsonObject[] { source_json, test_json, import_dict_json };
+    }
 }
@@ -1,4 +1,5 @@
 import sys
+import jpype
 import logging
 import argparse
 
@@ -65,5 +66,8 @@ if __name__ == "__main__":
         logging.basicConfig(
             level=args.log_level, 
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # JaCoCo core (in jacococli.jar) is used for coverage analysis in JVM
+    jpype.startJVM(jpype.getDefaultJVMPath(), '-Xmx4g', f"-Djava.class.path=./Java/project-info-process.jar;{FS.DEPENDENCY_PATH}/jacococli.jar")
     run(args.operation)
+    jpype.shutdownJVM()
     
\ No newline at end of file
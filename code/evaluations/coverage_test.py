@@ -1,9 +1,14 @@
 import os
 import re
+import shutil
 import logging
+import itertools
+import threading
+import concurrent.futures
 
 import tools.io_utils as utils
-from tools.execute_test import JavaRunner, CoverageExtractor
+from tools.execute_test import JavaRunner, CoverageExtractor, TestLauncher
+from tools.coverage_engine import CoverageEngine
 from tools.code_analysis import JavaASTParser
 
 
@@ -12,69 +17,168 @@ class ProjectTestRunner(JavaRunner):
     testclass_path: str
     report_path: str
     test_result: dict
+    html_report: bool
+    coverage_engine: CoverageEngine|None
 
-    def __init__(self, project_info, dep_fd, tc_path, rpt_path):
+    def __init__(self, project_info, dep_fd, tc_path, rpt_path, html_report=False, workspace=None):
         self.project_info = project_info
         self.testclass_path = tc_path.replace("<project>",project_info["project-name"])
         self.report_path = rpt_path.replace("<project>",project_info["project-name"])
-        super().__init__(project_info["project-url"], dep_fd)
+        super().__init__(project_info["project-url"], dep_fd, workspace)
+        self.html_report = html_report
+        self.coverage_engine = CoverageEngine.for_project(project_info["project-url"])
         self.logger = logging.getLogger(__name__)
         return
 
+    def analyze_coverage(self, tobject, store=None) -> tuple|None:
+        """
+        coverage of the focal method in the jacoco.exec of the runner, or in the execution data store if given
+        """
+        class_name = CoverageEngine.vm_class_name(tobject["package"], tobject["class"])
+        if store is None:
+            exec_file = f"{self.cd_cmd[1]}/{self.exec_file}"
+            counters = self.coverage_engine.analyze(exec_file, [class_name.split("$")[0]])
+        else:
+            counters = self.coverage_engine.analyze_store(store, [class_name.split("$")[0]])
+        counter = CoverageEngine.find_method(counters, class_name, tobject["method-name"])
+        if counter is None:
+            self.logger.warning(f"method {tobject['method-name']} not found in coverage data of {class_name}")
+            return None
+        return CoverageEngine.coverage_score(counter)
+
+    def use_sessions(self) -> bool:
+        return self.coverage_engine is not None and self.coverage_launcher is not None and not self.html_report
+
+    def run_with_sessions(self, data_id, tobject, test_classes:list|None=None):
+        """
+        Run the test class (or the given test classes) once with a coverage session per test.
+        Coverage of all tests and of the passing tests is merged offline, the coverage of each test is kept for minimization.
+        return: False if the launcher worker failed (not the tests), the caller should run the ConsoleLauncher instead
+        """
+        exec_file = f"{self.cd_cmd[1]}/{os.path.dirname(self.exec_file)}/jacoco-sessions.exec"
+        if test_classes is None: test_classes = [tobject["test-class"]]
+        result = self.run_test_sessions(test_classes, exec_file)
+        if result is None or result["status"] == "error":
+            self.logger.warning(f"test launcher worker failed, run ConsoleLauncher instead: {result['output'] if result else ''}")
+            if os.path.exists(exec_file): os.remove(exec_file)
+            return False
+        summary = result.get("summary", {})
+        if result["status"] != "completed" or summary.get("started", 0) == 0:
+            self.test_result[data_id]["error_type"] = "execution error"
+            return True
+        self.test_result[data_id].update({"test_cases": summary["started"], "passed_cases": summary["successful"]})
+        sessions = self.coverage_engine.read_sessions(exec_file)
+        tests = list(TestLauncher.iter_tests(result["tests"]))
+        setup = [sid for sid in sessions if sid.startswith("[setup]")]
+        passed = [test["id"] for test in tests if test.get("status") == "SUCCESSFUL"]
+        for prefix, session_ids in (("", list(sessions.keys())), ("correct_", setup + passed)):
+            if prefix and len(passed) == 0:
+                self.test_result[data_id].update({"correct_inst_cov": 0.0, "correct_bran_cov": 0.0})
+                continue
+            cov_score = self.analyze_coverage(tobject, self.coverage_engine.merge_sessions(sessions, session_ids))
+            if cov_score is not None:
+                self.test_result[data_id].update({f"{prefix}inst_cov": cov_score[0], f"{prefix}bran_cov": cov_score[1]})
+        case_coverage = {}
+        for test in tests:
+            if test["id"] not in sessions: continue
+            cov_score = self.analyze_coverage(tobject, sessions[test["id"]])
+            if cov_score is not None:
+                case_coverage[test.get("method", test["name"])] = list(cov_score)
+        self.test_result[data_id]["case_coverage"] = case_coverage
+        os.remove(exec_file)
+        return True
+
+    def collect_coverage(self, data_id, tobject, correct=False):
+        """
+        coverage of the focal method from the jacoco.exec of the runner, analyzed in JVM if possible.
+        The HTML/CSV report is generated when required or when JaCoCo is not available in JVM.
+        return: False if the report is required but failed
+        """
+        testid = tobject["id"]
+        suffix = "_correct" if correct else ""
+        flag = True
+        if self.coverage_engine is not None:
+            cov_score = self.analyze_coverage(tobject)
+            if cov_score is not None:
+                prefix = "correct_" if correct else ""
+                self.test_result[data_id].update({f"{prefix}inst_cov": cov_score[0], f"{prefix}bran_cov": cov_score[1]})
+        if self.coverage_engine is None or self.html_report:
+            html_report = f"{self.report_path}/jacoco-report-html/{testid}{suffix}/"
+            csv_report = f"{self.report_path}/jacoco-report-csv/{testid}{suffix}.csv"
+            flag = self.generate_report_single(html_report, csv_report) or self.coverage_engine is not None
+        self.delete_jacoco_exec()
+        return flag
+
     def run_project_test(self, compile=True):
         project_name = self.project_info["project-name"]
-        project_url = self.project_info["project-url"]
         test_objects = self.project_info["focal-methods"]
         self.test_result = {}
 
         self.logger.info(f"Running tests for project: {project_name}")
         for tobject in test_objects:
-            test_class = tobject["test-class"]
-            test_path = tobject["test-path"]
-            testid = tobject["id"]
-            method = tobject["method-name"]
-            class_path = f"{self.testclass_path}/{test_path.split('/')[-1]}"
-            data_id = f"{tobject['class']}#{method}"
-            self.test_result[data_id] = {}
-            try:
-                utils.copy_file(class_path, f"{project_url}/{test_path}")
-            except FileNotFoundError:
-                self.test_result[data_id].update({
-                    "error_type": "compile error",
-                    "test_cases": 0,
-                    "passed_cases": 0,
-                    "note": "test class not found"
-                })
-                continue
-
-            if compile:
-                cflag, _ = self.compile_test(test_path)
-                if not cflag:
-                    self.test_result[data_id]["error_type"] = "compile error"
-                    continue
-            eflag, feedback = self.run_singal_unit_test(test_class)
-            if eflag:
-                passed_test = self.deal_execution_feedback(data_id, feedback)
-            else:
-                self.test_result[data_id]["error_type"] = "execution error"
-                continue
-            html_report = f"{self.report_path}/jacoco-report-html/{testid}/"
-            csv_report = f"{self.report_path}/jacoco-report-csv/{testid}.csv"
-            if not self.generate_report_single(html_report, csv_report):
-                self.test_result[data_id]["error_type"] = "report error"
-                continue
-            self.delete_jacoco_exec()
-            if len(passed_test)>0:
-                passed_test = [f"{test_class}#{method}" for method in passed_test]
-                if not self.run_selected_mehods(passed_test): continue
-                correct_html_report = f"{self.report_path}/jacoco-report-html/{testid}_correct/"
-                correct_csv_report = f"{self.report_path}/jacoco-report-csv/{testid}_correct.csv"
-                self.generate_report_single(correct_html_report, correct_csv_report)
-                self.delete_jacoco_exec()
-            else:
-                self.test_result[data_id].update({"correct_inst_cov": 0.0, "correct_bran_cov": 0.0})
+            self.run_focal_method(tobject, compile)
         return self.test_result
 
+    def run_focal_method(self, tobject, compile=True) -> tuple[str, dict]:
+        """
+        test the generated class of one focal method, return (data id, test result)
+        """
+        project_url = self.project_info["project-url"]
+        test_class = tobject["test-class"]
+        test_path = tobject["test-path"]
+        method = tobject["method-name"]
+        class_path = f"{self.testclass_path}/{test_path.split('/')[-1]}"
+        source_path = self.test_source_path(test_path)
+        data_id = f"{tobject['class']}#{method}"
+        if self.test_result is None: self.test_result = {}
+        self.test_result[data_id] = {}
+        try:
+            utils.copy_file(class_path, f"{project_url}/{source_path}")
+        except FileNotFoundError:
+            self.test_result[data_id].update({
+                "error_type": "compile error",
+                "test_cases": 0,
+                "passed_cases": 0,
+                "note": "test class not found"
+            })
+            return data_id, self.test_result[data_id]
+
+        if compile:
+            cflag, _ = self.compile_test(source_path)
+            if not cflag:
+                self.test_result[data_id]["error_type"] = "compile error"
+                self.count_failed_cases(data_id, source_path)
+                return data_id, self.test_result[data_id]
+        if self.use_sessions() and self.run_with_sessions(data_id, tobject):
+            self.count_failed_cases(data_id, source_path)
+            return data_id, self.test_result[data_id]
+        eflag, feedback = self.run_singal_unit_test(test_class)
+        if eflag:
+            passed_test = self.deal_execution_feedback(data_id, feedback)
+        else:
+            self.test_result[data_id]["error_type"] = "execution error"
+            self.count_failed_cases(data_id, source_path)
+            return data_id, self.test_result[data_id]
+        if not self.collect_coverage(data_id, tobject):
+            self.test_result[data_id]["error_type"] = "report error"
+            return data_id, self.test_result[data_id]
+        if len(passed_test)>0:
+            passed_test = [f"{test_class}#{method}" for method in passed_test]
+            if self.run_selected_mehods(passed_test):
+                self.collect_coverage(data_id, tobject, correct=True)
+        else:
+            self.test_result[data_id].update({"correct_inst_cov": 0.0, "correct_bran_cov": 0.0})
+        return data_id, self.test_result[data_id]
+
+    def count_failed_cases(self, data_id, source_path):
+        # the calculator counts test cases of failed classes in the project directory, a workspace copy is counted here
+        if not self.workspace or "error_type" not in self.test_result[data_id]: return
+        if "test_cases" in self.test_result[data_id]: return
+        parser = JavaASTParser()
+        parser.parse(utils.load_text(f"{self.project_info['project-url']}/{source_path}"))
+        self.test_result[data_id].update({"test_cases": len(parser.get_test_cases()), "passed_cases": 0})
+        return
+
     def deal_execution_feedback(self, data_id, feedback):
         cases = 0
         passed = 0
@@ -152,25 +256,26 @@ class CoverageCalculator(CoverageExtractor):
             else:
                 package = test["package"]
                 classname = test["class"].split(".")[-1]
-                html_path = f"{self.report_path}/jacoco-report-html/{testid}/{package}/{classname}.html"
-                cov_score = self.extract_single_coverage(html_path, method)
-                data_id = f"{test['class']}#{method}"
-                if cov_score: 
-                    summary[data_id].update({"inst_cov": cov_score[0], "bran_cov": cov_score[1]})
-                else: 
-                    summary[data_id].update({"inst_cov": "<missing>", "bran_cov": "<missing>"})
+                # coverage analyzed in JVM is already in the test result
+                if "inst_cov" not in summary[data_id]:
+                    html_path = f"{self.report_path}/jacoco-report-html/{testid}/{package}/{classname}.html"
+                    cov_score = self.extract_single_coverage(html_path, method)
+                    if cov_score: 
+                        summary[data_id].update({"inst_cov": cov_score[0], "bran_cov": cov_score[1]})
+                    else: 
+                        summary[data_id].update({"inst_cov": "<missing>", "bran_cov": "<missing>"})
                 if "correct_inst_cov" not in summary[data_id]:
                     html_path = f"{self.report_path}/jacoco-report-html/{testid}_correct/{package}/{classname}.html"
                     cov_score = self.extract_single_coverage(html_path, method)
                     if cov_score:
                         summary[data_id].update({"correct_inst_cov": cov_score[0], "correct_bran_cov": cov_score[1]})
-                        if filter:
-                            inst_cov = summary[data_id]["inst_cov"]
-                            bran_cov = summary[data_id]["bran_cov"]
-                            if inst_cov>0 and cov_score[0]==inst_cov and cov_score[1]==bran_cov:
-                                summary[data_id]["passed_cases"] = summary[data_id]["test_cases"]
                     else:
                         summary[data_id].update({"correct_inst_cov": "<missing>", "correct_bran_cov": "<missing>"})
+                if filter and "<missing>" not in (summary[data_id]["inst_cov"], summary[data_id]["correct_inst_cov"]):
+                    inst_cov = summary[data_id]["inst_cov"]
+                    bran_cov = summary[data_id]["bran_cov"]
+                    if inst_cov>0 and summary[data_id]["correct_inst_cov"]==inst_cov and summary[data_id]["correct_bran_cov"]==bran_cov:
+                        summary[data_id]["passed_cases"] = summary[data_id]["test_cases"]
         self.count_general_metrics(summary)
         return summary
 
@@ -183,12 +288,16 @@ class CoverageCalculator(CoverageExtractor):
         bran_cov = 0.0
         correct_inst_cov = 0.0
         correct_bran_cov = 0.0
+        # methods without branches ("n/a" in the JaCoCo report) are left out of the branch coverage
+        bran_num = 0
 
         for _, item in summary.items():
             test_cases = item.get("test_cases", 0)
             passed_cases = item.get("passed_cases", 0)
+            has_branch = item.get("bran_cov", 0.0) is not None
             case_num += test_cases
             cov_num += 1
+            if has_branch: bran_num += 1
             if "error_type" in item:
                 error_type = self.error_type[item["error_type"]]
                 if error_type > 1:
@@ -200,17 +309,17 @@ class CoverageCalculator(CoverageExtractor):
                 pass_num += passed_cases
                 if "inst_cov" in item and item["inst_cov"] != "<missing>":
                     inst_cov += item["inst_cov"]
-                    bran_cov += item["bran_cov"]
+                    if has_branch: bran_cov += item["bran_cov"]
                 if "correct_inst_cov" in item and item["correct_inst_cov"] != "<missing>":
                     correct_inst_cov += item["correct_inst_cov"]
-                    correct_bran_cov += item["correct_bran_cov"]
+                    if has_branch and item["correct_bran_cov"] is not None: correct_bran_cov += item["correct_bran_cov"]
         summary.update({
             "compile_pass_rate": compile_num/case_num if case_num > 0 else 0,
             "execution_pass_rate": pass_num/case_num if case_num > 0 else 0,
             "average_instruction_coverage": inst_cov/cov_num if cov_num > 0 else 0.0,
-            "average_branch_coverage": bran_cov/cov_num if cov_num > 0 else 0.0,
+            "average_branch_coverage": bran_cov/bran_num if bran_num > 0 else 0.0,
             "average_correct_instruction_coverage": correct_inst_cov/cov_num if cov_num > 0 else 0.0,
-            "average_correct_branch_coverage": correct_bran_cov/cov_num if cov_num > 0 else 0.0,
+            "average_correct_branch_coverage": correct_bran_cov/bran_num if bran_num > 0 else 0.0,
         })
         return
 
@@ -228,6 +337,78 @@ class CoverageCalculator(CoverageExtractor):
         utils.write_json(result_file, exist_result)
 
 
+class EvaluationScheduler:
+    """
+    Test focal methods of all projects on a pool of workers, concurrently across and within projects.
+    Each worker has its own workspace in every project (test sources, test-classes, exec files) and
+    its own launcher processes; target/classes and libs of the project are shared read-only.
+    """
+    WORKSPACE_DIR = "target/eval-workers"
+    workers: int
+    compile: bool
+    local: threading.local
+    launchers: list
+
+    def __init__(self, dependency_dir, testclass_path, report_path, workers=4, html_report=False, compile=True):
+        self.dependency_dir = dependency_dir
+        self.testclass_path = testclass_path
+        self.report_path = report_path
+        self.workers = workers
+        self.html_report = html_report
+        self.compile = compile
+        self.local = threading.local()
+        self.launchers = []
+        self.slot_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _runner(self, info) -> ProjectTestRunner:
+        # runners are per worker thread and project, launchers are per worker thread
+        if not hasattr(self.local, "runners"):
+            with self.lock:
+                self.local.slot = next(self.slot_ids)
+            self.local.runners = {}
+            self.local.launchers = None
+        pj_name = info["project-name"]
+        if pj_name not in self.local.runners:
+            workspace = f"{self.WORKSPACE_DIR}/{self.local.slot}"
+            runner = ProjectTestRunner(info, self.dependency_dir, self.testclass_path, self.report_path, self.html_report, workspace)
+            if self.local.launchers is None:
+                self.local.launchers = (runner.launcher, runner.coverage_launcher)
+                with self.lock:
+                    self.launchers += [launcher for launcher in self.local.launchers if launcher is not None]
+            runner.use_launchers(*self.local.launchers)
+            self.local.runners[pj_name] = runner
+        return self.local.runners[pj_name]
+
+    def _run_task(self, info, tobject):
+        return self._runner(info).run_focal_method(tobject, self.compile)
+
+    def run(self, projects:dict) -> dict:
+        """
+        projects: {project name: project info}
+        return: {project name: test result}, results are ordered as the focal methods in the dataset
+        """
+        futures = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="eval") as pool:
+            for pj_name, info in projects.items():
+                for tobject in info["focal-methods"]:
+                    futures[(pj_name, f"{tobject['class']}#{tobject['method-name']}")] = pool.submit(self._run_task, info, tobject)
+            test_results = {pj_name: {} for pj_name in projects}
+            for (pj_name, data_id), future in futures.items():
+                try:
+                    _, result = future.result()
+                except Exception as e:
+                    self.logger.exception(f"error occured in testing {data_id} of {pj_name}: {e}")
+                    result = {"error_type": "execution error", "test_cases": 0, "passed_cases": 0, "note": str(e)}
+                test_results[pj_name][data_id] = result
+        for launcher in self.launchers:
+            launcher.close()
+        for info in projects.values():
+            shutil.rmtree(f"{info['project-url']}/{self.WORKSPACE_DIR}", ignore_errors=True)
+        return test_results
+
+
 def test_coverage(fstruct, task_setting, dataset_info: dict):
     root_path = os.getcwd().replace("\\", "/")
     dataset_dir = f"{root_path}/{fstruct.DATASET_PATH}"
@@ -243,13 +424,17 @@ def test_coverage(fstruct, task_setting, dataset_info: dict):
     calculator: CoverageCalculator = CoverageCalculator({}, "")
 
     logger.info(f"Start coverage test ...")
+    selected = {}
     for pj_name, info in dataset_info.items():
         if select and pj_name not in projects: continue
-        project_path = f"{dataset_dir}/{info['project-url']}"
-        info["project-url"] = project_path
-        # run converage test & generate report
-        runner = ProjectTestRunner(info, dependency_dir, testclass_path, report_path)
-        test_result = runner.run_project_test(compile_test)
+        info["project-url"] = f"{dataset_dir}/{info['project-url']}"
+        selected[pj_name] = info
+    # run converage test & generate report
+    scheduler = EvaluationScheduler(dependency_dir, testclass_path, report_path,
+                                    task_setting.EVAL_WORKERS, task_setting.HTML_REPORT, compile_test)
+    project_results = scheduler.run(selected)
+    for pj_name, info in selected.items():
+        test_result = project_results[pj_name]
         logger.info(test_result)
         # extract coverage
         calculator = CoverageCalculator(info, report_path)
@@ -10,8 +10,8 @@ from evaluations.coverage_test import ProjectTestRunner, CoverageCalculator
 
 
 class HITSRunner(ProjectTestRunner):
-    def __init__(self, project_info, dependency_dir, testclass_path, report_path):
-        super().__init__(project_info, dependency_dir, testclass_path, report_path)
+    def __init__(self, project_info, dependency_dir, testclass_path, report_path, html_report=False):
+        super().__init__(project_info, dependency_dir, testclass_path, report_path, html_report)
 
     def run_project_test(self, compile=True):
         project_name = self.project_info["project-name"]
@@ -58,6 +58,11 @@ class HITSRunner(ProjectTestRunner):
                 self.test_result[data_id]["test_cases"] = len(matched_files)
                 self.test_result[data_id]["passed_cases"] = 0
                 continue
+            test_classes = [f"{package}.{os.path.basename(file)[:-len('.java')]}" for file in compiled_files]
+            if self.use_sessions() and self.run_with_sessions(data_id, tobject, test_classes):
+                if "error_type" in self.test_result[data_id]:
+                    self.test_result[data_id]["test_cases"] = len(matched_files)
+                continue
             eflag, test_info = self.run_test_group(package, testid, data_id)
             if eflag:
                 cases = int(re.findall(r"([0-9]+) tests started", test_info)[0])
@@ -69,12 +74,9 @@ class HITSRunner(ProjectTestRunner):
                 self.test_result[data_id]["error_type"] = "execution error"
                 self.test_result[data_id]["test_cases"] = len(matched_files)
                 continue
-            html_report = f"{self.report_path}/jacoco-report-html/{testid}/"
-            csv_report = f"{self.report_path}/jacoco-report-csv/{testid}.csv"
-            if not self.generate_report_single(html_report, csv_report):
+            if not self.collect_coverage(data_id, tobject):
                 self.test_result[data_id]["error_type"] = "report error"
                 continue
-            self.delete_jacoco_exec()
             if len(passed_cases) > 0:
                 passed_cases_groups = []
                 flag = False
@@ -84,10 +86,9 @@ class HITSRunner(ProjectTestRunner):
                 for group in passed_cases_groups:
                     if self.run_selected_mehods(group): flag = True
                 if flag == True:
-                    correct_html_report = f"{self.report_path}/jacoco-report-html/{testid}_correct/"
-                    correct_csv_report = f"{self.report_path}/jacoco-report-csv/{testid}_correct.csv"
-                    self.generate_report_single(correct_html_report, correct_csv_report)
-                self.delete_jacoco_exec()
+                    self.collect_coverage(data_id, tobject, correct=True)
+                else:
+                    self.delete_jacoco_exec()
             else:
                 self.test_result[data_id].update({"correct_inst_cov": 0.0, "correct_bran_cov": 0.0})
         return self.test_result
@@ -142,8 +143,8 @@ class HITSRunner(ProjectTestRunner):
 
 
 class UTGenRunner(ProjectTestRunner):
-    def __init__(self, project_info, dependency_dir, testclass_path, report_path):
-        super().__init__(project_info, dependency_dir, testclass_path, report_path)
+    def __init__(self, project_info, dependency_dir, testclass_path, report_path, html_report=False):
+        super().__init__(project_info, dependency_dir, testclass_path, report_path, html_report)
         test_dependencies = f"libs/*;target/test-classes;target/classes;{self.dependency_fd}/*"
         self.test_base_cmd = [
             'java', 
@@ -203,19 +204,13 @@ class UTGenRunner(ProjectTestRunner):
             else:
                 self.test_result[data_id]["error_type"] = "execution error"
                 continue
-            html_report = f"{self.report_path}/jacoco-report-html/{testid}/"
-            csv_report = f"{self.report_path}/jacoco-report-csv/{testid}.csv"
-            if not self.generate_report_single(html_report, csv_report):
+            if not self.collect_coverage(data_id, tobject):
                 self.test_result[data_id]["error_type"] = "report error"
                 continue
-            self.delete_jacoco_exec()
             if len(passed_test)>0:
                 passed_test = [f"{test_class}#{method}" for method in passed_test]
                 if not self.run_selected_mehods(passed_test): continue
-                correct_html_report = f"{self.report_path}/jacoco-report-html/{testid}_correct/"
-                correct_csv_report = f"{self.report_path}/jacoco-report-csv/{testid}_correct.csv"
-                self.generate_report_single(correct_html_report, correct_csv_report)
-                self.delete_jacoco_exec()
+                self.collect_coverage(data_id, tobject, correct=True)
             else:
                 self.test_result[data_id].update({"correct_inst_cov": 0.0, "correct_bran_cov": 0.0})
         return self.test_result        
@@ -258,7 +253,7 @@ def extract_coverage_generic(runner_class, result_folder, dataset_info, fstruct,
     for pj_name, info in dataset_info.items():
         if select and pj_name not in projects: continue
         # run converage test & generate report
-        runner = runner_class(info, dependency_dir, testclass_path, report_path)
+        runner = runner_class(info, dependency_dir, testclass_path, report_path, task_setting.HTML_REPORT)
         test_result = runner.run_project_test(compile_test)
         logger.info(test_result)
         # extract coverage
@@ -7,9 +7,12 @@ import argparse
 
 import tools.io_utils as utils
 from tools.time_agent import TimeRecorder
+from tools.llm_cache import LLMCache
+from tools.run_manifest import RunManifest
 import procedure.generate_prompt as GenPrompt
 import procedure.generate_code as GenCode
 import procedure.post_process as Post
+from procedure.pipeline import MethodPipeline
 from settings import FileStructure as FS, TaskSettings as TS
 
 
@@ -17,6 +20,8 @@ def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('-L','--log_level', type=str, default='info', help='log level: info, debug, warning, error, critical')
     parser.add_argument('-F','--log_file', help="storage file of output info", default=None)
+    parser.add_argument('--resume', action='store_true', help="skip stages whose inputs are unchanged in the run manifest")
+    parser.add_argument('--post_only', action='store_true', help="only run the post process (verify & repair) stage")
 
     args = parser.parse_args()
     log_level = {
@@ -30,8 +35,44 @@ def get_args():
     return args
 
 
+def run_stages(dataset_info:dict):
+    """
+    run each stage for all focal methods, with a barrier between stages
+    """
+    case_then_code = TS.CASE_THEN_CODE
+    logger = logging.getLogger(__name__)
+    # generate prompts
+    prompt_gen_start = time.time()
+    GenPrompt.generate_init_prompts(FS, TS, dataset_info)
+    GenPrompt.generate_test_case_prompts(FS, TS, dataset_info)
+    prompt_gen_end = time.time()
+    logger.info(f"time for generate prompts: {prompt_gen_end - prompt_gen_start:.2f} seconds")
+
+    # generate test class framework
+    framework_start = time.time()
+    GenCode.generate_testclass_framework(FS, TS, dataset_info)
+    framework_end = time.time()
+    logger.info(f"time for generate test class framework: {framework_end - framework_start:.2f} seconds")
+
+    # generate test cases
+    testcase_start = time.time()
+    if case_then_code:
+        GenCode.generate_case_then_code(FS, TS, dataset_info)
+    else:
+        GenCode.generate_testcase_code(FS, TS, dataset_info)
+    testcase_end = time.time()
+    logger.info(f"time for generate test cases: {testcase_end - testcase_start:.2f} seconds")
+
+    # post process
+    post_start = time.time()
+    Post.verify_test_classes(FS, TS, dataset_info)
+    post_end = time.time()
+    logger.info(f"time for post process: {post_end - post_start:.2f} seconds")
+    return
+
+
 # TODO: a complete procedure for singal case in dataset
-def run():
+def run(resume=False, post_only=False):
     '''
     procedure:
     1. setup & teerdowm generation
@@ -61,35 +102,18 @@ def run():
         TS.PROMPT_LIST = prompt_list
         logger.info(f"prompt list: {TS.PROMPT_LIST}")
 
-    # generate prompts
-    prompt_gen_start = time.time()
-    GenPrompt.generate_init_prompts(FS, TS, dataset_info)
-    GenPrompt.generate_test_case_prompts(FS, TS, dataset_info)
-    prompt_gen_end = time.time()
-    logger.info(f"time for generate prompts: {prompt_gen_end - prompt_gen_start:.2f} seconds")
-
-    # generate test class framework
-    framework_start = time.time()
-    GenCode.generate_testclass_framework(FS, TS, dataset_info)
-    framework_end = time.time()
-    logger.info(f"time for generate test class framework: {framework_end - framework_start:.2f} seconds")
-
-    # generate test cases
-    testcase_start = time.time()
-    if case_then_code:
-        GenCode.generate_case_then_code(FS, TS, dataset_info)
+    # the run manifest is maintained by the pipeline, resume & post only runs always use it
+    if TS.PIPELINE or resume or post_only:
+        pipeline_start = time.time()
+        manifest = RunManifest(FS.MANIFEST_PATH, resume)
+        stages = ["verify"] if post_only else None
+        MethodPipeline(FS, TS, dataset_info, manifest, stages).run()
+        logger.info(f"time for pipeline: {time.time() - pipeline_start:.2f} seconds")
     else:
-        GenCode.generate_testcase_code(FS, TS, dataset_info)
-    testcase_end = time.time()
-    logger.info(f"time for generate test cases: {testcase_end - testcase_start:.2f} seconds")
+        run_stages(dataset_info)
 
-    # post process
-    post_start = time.time()
-    Post.verify_test_classes(FS, TS, dataset_info)
-    post_end = time.time()
-    logger.info(f"time for post process: {post_end - post_start:.2f} seconds")
-    
     TimeRecorder.update_records()
+    LLMCache.close_cache()
     end_time = time.time()
     elapsed_time = end_time - start_time
     logger.info(f"total elapsed time: {elapsed_time:.2f} seconds")
@@ -110,5 +134,5 @@ if __name__ == '__main__':
             level=args.log_level, 
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     jpype.startJVM(jpype.getDefaultJVMPath(), '-Xmx4g', "-Djava.class.path=./Java/project-info-process.jar;./Java/project-index-builder.jar")
-    run()
+    run(args.resume, args.post_only)
     jpype.shutdownJVM()
\ No newline at end of file
@@ -8,6 +8,7 @@ from settings import FileStructure as FS, TimeRecord as TR
 import tools.io_utils as utils
 import procedure.workspace_preparation as WSP
 import procedure.preprocess_project as PreProcess
+import procedure.incremental_index as Incremental
 
 
 def get_args():
@@ -17,6 +18,7 @@ def get_args():
     parser.add_argument('-W', '--workspace', action='store_true', help='prepare workspace: True/False')
     parser.add_argument('-D', '--dataset', action='store_true', help='prepare dataset_info.json: True/False')
     parser.add_argument('-P', '--project_index', action='store_true', help='prepare project index: True/False')
+    parser.add_argument('-I', '--incremental', action='store_true', help='with -P, re-index only source files changed since the last indexing')
 
     args = parser.parse_args()
     log_level = {
@@ -80,7 +82,11 @@ def run(args):
     #     logger.info("Preparing dataset_info.json ...")
     #     DatasetProcessor = jpype.JClass("DatasetPrepare")
     #     DatasetProcessor.main([dataset_abs])
-    if args.project_index:
+    if args.project_index and args.incremental:
+        logger.info("Updating project index ...")
+        dataset_info = utils.load_json(f"{dataset_path}/dataset_info.json")
+        Incremental.update_project_indexes(FS, dataset_info)
+    elif args.project_index:
         logger.info("Constructing project index ...")
         ProjectPreprocessor = jpype.JClass("PreProcessor")
         ProjectPreprocessor.main([dataset_abs, f"{root_path}/{code_info_path}/json"])
@@ -88,6 +94,8 @@ def run(args):
         PreProcess.extract_invoke_patterns(FS)
         IndexBuilder = jpype.JClass("IndexBuilder")
         IndexBuilder.main(["group", f"{code_info_path}/json", f"{code_info_path}/lucene"])
+        # fingerprints of the indexed sources, for later incremental indexing
+        Incremental.save_fingerprints(FS, utils.load_json(f"{dataset_path}/dataset_info.json"))
     
     logger.info("preparation completed.")
     return
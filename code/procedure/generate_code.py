@@ -1,154 +1,139 @@
 import os
+import json
 import logging
-import jpype
 import concurrent.futures
 from threading import Lock
 
 import tools.io_utils as io_utils
 from tools.llm_api import LLMCaller
 from tools.time_agent import TimeRecorder
+from tools.class_merger import merge_test_class
 from procedure.post_process import check_class_name
 
 
 def insert_test_case(init_class:str, insert_code:str):
+    return insert_test_cases(init_class, [insert_code])
+
+
+def insert_test_cases(init_class:str, insert_codes:list[str]):
+    """
+    merge the code of several responses into the test class at once
+    """
     init_class = init_class.strip()
-    insert_code = insert_code.lstrip()
-    TestClassEditor = jpype.JClass("editcode.TestClassUpdator")
-    added_class = str(TestClassEditor.main([init_class, insert_code, init_class.splitlines()[0]]))
-    return added_class
+    insert_codes = [code.lstrip() for code in insert_codes]
+    return merge_test_class(init_class, insert_codes, info=init_class.splitlines()[0])
 
 
-def generate_testclass_framework(file_structure, task_setting, dataset_info: dict):
-    prompt_path = file_structure.PROMPT_PATH
-    response_path = file_structure.RESPONSE_PATH
-    gen_path = file_structure.TESTCLASSS_PATH
+def select_tasks(file_structure, task_setting, dataset_info: dict) -> list[tuple]:
+    """
+    Collect the selected focal methods of all projects, so that one worker pool serves every project.
+    return: [(task_info, project_prompt, project_response, gen_folder)]
+    """
     projects = task_setting.PROJECTS
     case_list = task_setting.CASES_LIST
-    save_res = task_setting.SAVE_INTER_RESULT
-    mworkers = task_setting.MAX_WORKERS
     project_select = True if len(projects)>0 else False
     case_select = True if len(case_list)>0 else False
-    logger = logging.getLogger(__name__)
-    file_lock = Lock() # ensure thread-safe file writing
-    llm_callers = [LLMCaller() for _ in range(mworkers)]
-
-    @TimeRecorder
-    def process_init_response(llm_caller:LLMCaller, task_info, project_prompt, project_response, gen_folder):
-        id = task_info["id"]
-        class_name = task_info["test-class"].split('.')[-1]
-        test_class_path = f"{gen_folder}/{class_name}.java"
-        prompt = io_utils.load_text(f"{project_prompt}/{id}/init_prompt.md")
-        code, response = llm_caller.get_response_code(prompt)
-        code = check_class_name(code, class_name)
-        with file_lock:
-            io_utils.write_text(test_class_path, code)
-            if save_res:
-                res_path = f"{project_response}/{id}/init_response.md"
-                io_utils.write_text(res_path, response)
-        return id
-    
+    tasks = []
     for pj_name, pj_info in dataset_info.items():
         if project_select and pj_name not in projects: continue
-        logger.info(f"Generating test class framework for project {pj_name}...")
-        project_prompt = prompt_path.replace("<project>", pj_name)
-        project_response = response_path.replace("<project>", pj_name)
-        gen_folder = gen_path.replace("<project>", pj_name)
+        project_prompt = file_structure.PROMPT_PATH.replace("<project>", pj_name)
+        project_response = file_structure.RESPONSE_PATH.replace("<project>", pj_name)
+        gen_folder = file_structure.TESTCLASSS_PATH.replace("<project>", pj_name)
+        for test_info in pj_info["focal-methods"]:
+            if case_select and test_info["id"] not in case_list: continue
+            tasks.append((test_info, project_prompt, project_response, gen_folder))
+    return tasks
+
+
+file_lock = Lock() # ensure thread-safe file writing
+
+
+@TimeRecorder
+def process_init_response(llm_caller:LLMCaller, task_info, project_prompt, project_response, gen_folder, save_res=True):
+    id = task_info["id"]
+    class_name = task_info["test-class"].split('.')[-1]
+    test_class_path = f"{gen_folder}/{class_name}.java"
+    prompt = io_utils.load_text(f"{project_prompt}/{id}/init_prompt.md")
+    code, response = llm_caller.get_response_code(prompt)
+    code = check_class_name(code, class_name)
+    with file_lock:
+        io_utils.write_text(test_class_path, code)
+        if save_res:
+            res_path = f"{project_response}/{id}/init_response.md"
+            io_utils.write_text(res_path, response)
+    return id
+
+
+def generate_testclass_framework(file_structure, task_setting, dataset_info: dict):
+    save_res = task_setting.SAVE_INTER_RESULT
+    mworkers = task_setting.MAX_WORKERS
+    logger = logging.getLogger(__name__)
+    llm_caller = LLMCaller() # requests of all workers share the global LLM engine
+    
+    tasks = select_tasks(file_structure, task_setting, dataset_info)
+    logger.info(f"Generating test class framework for {len(tasks)} focal methods...")
+    for gen_folder in set(task[-1] for task in tasks):
         if not os.path.exists(gen_folder): os.makedirs(gen_folder)
-        logger.debug(f"max workers: {mworkers}")
-        with concurrent.futures.ThreadPoolExecutor(max_workers=mworkers) as executor:
-            futures = []
-            api_count = 0
-            for test_info in pj_info["focal-methods"]:
-                if case_select and test_info["id"] not in case_list: continue
-                future = executor.submit(
-                    process_init_response, 
-                    llm_callers[api_count],
-                    test_info, 
-                    project_prompt, 
-                    project_response, 
-                    gen_folder
-                )
-                futures.append(future)
-                api_count = (api_count+1) % mworkers
-            # wait for all tasks complete
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    id = future.result()
-                    logger.info(f"Completed test class framework generation for {id}")
-                except Exception as e:
-                    logger.error(f"Error processing test framework for: {e}")
+    logger.debug(f"max workers: {mworkers}")
+    # one pool for all projects, LLM concurrency is bounded by the engine
+    with concurrent.futures.ThreadPoolExecutor(max_workers=mworkers) as executor:
+        futures = [executor.submit(process_init_response, llm_caller, *task, save_res) for task in tasks]
+        # wait for all tasks complete
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                id = future.result()
+                logger.info(f"Completed test class framework generation for {id}")
+            except Exception as e:
+                logger.error(f"Error processing test framework for: {e}")
     return
 
 
+@TimeRecorder
+def process_code_response(llm_caller:LLMCaller, task_info, project_prompt, project_response, gen_folder, prompt_list, save_res=True):
+    logger = logging.getLogger(__name__)
+    class_name = task_info["test-class"].split('.')[-1]
+    id = task_info["id"]
+    save_path = f"{gen_folder}/{class_name}.java"
+    init_class = io_utils.load_text(save_path)
+    for prompt_name in prompt_list:
+        prompt = io_utils.load_text(f"{project_prompt}/{id}/{prompt_name}_prompt.md")
+        prompt = prompt.replace('<initial_class>', init_class)
+        code, response = llm_caller.get_response_code(prompt)
+        logger.debug("finish get response")
+        init_class = insert_test_case(init_class, code)
+        logger.debug("finish insert test case")
+        if save_res:
+            response_path = f"{project_response}/{id}/{prompt_name}_response.md"
+            with file_lock:
+                io_utils.write_text(response_path, response)
+    with file_lock:
+        io_utils.write_text(save_path, init_class)
+    return id
+
+
 def generate_testcase_code(file_structure, task_setting, dataset_info: dict):
-    prompt_path = file_structure.PROMPT_PATH
-    response_path = file_structure.RESPONSE_PATH
-    gen_path = file_structure.TESTCLASSS_PATH
     prompt_list = task_setting.PROMPT_LIST
-    projects = task_setting.PROJECTS
-    case_list = task_setting.CASES_LIST
     save_res = task_setting.SAVE_INTER_RESULT
     mworkers = task_setting.MAX_WORKERS
-    project_select = True if len(projects)>0 else False
-    case_select = True if len(case_list)>0 else False
     logger = logging.getLogger(__name__)
-    file_lock = Lock()
-    llm_callers = [LLMCaller() for _ in range(mworkers)]
-
-    @TimeRecorder
-    def process_case_response(llm_caller:LLMCaller, task_info, project_prompt, project_response, gen_folder):
-        class_name = task_info["test-class"].split('.')[-1]
-        id = task_info["id"]
-        save_path = f"{gen_folder}/{class_name}.java"
-        init_class = io_utils.load_text(save_path)
-        for prompt_name in prompt_list:
-            prompt = io_utils.load_text(f"{project_prompt}/{id}/{prompt_name}_prompt.md")
-            prompt = prompt.replace('<initial_class>', init_class)
-            code, response = llm_caller.get_response_code(prompt)
-            logger.debug("finish get response")
-            init_class = insert_test_case(init_class, code)
-            logger.debug("finish insert test case")
-            if save_res:
-                response_path = f"{project_response}/{id}/{prompt_name}_response.md"
-                with file_lock:
-                    io_utils.write_text(response_path, response)
-        with file_lock:
-            io_utils.write_text(save_path, init_class)
-        return id
+    llm_caller = LLMCaller() # requests of all workers share the global LLM engine
 
-    for pj_name, pj_info in dataset_info.items():
-        if project_select and pj_name not in projects: continue
-        logger.info(f"Generating test cases for project {pj_name}...")
-        project_prompt = prompt_path.replace("<project>", pj_name)
-        project_response = response_path.replace("<project>", pj_name)
-        gen_folder = gen_path.replace("<project>", pj_name)
-        logger.debug(f"max workers: {mworkers}")
-        with concurrent.futures.ThreadPoolExecutor(max_workers=mworkers) as executor:
-            futures = []
-            api_count = 0
-            for test_info in pj_info["focal-methods"]:
-                if case_select and test_info["id"] not in case_list: continue
-                future = executor.submit(
-                    process_case_response, 
-                    llm_callers[api_count],
-                    test_info, 
-                    project_prompt, 
-                    project_response, 
-                    gen_folder
-                )
-                futures.append(future)
-                api_count = (api_count+1) % mworkers
-            # wait for all tasks complete
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    id = future.result()
-                    logger.info(f"Completed test case generation for {id}")
-                except Exception as e:
-                    logger.error(f"Error processing test case: {e}")
+    tasks = select_tasks(file_structure, task_setting, dataset_info)
+    logger.info(f"Generating test cases for {len(tasks)} focal methods...")
+    logger.debug(f"max workers: {mworkers}")
+    # one pool for all projects, LLM concurrency is bounded by the engine
+    with concurrent.futures.ThreadPoolExecutor(max_workers=mworkers) as executor:
+        futures = [executor.submit(process_code_response, llm_caller, *task, prompt_list, save_res) for task in tasks]
+        # wait for all tasks complete
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                id = future.result()
+                logger.info(f"Completed test case generation for {id}")
+            except Exception as e:
+                logger.error(f"Error processing test case: {e}")
     return
 
 
-
 '''
 format of output cases:
 [
@@ -170,10 +155,38 @@ format of output cases:
 ]
 '''
 class FormattedTestcase:
+    """
+    Test cases grouped by test name. A case is a duplicate if its inputs have the same key as an existing
+    case of the group, see case_key. The compact JSON of the groups is cached until the next change.
+    """
     group_cases: dict
+    group_keys: dict # {group name: set of case keys}
 
     def __init__(self):
         self.group_cases = {}
+        self.group_keys = {}
+        self._json = None
+
+    @staticmethod
+    def _norm_value(value) -> str:
+        # whitespace and quote variants of a value are the same: "a  b", 'a b', a b
+        if not isinstance(value, str):
+            value = json.dumps(value, sort_keys=True, ensure_ascii=False)
+        value = " ".join(value.split())
+        while len(value) >= 2 and value[0] in "\"'" and value[-1] in "\"'":
+            value = value[1:-1].strip()
+        return value
+
+    @staticmethod
+    def case_key(case:dict) -> tuple:
+        """
+        ((parameter, normalized value), ...) in the order of the inputs
+        """
+        inputs = case.get("input")
+        if not isinstance(inputs, list):
+            return (FormattedTestcase._norm_value(case),)
+        return tuple((str(item.get("parameter", "")).strip(), FormattedTestcase._norm_value(item.get("value", "")))
+                     if isinstance(item, dict) else FormattedTestcase._norm_value(item) for item in inputs)
 
     def merge_test_cases(self, json_res):
         if json_res is None: return
@@ -193,40 +206,24 @@ class FormattedTestcase:
             return
         extract_group(json_res)
         for new_group in new_groups:
-            group_cases = new_group.get("cases", [])
             group_name = new_group.get("group", "unnamed")
-            exist_group = self.group_cases.get(group_name, None) # list or None
-            if exist_group is None:
-                self.group_cases[group_name] = group_cases
-            else:
-                for new_case in group_cases:
-                    case_exists = False
-                    for exist_case in exist_group:
-                        if len(new_case["input"]) == len(exist_case["input"]):
-                            all_params_match = True
-                            for new_input, exist_input in zip(new_case["input"], exist_case["input"]):
-                                if new_input["parameter"] != exist_input["parameter"] or \
-                                new_input["value"] != exist_input["value"]:
-                                    all_params_match = False
-                                    break
-                        if all_params_match:
-                            case_exists = True
-                            break
-                    if not case_exists:
-                        exist_group.append(new_case)
-                self.group_cases[group_name] = exist_group
+            exist_group = self.group_cases.setdefault(group_name, [])
+            exist_keys = self.group_keys.setdefault(group_name, set())
+            for new_case in new_group.get("cases", []):
+                if not isinstance(new_case, dict): continue
+                key = self.case_key(new_case)
+                if key in exist_keys: continue
+                exist_keys.add(key)
+                exist_group.append(new_case)
+                self._json = None
         return
 
     def __str__(self) -> str:
-        res = []
-        for group_name, cases in self.group_cases.items():
-            res.append({
-                "group": group_name,
-                "cases": cases
-            })
-        return str(res)
+        if self._json is None:
+            self._json = json.dumps(self.to_list(), ensure_ascii=False, separators=(",", ":"))
+        return self._json
 
-    def to_list(self) -> dict:
+    def to_list(self) -> list:
         res = []
         for group_name, cases in self.group_cases.items():
             res.append({
@@ -236,94 +233,84 @@ class FormattedTestcase:
         return res
 
 
+@TimeRecorder
+def process_case_response(llm_caller:LLMCaller, task_info, project_prompt, project_response, gen_folder, prompt_list, save_res=True, fanout=False):
+    """
+    fanout: issue the case prompts concurrently with an empty case list and merge the results afterwards,
+    otherwise each prompt receives the cases generated by the previous ones
+    """
+    logger = logging.getLogger(__name__)
+    id = task_info["id"]
+    response_folder = f"{project_response}/{id}"
+    prompt_folder = f"{project_prompt}/{id}"
+    # generate test cases in json format
+    formatted_cases = FormattedTestcase()
+    case_prompts = [pname for pname in prompt_list if pname != "gencode"]
+    results = None
+    if fanout:
+        prompts = [io_utils.load_text(f"{prompt_folder}/{pname}_prompt.md").replace('<cases_json>', str(formatted_cases))
+                   for pname in case_prompts]
+        results = llm_caller.get_response_json_batch(prompts)
+    for i, prompt_name in enumerate(case_prompts):
+        if results is not None:
+            case_data, response = results[i]
+        else:
+            prompt = io_utils.load_text(f"{prompt_folder}/{prompt_name}_prompt.md")
+            prompt = prompt.replace('<cases_json>', str(formatted_cases))
+            case_data, response = llm_caller.get_response_json(prompt)
+        logger.debug("finish get response")
+        try:
+            formatted_cases.merge_test_cases(case_data)
+        except Exception as e:
+            logger.warning(f"Error while adding test cases for {id} from prompt {prompt_name}: {e}")
+        logger.debug("finish insert test case")
+        if save_res:
+            with file_lock:
+                io_utils.write_text(f"{response_folder}/{prompt_name}_response.md", response)
+    with file_lock:
+        io_utils.write_json(f"{response_folder}/cases.json", formatted_cases.to_list())
+    # generate test code based on test cases
+    class_name = task_info["test-class"].split('.')[-1]
+    save_path = f"{gen_folder}/{class_name}.java"
+    init_class = io_utils.load_text(save_path)
+    prompt = io_utils.load_text(f"{prompt_folder}/gencode_prompt.md")
+    prompt = prompt.replace('<initial_class>', init_class).replace('<cases_json>', str(formatted_cases))
+    code, response = llm_caller.get_response_code(prompt)
+    init_class = insert_test_case(init_class, code)
+    with file_lock:
+        io_utils.write_text(save_path, init_class)
+        if save_res:
+            io_utils.write_text(f"{response_folder}/gencode_response.md", response)
+    return id
+
+
 def generate_case_then_code(file_structure, task_setting, dataset_info: dict):
-    prompt_path = file_structure.PROMPT_PATH
-    response_path = file_structure.RESPONSE_PATH
-    gen_path = file_structure.TESTCLASSS_PATH
     prompt_list:list = task_setting.PROMPT_LIST
-    projects = task_setting.PROJECTS
-    case_list = task_setting.CASES_LIST
     save_res = task_setting.SAVE_INTER_RESULT
+    fanout = task_setting.CASE_FANOUT
     mworkers = task_setting.MAX_WORKERS
-    project_select = True if len(projects)>0 else False
-    case_select = True if len(case_list)>0 else False
     logger = logging.getLogger(__name__)
-    file_lock = Lock()
-    llm_callers = [LLMCaller() for _ in range(mworkers)]
-
-    @TimeRecorder
-    def process_case_response(llm_caller:LLMCaller, task_info, project_prompt, project_response, gen_folder):
-        id = task_info["id"]
-        response_folder = f"{project_response}/{id}"
-        prompt_folder = f"{project_prompt}/{id}"
-        # generate test cases in json format
-        formatted_cases = FormattedTestcase()
-        for prompt_name in prompt_list:
-            if prompt_name == "gencode": continue
-            prompt = io_utils.load_text(f"{prompt_folder}/{prompt_name}_prompt.md")
-            prompt = prompt.replace('<cases_json>', str(formatted_cases))
-            case_data, response = llm_caller.get_response_json(prompt)
-            logger.debug("finish get response")
+    llm_caller = LLMCaller() # requests of all workers share the global LLM engine
+
+    tasks = select_tasks(file_structure, task_setting, dataset_info)
+    logger.info(f"Generating test cases for {len(tasks)} focal methods...")
+    logger.debug(f"max workers: {mworkers}")
+    # one pool for all projects, LLM concurrency is bounded by the engine
+    with concurrent.futures.ThreadPoolExecutor(max_workers=mworkers) as executor:
+        futures = [executor.submit(process_case_response, llm_caller, *task, prompt_list, save_res, fanout) for task in tasks]
+        # wait for all tasks complete
+        for future in concurrent.futures.as_completed(futures):
             try:
-                formatted_cases.merge_test_cases(case_data)
+                id = future.result()
+                logger.info(f"Completed test case generation for {id}")
             except Exception as e:
-                logger.warning(f"Error while adding test cases for {id} from prompt {prompt_name}: {e}")
-            logger.debug("finish insert test case")
-            if save_res:
-                with file_lock:
-                    io_utils.write_text(f"{response_folder}/{prompt_name}_response.md", response)
-        with file_lock:
-            io_utils.write_json(f"{response_folder}/cases.json", formatted_cases.to_list())
-        # generate test code based on test cases
-        class_name = task_info["test-class"].split('.')[-1]
-        save_path = f"{gen_folder}/{class_name}.java"
-        init_class = io_utils.load_text(save_path)
-        prompt = io_utils.load_text(f"{prompt_folder}/gencode_prompt.md")
-        prompt = prompt.replace('<initial_class>', init_class).replace('<cases_json>', str(formatted_cases))
-        code, response = llm_caller.get_response_code(prompt)
-        init_class = insert_test_case(init_class, code)
-        with file_lock:
-            io_utils.write_text(save_path, init_class)
-            if save_res:
-                io_utils.write_text(f"{response_folder}/gencode_response.md", response)
-        return id
-
-    for pj_name, pj_info in dataset_info.items():
-        if project_select and pj_name not in projects: continue
-        logger.info(f"Generating test cases for project {pj_name}...")
-        project_prompt = prompt_path.replace("<project>", pj_name)
-        project_response = response_path.replace("<project>", pj_name)
-        gen_folder = gen_path.replace("<project>", pj_name)
-        logger.debug(f"max workers: {mworkers}")
-        with concurrent.futures.ThreadPoolExecutor(max_workers=mworkers) as executor:
-            futures = []
-            api_count = 0
-            for test_info in pj_info["focal-methods"]:
-                if case_select and test_info["id"] not in case_list: continue
-                future = executor.submit(
-                    process_case_response,
-                    llm_callers[api_count],
-                    test_info,
-                    project_prompt,
-                    project_response,
-                    gen_folder
-                )
-                futures.append(future)
-                api_count = (api_count+1) % mworkers
-            # wait for all tasks complete
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    id = future.result()
-                    logger.info(f"Completed test case generation for {id}")
-                except Exception as e:
-                    logger.error(f"Error processing test case: {e}")
+                logger.error(f"Error processing test case: {e}")
     return
 
 
 if __name__ == "__main__":
     import sys
     sys.path.append(os.path.abspath("../"))
-    import json
     test_group_1 = json.loads("""
     """)
     test_group_2 = json.loads("""
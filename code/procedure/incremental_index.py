@@ -0,0 +1,205 @@
+import os
+import json
+import jpype
+import hashlib
+import logging
+
+import tools.io_utils as io_utils
+import procedure.preprocess_project as PreProcess
+
+
+SOURCE_FOLDER = "src/main/java"
+TEST_FOLDER = "src/test-original/java"
+
+
+def fingerprint_sources(project_path:str) -> dict:
+    '''
+    {"<path relative to the project>": sha1 of the content} of the source and test files
+    '''
+    fingerprints = {}
+    for folder in (SOURCE_FOLDER, TEST_FOLDER):
+        for root, _, files in os.walk(f"{project_path}/{folder}"):
+            for file in files:
+                if not file.endswith(".java"): continue
+                path = os.path.join(root, file)
+                with open(path, "rb") as f:
+                    digest = hashlib.sha1(f.read()).hexdigest()
+                fingerprints[os.path.relpath(path, project_path).replace("\\", "/")] = digest
+    return fingerprints
+
+
+def save_fingerprints(file_structure, dataset_info:dict):
+    dataset_path = file_structure.DATASET_PATH
+    for pj_name, pj_info in dataset_info.items():
+        fingerprints = fingerprint_sources(f"{dataset_path}/{pj_info['project-url']}")
+        io_utils.write_json(f"{file_structure.CODE_INFO_PATH}/fingerprints/{pj_name}.json", fingerprints)
+    return
+
+
+def _load_or_empty(path:str, default):
+    return io_utils.load_json(path) if os.path.exists(path) else default
+
+
+def _class_file(folder:str, cinfo:dict) -> str:
+    return f"{folder}/{cinfo['file']}".replace("\\", "/")
+
+
+def _node_class(node_id:str) -> str:
+    return node_id.split("#")[0]
+
+
+def _caller_map(calling_graph:dict) -> dict:
+    # caller -> callees
+    callees = {}
+    for class_fqn, cdata in calling_graph.items():
+        for method_sig, mdata in cdata.items():
+            for caller in mdata["caller"]:
+                callees.setdefault(caller["sig"], set()).add(f"{class_fqn}#{method_sig}")
+    return callees
+
+
+def patch_calling_graph(calling_graph:dict, source_data:dict, changed_classes:set):
+    '''
+    replace the methods of the changed classes and the call edges from them, source_data is the updated code info
+    '''
+    for class_fqn in changed_classes:
+        calling_graph.pop(class_fqn, None)
+    for cdata in calling_graph.values():
+        for mdata in cdata.values():
+            mdata["caller"] = [caller for caller in mdata["caller"] if _node_class(caller["sig"]) not in changed_classes]
+    new_classes = changed_classes & set(source_data.keys())
+    for class_fqn in new_classes:
+        calling_graph[class_fqn] = PreProcess.callee_entries(source_data[class_fqn])
+    for class_fqn, cinfo in source_data.items():
+        # edges from changed classes to all methods, from the other classes to methods of changed classes
+        PreProcess.add_callers(calling_graph, class_fqn, cinfo, None if class_fqn in new_classes else new_classes)
+    return calling_graph
+
+
+def _imported_name(import_stmt:str) -> str:
+    # "import static a.b.C.*;" -> "a.b.C"
+    name = import_stmt.strip().removeprefix("import").strip().removeprefix("static ").strip()
+    return name.rstrip(";").strip().removesuffix(".*")
+
+
+def prune_import_dict(import_dict:dict, removed_classes:set):
+    '''
+    drop the imports of classes that no longer exist (and of their members and inner classes)
+    '''
+    def exists(import_stmt:str) -> bool:
+        name = _imported_name(import_stmt)
+        return not any(name == fqn or name.startswith(f"{fqn}.") for fqn in removed_classes)
+    for symbol in list(import_dict.keys()):
+        imports = [item for item in import_dict[symbol] if exists(item)]
+        if len(imports) > 0:
+            import_dict[symbol] = imports
+        else:
+            import_dict.pop(symbol)
+    return import_dict
+
+
+def affected_methods(graphs:list, changed_classes:set) -> set:
+    '''
+    methods whose invoke patterns may change: methods of changed classes, methods called by them,
+    and methods whose private call chains pass through an affected private method (in the old or the new graph)
+    '''
+    affected = set()
+    for calling_graph in graphs:
+        types = {f"{c}#{m}": mdata["type"] for c, cdata in calling_graph.items() for m, mdata in cdata.items()}
+        callees_of = _caller_map(calling_graph)
+        stack = [node for node in types if _node_class(node) in changed_classes]
+        stack += [callee for caller, callees in callees_of.items() if _node_class(caller) in changed_classes for callee in callees]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node in affected: continue
+            affected.add(node)
+            if types.get(node) == "PRIVATE":
+                stack.extend(callees_of.get(node, []))
+    return affected
+
+
+def update_project_index(file_structure, pj_name:str, project_path:str) -> list:
+    '''
+    Re-index the source files changed since the last indexing of the project.
+    Code info and control flow graphs are re-extracted for the changed files, edges of the calling graph from and to
+    their classes are patched, invoke patterns of the affected methods are recomputed and Lucene documents of the
+    changed classes are replaced.
+    return: changed files
+    '''
+    logger = logging.getLogger(__name__)
+    code_info_path = file_structure.CODE_INFO_PATH
+    fingerprint_file = f"{code_info_path}/fingerprints/{pj_name}.json"
+    json_file = f"{code_info_path}/json/{pj_name}.json"
+    cfg_file = f"{code_info_path}/codegraph/{pj_name}_controlflow.json"
+    graph_file = f"{code_info_path}/codegraph/{pj_name}_callgraph.json"
+    invoke_file = f"{code_info_path}/codegraph/{pj_name}_invoke.json"
+
+    old_fingerprints = _load_or_empty(fingerprint_file, {})
+    new_fingerprints = fingerprint_sources(project_path)
+    changed = [file for file, digest in new_fingerprints.items() if old_fingerprints.get(file) != digest]
+    removed = [file for file in old_fingerprints if file not in new_fingerprints]
+    if len(changed) + len(removed) == 0:
+        logger.info(f"index of {pj_name} is up to date")
+        return []
+    logger.info(f"re-index {pj_name}: {len(changed)} changed files, {len(removed)} removed files")
+    touched = set(changed + removed)
+
+    # code info & control flow graphs of the changed files
+    code_info = _load_or_empty(json_file, {"project": pj_name, "source": {}, "test": {}, "import_dict": {}})
+    PreProcessor = jpype.JClass("PreProcessor")
+    extracted = json.loads(str(PreProcessor.extractFiles(os.path.abspath(project_path), changed))) if len(changed) > 0 \
+        else {"source": {}, "test": {}, "import_dict": {}, "controlflow": {}}
+    changed_classes = set()
+    removed_classes = set()
+    for part, folder in (("source", SOURCE_FOLDER), ("test", TEST_FOLDER)):
+        old_classes = [fqn for fqn, cinfo in code_info[part].items() if _class_file(folder, cinfo) in touched]
+        for class_fqn in old_classes:
+            code_info[part].pop(class_fqn)
+        code_info[part].update(extracted[part])
+        removed_classes |= set(old_classes) - set(extracted[part].keys())
+        if part == "source":
+            changed_classes = set(old_classes) | set(extracted[part].keys())
+    # classes removed or renamed since the last indexing
+    removed_classes -= set(code_info["source"].keys()) | set(code_info["test"].keys())
+    prune_import_dict(code_info["import_dict"], removed_classes)
+    for symbol, imports in extracted["import_dict"].items():
+        existing = code_info["import_dict"].setdefault(symbol, [])
+        existing.extend(item for item in imports if item not in existing)
+    io_utils.write_json(json_file, code_info)
+    cfg_data = _load_or_empty(cfg_file, {})
+    for class_fqn in changed_classes | set(extracted["controlflow"].keys()):
+        cfg_data.pop(class_fqn, None)
+    cfg_data.update(extracted["controlflow"])
+    io_utils.write_json(cfg_file, cfg_data)
+
+    # calling graph & invoke patterns
+    calling_graph = _load_or_empty(graph_file, {})
+    old_graph = json.loads(json.dumps(calling_graph))
+    patch_calling_graph(calling_graph, code_info["source"], changed_classes)
+    io_utils.write_json(graph_file, calling_graph)
+    affected = affected_methods([old_graph, calling_graph], changed_classes)
+    extractor = PreProcess.InvokePatternExtractor(json_file, graph_file, cfg_file)
+    new_patterns = extractor.extract_invoke_pattern(affected)
+    invoke_patterns = _load_or_empty(invoke_file, {})
+    invoke_patterns = {class_fqn: invoke_patterns.get(class_fqn, {}) for class_fqn in calling_graph}
+    for node in affected:
+        class_fqn, method_sig = node.split("#", 1)
+        if class_fqn not in invoke_patterns: continue
+        invoke_patterns[class_fqn].pop(method_sig, None)
+        if method_sig in new_patterns[class_fqn]:
+            invoke_patterns[class_fqn][method_sig] = new_patterns[class_fqn][method_sig]
+    io_utils.write_json(invoke_file, invoke_patterns)
+    logger.info(f"invoke patterns of {len(affected)} methods are recomputed")
+
+    # lucene documents of the changed classes
+    IndexBuilder = jpype.JClass("IndexBuilder")
+    IndexBuilder.main(["update", json_file, f"{code_info_path}/lucene/{pj_name}", *sorted(changed_classes)])
+    io_utils.write_json(fingerprint_file, new_fingerprints)
+    return changed
+
+
+def update_project_indexes(file_structure, dataset_info:dict):
+    dataset_path = file_structure.DATASET_PATH
+    for pj_name, pj_info in dataset_info.items():
+        update_project_index(file_structure, pj_name, f"{dataset_path}/{pj_info['project-url']}")
+    return
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import logging
+import threading
+import collections
+import concurrent.futures
+
+import tools.io_utils as io_utils
+from tools.llm_api import LLMCaller
+from tools.run_manifest import RunManifest
+from tools.code_search import CodeSearcher
+from tools.project_knowledge import ProjectKnowledge
+from tools.context_budget import ContextBudgeter
+from tools.prompt_generator import PromptGenerator
+import procedure.generate_prompt as GenPrompt
+import procedure.generate_code as GenCode
+import procedure.post_process as Post
+
+
+class MethodPipeline:
+    """
+    Run every focal method through its own chain of stages instead of waiting at global stage barriers:
+    prompts (cpu pool) -> test class framework (llm pool) -> test cases (llm pool) -> verification (build pool)
+    Each stage submits the next one when it completes, so LLM calls of some methods overlap
+    with context collection and compilation of others.
+    Every stage is recorded in the run manifest; the test class written by a stage is kept as
+    `<stage>_class.java` in the response folder, so that a later stage can be re-run from it.
+    """
+    STAGES = ("prompt", "framework", "testcase", "verify")
+    file_structure: object
+    task_setting: object
+    dataset_info: dict
+    searchers: dict
+    repairers: Post.RepairerPool
+    project_locks: dict
+    records: dict
+
+    def __init__(self, file_structure, task_setting, dataset_info:dict, manifest:RunManifest, stages:list|None=None):
+        """
+        stages: stages to run, default all stages
+        """
+        self.file_structure = file_structure
+        self.task_setting = task_setting
+        self.dataset_info = dataset_info
+        self.manifest = manifest
+        self.stages = list(self.STAGES) if stages is None else stages
+        self.llm_caller = LLMCaller()
+        self.init_generator = PromptGenerator('./templates', [])
+        self.case_generator = PromptGenerator('./templates', task_setting.PROMPT_LIST)
+        self.budgeter = ContextBudgeter(task_setting.CONTEXT_TOKEN_BUDGET)
+        self.searchers = {}
+        self.repairers = Post.RepairerPool(file_structure, task_setting, dataset_info)
+        self.project_locks = {}
+        self.records = {}
+        self.lock = threading.Lock()
+        self.cpu_pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="prompt")
+        self.llm_pool = concurrent.futures.ThreadPoolExecutor(max_workers=task_setting.MAX_WORKERS, thread_name_prefix="llm")
+        self.build_pool = concurrent.futures.ThreadPoolExecutor(max_workers=task_setting.BUILD_WORKERS, thread_name_prefix="build")
+        self.logger = logging.getLogger(__name__)
+
+    def _project_lock(self, pj_name:str, kind:str) -> threading.Lock:
+        with self.lock:
+            return self.project_locks.setdefault((kind, pj_name), threading.Lock())
+
+    def _get_searcher(self, pj_name:str) -> CodeSearcher:
+        # created lazily by the first method of the project, similar functions of the project are prefetched once
+        with self._project_lock(pj_name, "search"):
+            if pj_name not in self.searchers:
+                pj_info = self.dataset_info[pj_name]
+                project_path = f"{self.file_structure.DATASET_PATH}/{pj_info['project-url']}"
+                searcher = CodeSearcher(project_path, pj_name, self.file_structure.CODE_INFO_PATH, self.task_setting.SIM_TOP_K)
+                searcher.prefetch_usage_search([(tinfo["class"], tinfo["method-name"]) for tinfo in pj_info["focal-methods"]])
+                self.searchers[pj_name] = searcher
+        return self.searchers[pj_name]
+
+    def _record(self, tid:str, stage:str, start:float):
+        with self.lock:
+            self.records.setdefault(tid, {})[stage] = round(time.time() - start, 2)
+        return
+
+    @staticmethod
+    def _class_path(task:tuple) -> str:
+        return f"{task[3]}/{task[0]['test-class'].split('.')[-1]}.java"
+
+    @staticmethod
+    def _snapshot_path(task:tuple, stage:str) -> str:
+        return f"{task[2]}/{task[0]['id']}/{stage}_class.java"
+
+    def _snapshot_class(self, task:tuple, stage:str):
+        io_utils.copy_file(self._class_path(task), self._snapshot_path(task, stage))
+        return
+
+    def _restore_class(self, task:tuple, stage:str):
+        # start from the output of the previous stage, the test class may be changed by later stages
+        snapshot = self._snapshot_path(task, stage)
+        if os.path.exists(snapshot):
+            io_utils.copy_file(snapshot, self._class_path(task))
+        return
+
+    def _run_prompt(self, pj_name:str, task:tuple):
+        task_info, project_prompt = task[0], task[1]
+        start = time.time()
+        prompt_dir = f"{project_prompt}/{task_info['id']}"
+        code_info = self.manifest.file_digest(f"{self.file_structure.CODE_INFO_PATH}/json/{pj_name}.json", cached=True)
+        templates = self.manifest.file_digest("./templates", cached=True)
+        input_hash = RunManifest.hash_inputs(json.dumps(task_info, sort_keys=True), code_info, templates,
+            self.task_setting.PROMPT_LIST, self.task_setting.SIM_TOP_K, self.task_setting.CONTEXT_TOKEN_BUDGET)
+        outputs = [f"{prompt_dir}/init_prompt.md"] + [f"{prompt_dir}/{name}_prompt.md" for name in self.task_setting.PROMPT_LIST]
+
+        def generate():
+            searcher = self._get_searcher(pj_name)
+            GenPrompt.generate_init_prompt(searcher, self.init_generator, self.budgeter, task_info, prompt_dir)
+            GenPrompt.generate_test_case_prompt(searcher, self.case_generator, self.budgeter, task_info, prompt_dir)
+        if self.manifest.run_stage(pj_name, task_info["id"], "prompt", input_hash, outputs, generate):
+            self._record(task_info["id"], "prompt", start)
+
+    def _llm_inputs(self) -> list:
+        return [self.llm_caller.model, self.llm_caller.temperature]
+
+    def _run_framework(self, pj_name:str, task:tuple):
+        tid = task[0]["id"]
+        start = time.time()
+        init_prompt = self.manifest.file_digest(f"{task[1]}/{tid}/init_prompt.md")
+        input_hash = RunManifest.hash_inputs(init_prompt, *self._llm_inputs())
+        outputs = [self._snapshot_path(task, "framework"), self._class_path(task)]
+
+        def generate():
+            GenCode.process_init_response(self.llm_caller, *task, self.task_setting.SAVE_INTER_RESULT)
+            self._snapshot_class(task, "framework")
+        if self.manifest.run_stage(pj_name, tid, "framework", input_hash, outputs, generate):
+            self._record(tid, "framework", start)
+
+    def _run_testcase(self, pj_name:str, task:tuple):
+        tid = task[0]["id"]
+        start = time.time()
+        prompt_list = self.task_setting.PROMPT_LIST
+        save_res = self.task_setting.SAVE_INTER_RESULT
+        case_then_code = self.task_setting.CASE_THEN_CODE
+        fanout = self.task_setting.CASE_FANOUT
+        prompts = [self.manifest.file_digest(f"{task[1]}/{tid}/{name}_prompt.md") for name in prompt_list]
+        input_hash = RunManifest.hash_inputs(self.manifest.output_hash(pj_name, tid, "framework"),
+            prompt_list, prompts, case_then_code, fanout, *self._llm_inputs())
+        outputs = [self._snapshot_path(task, "testcase"), self._class_path(task)]
+
+        def generate():
+            self._restore_class(task, "framework")
+            if case_then_code:
+                GenCode.process_case_response(self.llm_caller, *task, prompt_list, save_res, fanout)
+            else:
+                GenCode.process_code_response(self.llm_caller, *task, prompt_list, save_res)
+            self._snapshot_class(task, "testcase")
+        if self.manifest.run_stage(pj_name, tid, "testcase", input_hash, outputs, generate):
+            self._record(tid, "testcase", start)
+
+    def _run_verify(self, pj_name:str, task:tuple):
+        tid = task[0]["id"]
+        start = time.time()
+        usage_context = self.manifest.file_digest(f"{task[1]}/{tid}/usage_context.json")
+        input_hash = RunManifest.hash_inputs(self.manifest.output_hash(pj_name, tid, "testcase"),
+            usage_context, self.task_setting.FIX_TRIES)
+        outputs = [self._class_path(task)]
+
+        def verify():
+            # each build worker compiles in its own workspace of the project
+            self._restore_class(task, "testcase")
+            code_repair = self.repairers.get(pj_name)
+            Post.verify_test_class(code_repair, self.file_structure, pj_name, task[0])
+        if self.manifest.run_stage(pj_name, tid, "verify", input_hash, outputs, verify):
+            self._record(tid, "verify", start)
+
+    def _stage_plan(self) -> list:
+        plan = [
+            (self.cpu_pool, self._run_prompt),
+            (self.llm_pool, self._run_framework),
+            (self.llm_pool, self._run_testcase),
+            (self.build_pool, self._run_verify),
+        ]
+        return [(stage, *step) for stage, step in zip(self.STAGES, plan) if stage in self.stages]
+
+    def _submit(self, plan:list, index:int, pj_name:str, task:tuple, done:concurrent.futures.Future):
+        tid = task[0]["id"]
+        stage, pool, func = plan[index]
+        future = pool.submit(func, pj_name, task)
+
+        def on_done(fut:concurrent.futures.Future):
+            # exceptions raised in a done callback are swallowed, every path must finish the chain
+            try:
+                error = fut.exception()
+            except concurrent.futures.CancelledError as e:
+                error = e
+            if error is not None:
+                self.logger.error(f"Error in stage {stage} of {tid}: {error!r}")
+                done.set_result((tid, stage))
+            elif index + 1 < len(plan):
+                try:
+                    self._submit(plan, index + 1, pj_name, task, done)
+                except Exception as e:
+                    # e.g. RuntimeError after the pool is shut down
+                    self.logger.error(f"Failed to start stage {plan[index + 1][0]} of {tid}: {e!r}")
+                    done.set_result((tid, plan[index + 1][0]))
+            else:
+                self.logger.info(f"Completed all stages for {tid}")
+                done.set_result((tid, None))
+        future.add_done_callback(on_done)
+        return
+
+    def run(self) -> dict:
+        """
+        return: elapsed time of each stage, keyed by focal method id
+        """
+        plan = self._stage_plan()
+        tasks = []
+        projects = self.task_setting.PROJECTS
+        for pj_name in self.dataset_info.keys():
+            if len(projects) > 0 and pj_name not in projects: continue
+            project_data = {pj_name: self.dataset_info[pj_name]}
+            tasks.extend((pj_name, task) for task in GenCode.select_tasks(self.file_structure, self.task_setting, project_data))
+        for gen_folder in set(task[-1] for _, task in tasks):
+            if not os.path.exists(gen_folder): os.makedirs(gen_folder)
+        self.logger.info(f"Running pipeline for {len(tasks)} focal methods...")
+
+        chains = {}
+        for pj_name, task in tasks:
+            done = concurrent.futures.Future()
+            self._submit(plan, 0, pj_name, task, done)
+            chains[done] = pj_name
+        pending = collections.Counter(chains.values())
+        failed = []
+        for done in concurrent.futures.as_completed(chains):
+            tid, failed_stage = done.result()
+            if failed_stage is not None:
+                failed.append((tid, failed_stage))
+            pending[chains[done]] -= 1
+            if pending[chains[done]] == 0:
+                self._finish_project(chains[done])
+        if len(failed) > 0:
+            self.logger.warning(f"{len(failed)} focal methods stopped early: {failed}")
+        self.close()
+        return self.records
+
+    def _finish_project(self, pj_name:str):
+        # all methods of the project are done, its index is not needed any more
+        searcher = self.searchers.pop(pj_name, None)
+        if searcher is not None:
+            searcher.close()
+        ProjectKnowledge.release(pj_name)
+        return
+
+    def close(self):
+        for pool in (self.cpu_pool, self.llm_pool, self.build_pool):
+            pool.shutdown(wait=True)
+        for searcher in self.searchers.values():
+            searcher.close()
+        self.repairers.close()
+        return
@@ -2,16 +2,22 @@ import os
 import re
 import copy
 import jpype
+import shutil
 import logging
+import itertools
+import threading
+import collections
 import concurrent.futures
 from enum import Enum
 
 from tools import io_utils
 from tools.llm_api import LLMCaller
-from tools.execute_test import JavaRunner
+from tools.execute_test import JavaRunner, TestLauncher
 from tools.time_agent import TimeRecorder
 from tools.code_analysis import JavaCodeEditor
+from tools.class_merger import merge_test_class
 from tools.prompt_generator import PromptGenerator
+from tools.project_knowledge import ProjectKnowledge
 
 
 def check_class_name(init_class:str, tcname:str, pcname:str=""):
@@ -49,10 +55,9 @@ class CodeRepairer(JavaRunner):
     llm_caller: LLMCaller
     prompt_gen: PromptGenerator
     parser: JavaCodeEditor
-    class_editor: jpype.JClass
 
-    def __init__(self, dependency_fd, project_url, tc_path:str, fix_tries:int, impt_dict:dict):
-        super().__init__(project_url, dependency_fd)
+    def __init__(self, dependency_fd, project_url, tc_path:str, fix_tries:int, impt_dict:dict, workspace:str|None=None):
+        super().__init__(project_url, dependency_fd, workspace)
         self.max_tries = fix_tries
         self.half_tries = int((fix_tries)/2)
         self.url = project_url
@@ -62,7 +67,6 @@ class CodeRepairer(JavaRunner):
         self.llm_caller = LLMCaller()
         self.prompt_gen = PromptGenerator('./templates', [])
         self.parser = JavaCodeEditor()
-        self.class_editor = jpype.JClass("editcode.TestClassUpdator")
         self.logger = logging.getLogger(__name__)
 
     def compile_and_execute(self, class_path, test_class):
@@ -72,7 +76,10 @@ class CodeRepairer(JavaRunner):
             return (VerifyResult.COMPILE_ERROR, cfeedback, passrate)
         eflag, efeedback = self.run_singal_unit_test(test_class, coverage=False)
         passrate = -1.0
-        if eflag:
+        if eflag and self.test_result is not None:
+            summary = self.test_result["summary"]
+            if summary["started"] > 0: passrate = summary["successful"] / summary["started"]
+        elif eflag:
             try:
                 cases = int(re.findall(r"([0-9]+) tests started", efeedback)[0])
                 passed = int(re.findall(r"([0-9]+) tests successful", efeedback)[0])
@@ -90,6 +97,8 @@ class CodeRepairer(JavaRunner):
         '''
         rule_fixes = []
         llm_fixes = []
+        if self.compile_diagnostics is not None:
+            return self.parse_compile_diagnostics(self.compile_diagnostics)
         split_str = class_path.replace("/", "\\")
         errors = feedback.split(f"{split_str}:")
         for error in errors:
@@ -111,7 +120,43 @@ class CodeRepairer(JavaRunner):
                 continue
         return [rule_fixes, llm_fixes]
 
+    def parse_compile_diagnostics(self, diagnostics:list):
+        '''
+        Classify the structured diagnostics of the in-JVM compiler by diagnostic code.
+        '''
+        rule_fixes = []
+        llm_fixes = []
+        for diag in diagnostics:
+            if diag["kind"] != "error": continue
+            if diag["line"] < 1:
+                # no position in the test class (NOPOS), e.g. a class on the classpath can't be accessed
+                self.logger.warning(f"compile error without line number: {diag['message']}")
+                continue
+            line = diag["line"] - 1
+            msg = diag["message"]
+            code = diag["code"] or ""
+            if code.startswith("compiler.err.cant.resolve"):
+                rule_fixes.append([line, msg, RuleError.UNRESLOVE_SYMBOL])
+            elif code == "compiler.err.unreported.exception.need.to.catch.or.throw":
+                rule_fixes.append([line, msg, RuleError.UNREPORTED_EXCEPTION])
+            elif code == "compiler.err.already.defined" and msg.startswith("class"):
+                rule_fixes.append([line, msg, RuleError.DUPLICATE_INNER_CLASS])
+            llm_fixes.append([line, msg])
+        return [rule_fixes, llm_fixes]
+
     def check_timeout_cases(self, test_class:str, code:str):
+        result = self.run_test_structured(test_class, timeout=60)
+        if result is not None and result["status"] != "error":
+            # remove the test cases still running when the time is out
+            running = [test["method"] for test in TestLauncher.iter_tests(result["tests"])
+                       if test.get("status") == "RUNNING" and "method" in test]
+            if len(running) == 0: return code
+            self.parser.parse(code)
+            start, end, mnames = self.parser.get_test_case_position()
+            lines = [[start[mnames.index(name)], end[mnames.index(name)]] for name in running if name in mnames]
+            if len(lines) > 0:
+                self.parser.remove_lines(lines)
+            return self.parser.get_code()
         feedback = self.run_test_verbose(test_class)
         """
         | | +-- testPrintContent()
@@ -157,15 +202,16 @@ class CodeRepairer(JavaRunner):
             elif type == RuleError.DUPLICATE_INNER_CLASS:
                 ster_flag = True
                 pass
-        if len(exception_lines) > 0:
-            self.logger.info(f"add exception declaration in lines {exception_lines}")
-            self.parser.add_exception(exception_lines)
-        if len(remove_imports) > 0:
-            self.logger.info(f"remove imports in lines {remove_imports}")
-            self.parser.remove_lines(remove_imports)
-        if len(add_imports) > 0:
-            self.logger.info(f"add imports {add_imports}")
-            self.parser.add_imports(list(add_imports))
+        with self.parser.edits():
+            if len(exception_lines) > 0:
+                self.logger.info(f"add exception declaration in lines {exception_lines}")
+                self.parser.add_exception(exception_lines)
+            if len(remove_imports) > 0:
+                self.logger.info(f"remove imports in lines {remove_imports}")
+                self.parser.remove_lines(remove_imports)
+            if len(add_imports) > 0:
+                self.logger.info(f"add imports {add_imports}")
+                self.parser.add_imports(list(add_imports))
         new_class = self.parser.get_code()
         if ster_flag:
             TestClassSterilizer = jpype.JClass("editcode.TestClassSterilizer")
@@ -185,7 +231,7 @@ class CodeRepairer(JavaRunner):
         }
         prompt = self.prompt_gen.generate_single("post", context)
         code, response = self.llm_caller.get_response_code(prompt)
-        code = str(self.class_editor.main([test_class, code, "true", response_path]))
+        code = merge_test_class(test_class, [code], force_update=True, info=response_path)
         io_utils.write_text(prompt_path, prompt)
         io_utils.write_text(response_path, response)
         # todo: transform to code diff
@@ -219,6 +265,7 @@ class CodeRepairer(JavaRunner):
         test_class = task_info["test-class"]
         class_name = test_path.split('/')[-1]
         class_path = f"{self.testclass_path}/{class_name}"
+        test_path = self.test_source_path(test_path)
         target_path = f"{self.url}/{test_path}"
         passrates = []
         count = 0
@@ -275,56 +322,107 @@ class CodeRepairer(JavaRunner):
         return
 
 
+def create_repairer(file_structure, task_setting, project_name:str, project_info:dict, workspace:str|None=None) -> CodeRepairer:
+    root_path = os.getcwd().replace("\\", "/")
+    dependency_path = f"{root_path}/{file_structure.DEPENDENCY_PATH}"
+    project_path = f"{root_path}/{file_structure.DATASET_PATH}/{project_info['project-url']}"
+    project_testclass = file_structure.TESTCLASSS_PATH.replace("<project>", project_name)
+    import_dict = ProjectKnowledge.for_project(project_path, project_name, file_structure.CODE_INFO_PATH).import_dict
+    return CodeRepairer(dependency_path, project_path, project_testclass, task_setting.FIX_TRIES, import_dict, workspace)
+
+
+class RepairerPool:
+    """
+    Repairers of worker threads. Each worker has its own workspace (test sources, test classes) in every project,
+    so that test classes of one project are repaired concurrently over the shared project build;
+    launcher workers of a thread are shared across projects.
+    """
+    WORKSPACE_DIR = "target/repair-workers"
+
+    def __init__(self, file_structure, task_setting, dataset_info:dict):
+        self.file_structure = file_structure
+        self.task_setting = task_setting
+        self.dataset_info = dataset_info
+        self.local = threading.local()
+        self.launchers = []
+        self.project_urls = set()
+        self.slot_ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def get(self, project_name:str) -> CodeRepairer:
+        if not hasattr(self.local, "repairers"):
+            with self.lock:
+                self.local.slot = next(self.slot_ids)
+            self.local.repairers = {}
+            self.local.launchers = None
+        if project_name not in self.local.repairers:
+            workspace = f"{self.WORKSPACE_DIR}/{self.local.slot}"
+            repairer = create_repairer(self.file_structure, self.task_setting, project_name, self.dataset_info[project_name], workspace)
+            if self.local.launchers is None:
+                self.local.launchers = (repairer.launcher, repairer.coverage_launcher)
+                with self.lock:
+                    self.launchers += [launcher for launcher in self.local.launchers if launcher is not None]
+            repairer.use_launchers(*self.local.launchers)
+            with self.lock:
+                self.project_urls.add(repairer.url)
+            self.local.repairers[project_name] = repairer
+        return self.local.repairers[project_name]
+
+    def close(self):
+        for launcher in self.launchers:
+            launcher.close()
+        for project_url in self.project_urls:
+            shutil.rmtree(f"{project_url}/{self.WORKSPACE_DIR}", ignore_errors=True)
+        return
+
+
+def verify_test_class(code_repair:CodeRepairer, file_structure, project_name:str, ts_info:dict):
+    tid = ts_info["id"]
+    project_prompt = file_structure.PROMPT_PATH.replace("<project>", project_name)
+    project_fix = file_structure.FIX_PATH.replace("<project>", project_name)
+    context_path = f"{project_prompt}/{tid}/usage_context.json"
+    case_prompt_path = f"{project_fix}/{tid}/repair_prompt"
+    case_response_path = f"{project_fix}/{tid}/repair_response"
+    code_repair.check_test_class(ts_info, case_prompt_path, case_response_path, context_path)
+    return tid
+
+
 def verify_test_classes(file_structure, task_setting, dataset_info):
     '''
     Compile test class to check correctness
     If there are compilation errors, fix the test cases through compilation feedback.
     '''
-    root_path = os.getcwd().replace("\\", "/")
-    dependency_path = f"{root_path}/{file_structure.DEPENDENCY_PATH}"
-    dataset_dir = file_structure.DATASET_PATH
-    code_info_path = file_structure.CODE_INFO_PATH
-    prompt_path = file_structure.PROMPT_PATH
-    fix_path = file_structure.FIX_PATH
-    testclass_path = file_structure.TESTCLASSS_PATH
     projects = task_setting.PROJECTS
     case_list = task_setting.CASES_LIST
-    fix_tries = task_setting.FIX_TRIES
     project_select = True if len(projects)>0 else False
     case_select = True if len(case_list)>0 else False
-    mworker = len(dataset_info)
     logger = logging.getLogger(__name__)
+    repairers = RepairerPool(file_structure, task_setting, dataset_info)
+
+    def run_task(project_name, ts_info):
+        code_repair = repairers.get(project_name)
+        return verify_test_class(code_repair, file_structure, project_name, ts_info)
 
-    def run_project(project_info, project_name):
-        project_path = f"{root_path}/{dataset_dir}/{project_info['project-url']}"
-        project_prompt = prompt_path.replace("<project>", project_name)
-        project_fix = fix_path.replace("<project>", project_name)
-        project_testclass = testclass_path.replace("<project>", project_name)
-        code_info = io_utils.load_json(f"{code_info_path}/json/{project_name}.json")
-        import_dict = code_info["import_dict"]
-        code_repair = CodeRepairer(dependency_path, project_path, project_testclass, fix_tries, import_dict)
-
-        for ts_info in project_info["focal-methods"]:
-            tid = ts_info["id"]
-            if case_select and tid not in case_list: continue
-            context_path = f"{project_prompt}/{tid}/usage_context.json"
-            case_prompt_path = f"{project_fix}/{tid}/repair_prompt"
-            case_response_path = f"{project_fix}/{tid}/repair_response"
-            code_repair.check_test_class(ts_info, case_prompt_path, case_response_path, context_path)
-        return project_path
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=mworker) as executor:
-        futures = []
+    # one pool for the test classes of all projects, so that large projects don't bound the time
+    with concurrent.futures.ThreadPoolExecutor(max_workers=task_setting.BUILD_WORKERS) as executor:
+        futures = {}
         for pj_name, pj_info in dataset_info.items():
             if project_select and pj_name not in projects: continue
             logger.info(f"verify process test classes in {pj_name}...")
-            futures.append(executor.submit(run_project, pj_info, pj_name))
+            for ts_info in pj_info["focal-methods"]:
+                if case_select and ts_info["id"] not in case_list: continue
+                futures[executor.submit(run_task, pj_name, ts_info)] = pj_name
+        pending = collections.Counter(futures.values())
         for future in concurrent.futures.as_completed(futures):
             try:
-                project_path = future.result()
-                logger.info(f"Post process completed: {project_path}")
+                tid = future.result()
+                logger.info(f"Post process completed: {futures[future]} {tid}")
             except Exception as e:
-                logger.error(f"Error in post process: {e}")
+                logger.error(f"Error in post process of {futures[future]}: {e}")
+            pending[futures[future]] -= 1
+            if pending[futures[future]] == 0:
+                ProjectKnowledge.release(futures[future])
+    repairers.close()
     return
 
 
@@ -1,10 +1,10 @@
 import re
-import copy
-import networkx as nx
-from queue import Queue
-from networkx import DiGraph
+from array import array
+from collections import deque
+from networkx import DiGraph, strongly_connected_components
 
 import tools.io_utils as io_utils
+from tools.signature_index import SignatureIndex
 
 
 def process_signature(osig, return_type=None):
@@ -35,6 +35,52 @@ structure of calling graph:
     }
 }
 '''
+def callee_entries(cinfo:dict) -> dict:
+    '''
+    calling graph entries of the methods and constructors of a class, without callers
+    '''
+    class_data = {}
+    for _, method_infos in cinfo["methods"].items():
+        for minfo in method_infos:
+            return_type = minfo["return_type"].split('.')[-1] + " "
+            method_sig = process_signature(minfo["signature"], return_type)
+            class_data[method_sig] = {
+                "type": minfo["access_type"],
+                "caller": []
+            }
+    for minfo in cinfo["constructors"]:
+        method_sig = minfo["signature"]
+        class_data[method_sig] = {
+                "type": minfo["access_type"],
+                "caller": []
+        }
+    return class_data
+
+
+def add_callers(calling_graph:dict, class_fqn:str, cinfo:dict, callee_classes:set|None=None):
+    '''
+    add the methods of a class as callers of the methods they call, only in callee_classes if given
+    '''
+    for _, method_infos in cinfo["methods"].items():
+        for minfo in method_infos:
+            method_sig = minfo["signature"]
+            return_type = minfo["return_type"].split('.')[-1] + " "
+            # method_sig = method_sig[method_sig.index(return_type)+len(return_type):]
+            method_sig = process_signature(method_sig, return_type)
+
+            for call_info in minfo["call_methods"]:
+                call_split = call_info["signature"].split('#')
+                callee = call_split[0]
+                if callee_classes is not None and callee not in callee_classes: continue
+                call_sig = process_signature(call_split[-1])
+                if callee in calling_graph and call_sig in calling_graph[callee]:
+                    calling_graph[callee][call_sig]["caller"].append({
+                        "sig": f"{class_fqn}#{method_sig}",
+                        "lines": call_info["line_numbers"]
+                        })
+    return
+
+
 def build_calling_graph(file_structure):
     code_info_path = file_structure.CODE_INFO_PATH
     dataset_dir = f"{file_structure.DATASET_PATH}/dataset_info.json"
@@ -45,53 +91,139 @@ def build_calling_graph(file_structure):
         code_info = io_utils.load_json(f"{code_info_path}/json/{pj_name}.json")
         source_data = code_info["source"]
         for class_fqn, cinfo in source_data.items():
-            class_data = {}
-            for _, method_infos in cinfo["methods"].items():
-                for minfo in method_infos:
-                    return_type = minfo["return_type"].split('.')[-1] + " "
-                    method_sig = process_signature(minfo["signature"], return_type)
-                    class_data[method_sig] = {
-                        "type": minfo["access_type"],
-                        "caller": []
-                    }
-            for minfo in cinfo["constructors"]:
-                method_sig = minfo["signature"]
-                class_data[method_sig] = {
-                        "type": minfo["access_type"],
-                        "caller": []
-                }
-            calling_graph.update({class_fqn: class_data})
+            calling_graph.update({class_fqn: callee_entries(cinfo)})
 
         for class_fqn, cinfo in source_data.items():
-            # class_data = calling_graph[class_fqn]
-            for _, method_infos in cinfo["methods"].items():
-                for minfo in method_infos:
-                    method_sig = minfo["signature"]
-                    return_type = minfo["return_type"].split('.')[-1] + " "
-                    # method_sig = method_sig[method_sig.index(return_type)+len(return_type):]
-                    method_sig = process_signature(method_sig, return_type)
-
-                    for call_info in minfo["call_methods"]:
-                        call_split = call_info["signature"].split('#')
-                        callee = call_split[0]
-                        call_sig = process_signature(call_split[-1])
-                        if callee in calling_graph and call_sig in calling_graph[callee]:
-                            calling_graph[callee][call_sig]["caller"].append({
-                                "sig": f"{class_fqn}#{method_sig}",
-                                "lines": call_info["line_numbers"]
-                                })
+            add_callers(calling_graph, class_fqn, cinfo)
         graph_path = f"{code_info_path}/codegraph/{pj_name}_callgraph.json"
         io_utils.write_json(graph_path, calling_graph)
 
 
+class CompactCFG:
+    '''
+    control flow graph of a method in CSR form:
+    successors of node i are targets[offsets[i]:offsets[i+1]], its lines are lines[line_offsets[i]:line_offsets[i+1]]
+    '''
+    kinds: list
+    offsets: array
+    targets: array
+    line_offsets: array
+    lines: array
+
+    def __init__(self, mdata:dict):
+        ids = {}
+        for node in mdata["nodes"]:
+            ids.setdefault(node["id"], len(ids))
+        for edge in mdata["edges"]:
+            ids.setdefault(edge["source"], len(ids))
+            ids.setdefault(edge["target"], len(ids))
+        self.kinds = [None] * len(ids)
+        node_lines = [[] for _ in range(len(ids))]
+        for node in mdata["nodes"]:
+            self.kinds[ids[node["id"]]] = node["kind"]
+            node_lines[ids[node["id"]]] = node["lines"]
+        self.line_offsets = array("i", [0])
+        self.lines = array("i")
+        for lines in node_lines:
+            self.lines.extend(lines)
+            self.line_offsets.append(len(self.lines))
+        successors = [[] for _ in range(len(ids))]
+        for edge in mdata["edges"]:
+            target = ids[edge["target"]]
+            if target not in successors[ids[edge["source"]]]:
+                successors[ids[edge["source"]]].append(target)
+        self.offsets = array("i", [0])
+        self.targets = array("i")
+        for succ in successors:
+            self.targets.extend(succ)
+            self.offsets.append(len(self.targets))
+        # the last BEGIN node is the entry
+        self.begin = max((i for i, kind in enumerate(self.kinds) if kind == "BEGIN"), default=None)
+        self._line_nodes = None
+        self._preds = None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def successors(self, node:int):
+        return self.targets[self.offsets[node]:self.offsets[node+1]]
+
+    def node_lines(self, node:int):
+        return self.lines[self.line_offsets[node]:self.line_offsets[node+1]]
+
+    def line_nodes(self, line:int) -> list:
+        if self._line_nodes is None:
+            self._line_nodes = {}
+            for node in range(len(self.kinds)):
+                for nline in self.node_lines(node):
+                    self._line_nodes.setdefault(nline, []).append(node)
+        return self._line_nodes.get(line, [])
+
+    def shortest_path_preds(self) -> dict:
+        '''
+        predecessors of each node reachable from BEGIN on its shortest paths, computed by one BFS
+        '''
+        if self._preds is None:
+            self._preds = {}
+            if self.begin is not None:
+                self._preds[self.begin] = []
+                distance = {self.begin: 0}
+                bfs_queue = deque([self.begin])
+                while len(bfs_queue) > 0:
+                    node = bfs_queue.popleft()
+                    for succ in self.successors(node):
+                        if succ not in distance:
+                            distance[succ] = distance[node] + 1
+                            self._preds[succ] = [node]
+                            bfs_queue.append(succ)
+                        elif distance[succ] == distance[node] + 1:
+                            self._preds[succ].append(node)
+        return self._preds
+
+
+class CFGStore:
+    '''
+    method CFGs of a project kept as loaded from json, a CompactCFG is built on the first query of a method
+    '''
+    cfg_data: dict
+    index: SignatureIndex
+    cfgs: dict
+
+    def __init__(self, cfg_data:dict):
+        self.cfg_data = cfg_data
+        self.index = SignatureIndex()
+        self.cfgs = {}
+        for class_fqn, cdata in cfg_data.items():
+            for method_sig in cdata.keys():
+                self.index.add(class_fqn, method_sig, (class_fqn, method_sig))
+        return
+
+    def __len__(self):
+        return len(self.index)
+
+    def find(self, class_fqn:str, method_sig:str) -> CompactCFG|None:
+        key = self.index.find(class_fqn, method_sig)
+        if key is None: return None
+        if key not in self.cfgs:
+            self.cfgs[key] = CompactCFG(self.cfg_data[key[0]][key[1]])
+        return self.cfgs[key]
+
+
 class InvokePatternExtractor:
     code_info: dict
     calling_data: dict
     call_graph: DiGraph
-    method_cfgs: dict
+    method_cfgs: CFGStore
+    method_index: SignatureIndex
+    chain_cache: dict
+    expansion_cache: dict
+    cyclic_nodes: set
 
     def __init__(self, code_info_path, calling_path, cfg_path):
         self.code_info = io_utils.load_json(code_info_path)
+        self.method_index = SignatureIndex.from_code_info(self.code_info["source"])
+        self.chain_cache = {}
+        self.expansion_cache = {}
         self.calling_data = io_utils.load_json(calling_path)
         cfg_data = io_utils.load_json(cfg_path)
         self.build_calling_graph(self.calling_data)
@@ -116,21 +248,12 @@ class InvokePatternExtractor:
             if len(list(graph.neighbors(node))) + len(list(graph.predecessors(node))) == 0:
                 graph.remove_node(node)
         self.call_graph = graph
+        private_graph = graph.subgraph([node for node, node_type in graph.nodes(data="type") if node_type == "PRIVATE"])
+        self.cyclic_nodes = {node for nodes in strongly_connected_components(private_graph) if len(nodes) > 1 for node in nodes}
         return
 
     def build_method_cfg(self, cfg_data):
-        cfg_cache = {}
-        for class_fqn, cdata in cfg_data.items():
-            for method_sig, mdata in cdata.items():
-                method_graph = DiGraph()
-                nodes = []
-                edges = []
-                nodes = [(node["id"], {"kind": node["kind"], "lines": node["lines"]}) for node in mdata["nodes"]]
-                edges = [(edge["source"], edge["target"], {"is_back": edge["is_back"]}) for edge in mdata["edges"]]
-                method_graph.add_nodes_from(nodes)
-                method_graph.add_edges_from(edges)
-                cfg_cache[f"{class_fqn}#{method_sig}"] = method_graph
-        self.method_cfgs = cfg_cache
+        self.method_cfgs = CFGStore(cfg_data)
         return
 
     def _build_path(self, prev, start_id):
@@ -143,26 +266,71 @@ class InvokePatternExtractor:
             cur_node = prev[cur_node_id]
         return path
 
-    def get_call_chain(self, node_id):
-        bfs_queue = Queue()
-        bfs_queue.put((node_id,[]))
+    def _in_chain(self, entries:list, index:int, node_id) -> bool:
+        while index >= 0:
+            if entries[index][0] == node_id: return True
+            index = entries[index][2]
+        return False
+
+    def _build_chain(self, entries:list, index:int) -> list:
+        chain = []
+        while index >= 0:
+            chain.append((entries[index][0], entries[index][1]))
+            index = entries[index][2]
+        chain.reverse()
+        return chain
+
+    def get_call_chain(self, node_id, k=3):
+        '''
+        the k shortest chains from a method through private callers to a non-private caller (or back into the chain),
+        chain: [("<caller>", [target_lines]), ...]
+        the expansion of each private caller out of call cycles is searched once and reused by the chains of other methods
+        '''
+        if node_id in self.chain_cache: return self.chain_cache[node_id]
+        call_chains = self._search_chains(node_id, k, set())
+        self.chain_cache[node_id] = call_chains
+        return call_chains
+
+    def _search_chains(self, node_id, k:int, chain:set) -> list:
+        '''
+        chains from the callers of node_id, chain: private callers in the chain searched so far
+        '''
+        if node_id in self.cyclic_nodes: return self._search_cycle(node_id, k, chain)
+        cacheable = node_id in chain
+        if cacheable and node_id in self.expansion_cache: return self.expansion_cache[node_id]
+        candidates = []
+        for _, caller, edge in self.call_graph.edges(node_id, data=True):
+            step = (caller, edge["target"])
+            if self.call_graph.nodes[caller]["type"] != "PRIVATE" or caller in chain:
+                candidates.append([step])
+                continue
+            chain.add(caller)
+            candidates.extend([step] + caller_chain for caller_chain in self._search_chains(caller, k, chain))
+            chain.discard(caller)
+        # stable: chains of the same length keep the order of the callers
+        call_chains = sorted(candidates, key=len)[:k]
+        if cacheable: self.expansion_cache[node_id] = call_chains
+        return call_chains
+
+    def _search_cycle(self, node_id, k:int, chain:set) -> list:
+        '''
+        expansion of a method in a call cycle, it depends on the chain and is not cached;
+        breadth first, paths share their prefixes through parent pointers and the search stops once k chains are found
+        '''
+        # entries: (node, target lines, index of the parent entry), -1 is node_id
+        entries = []
+        frontier = deque([-1])
         call_chains = []
-        while not bfs_queue.empty():
-            cur_node_id, path = bfs_queue.get()
-            for edge in self.call_graph.edges(cur_node_id,data=True):
-                caller = edge[1]
-                caller_node = self.call_graph.nodes[caller]
-                chain = [node[0] for node in path]
-                npath = copy.deepcopy(path)
-                npath.append((caller, edge[2]["target"]))
-                if caller_node["type"] == "PRIVATE" and caller not in chain:
-                    bfs_queue.put((caller, npath))
+        while len(frontier) > 0 and len(call_chains) < k:
+            index = frontier.popleft()
+            cur_node_id = node_id if index < 0 else entries[index][0]
+            for _, caller, edge in self.call_graph.edges(cur_node_id, data=True):
+                entries.append((caller, edge["target"], index))
+                if self.call_graph.nodes[caller]["type"] == "PRIVATE" and caller not in chain and not self._in_chain(entries, index, caller):
+                    frontier.append(len(entries) - 1)
                 else:
-                    call_chains.append(npath)
-        # keep the shortest 3 paths
-        call_chains.sort(key=lambda x: len(x))
-        call_chains = call_chains[:min(3, len(call_chains))]
-        print("call_chains of ",node_id,": ",call_chains)
+                    call_chains.append(self._build_chain(entries, len(entries) - 1))
+                    if len(call_chains) == k: break
         return call_chains
 
     def _order_code_lines(self, code_lines:list):
@@ -187,63 +355,34 @@ class InvokePatternExtractor:
         else: ordered_lines.append([start, end])
         return (ordered_lines, length)
 
-    def _get_lines_from_cfg(self, cfg:DiGraph, target_lines):
+    def _get_lines_from_cfg(self, cfg:CompactCFG, target_lines):
+        '''
+        lines of all nodes on the shortest paths from BEGIN to the nodes of the target lines
+        '''
         visited = set(target_lines)
-        # find the node with kind="BEGIN"
-        start_node = None
-        target_nodes = set()
-        for nid, node in cfg.nodes.data():
-            if any(line in node["lines"] for line in target_lines):
-                target_nodes.add(nid)
-            if node["kind"] == "BEGIN":
-                start_node = nid
         # If no BEGIN node is found, return the visited lines
-        if start_node is None:
+        if cfg.begin is None:
             return list(visited)
-        for target in target_nodes:
-            paths = nx.all_shortest_paths(cfg, start_node, target)
-            for path in paths:
-                for node in path:
-                    visited.update(cfg.nodes[node]["lines"])
+        preds = cfg.shortest_path_preds()
+        # mark backwards along the shortest-path predecessors, unreachable targets have no path
+        stack = [node for line in set(target_lines) for node in cfg.line_nodes(line) if node in preds]
+        on_path = set()
+        while len(stack) > 0:
+            node = stack.pop()
+            if node in on_path: continue
+            on_path.add(node)
+            stack.extend(preds[node])
+        for node in on_path:
+            visited.update(cfg.node_lines(node))
         return list(visited)
 
-    def _equal_sig(self, candidate, target):
-        cand_parts = candidate.replace("(", "( ").replace(")", " )").split()
-        target_parts = target.replace("(", "( ").replace(")", " )").split()
-        if len(cand_parts) != len(target_parts):
-            return False
-        if cand_parts[0] != target_parts[0]:
-            return False
-        for item_m, item_t in zip(cand_parts[1:-1], target_parts[1:-1]):
-            if item_m.startswith("Object"): continue
-            if len(item_t.replace(',','')) == 1: continue
-            elif not item_t.startswith(item_m):
-                return False
-        return True
-
     def _get_lines_from_method(self, class_fqn, method_sig, target_lines):
-        class_info = self.code_info["source"][class_fqn]
-        method_info = None
-        for method, m_infos in class_info["methods"].items():
-            if method_sig.find(method) != -1:
-                for m_info in m_infos:
-                    if process_signature(m_info["signature"]).endswith(method_sig):
-                        method_info = m_info
-                        break
-        if method_info is None:
-            for m_info in class_info["constructors"]:
-                if process_signature(m_info["signature"]).endswith(method_sig):
-                    method_info = m_info
-                    break
+        method_info = self.method_index.find(class_fqn, method_sig)
         if method_info is None:
             err_msg = f"method {method_sig} not found in class {class_fqn}"
             raise ValueError(err_msg)
-        method_cfg = None
         full_sig = f"{class_fqn}#{method_sig}"
-        for candidate in self.method_cfgs.keys():
-            if self._equal_sig(candidate, full_sig):
-                method_cfg = self.method_cfgs[candidate]
-                break
+        method_cfg = self.method_cfgs.find(class_fqn, method_sig)
         if method_cfg is None:
             err_msg = f"sig {full_sig} not found in method cfg"
             print(err_msg)
@@ -298,7 +437,10 @@ class InvokePatternExtractor:
         }
     }
     '''
-    def extract_invoke_pattern(self):
+    def extract_invoke_pattern(self, node_ids:set|None=None):
+        '''
+        node_ids: extract the patterns of these methods ("<class_fqn>#<method_sig>") only, default all methods
+        '''
         invoke_patterns = {}
         # extract invoke pattern
         for class_fqn, cdata in self.calling_data.items():
@@ -306,6 +448,7 @@ class InvokePatternExtractor:
             for method_sig, mdata in cdata.items():
                 if len(mdata["caller"])==0: continue
                 node_id = f"{class_fqn}#{method_sig}"
+                if node_ids is not None and node_id not in node_ids: continue
                 if mdata["type"] == "PRIVATE":
                     call_chains = self.get_call_chain(node_id)
                     if len(call_chains)==0: continue
@@ -0,0 +1,64 @@
+import random
+
+from procedure.preprocess_project import InvokePatternExtractor
+
+
+def make_extractor(calling_data:dict) -> InvokePatternExtractor:
+    extractor = InvokePatternExtractor.__new__(InvokePatternExtractor)
+    extractor.chain_cache = {}
+    extractor.expansion_cache = {}
+    extractor.build_calling_graph(calling_data)
+    return extractor
+
+
+def calls(*callers) -> list:
+    return [{"sig": f"C#{caller}", "lines": [i]} for i, caller in enumerate(callers)]
+
+
+def chains(extractor, method:str) -> list:
+    return [[caller for caller, _ in chain] for chain in extractor.get_call_chain(f"C#{method}")]
+
+
+def shortest_chains(extractor, node_id, k=3) -> list:
+    # reference: breadth first over all paths, a chain ends at a non-private caller or back into the chain
+    found = []
+    paths = [[]]
+    while len(paths) > 0 and len(found) < k:
+        path = paths.pop(0)
+        last = path[-1][0] if path else node_id
+        for _, caller, edge in extractor.call_graph.edges(last, data=True):
+            chain = path + [(caller, edge["target"])]
+            if extractor.call_graph.nodes[caller]["type"] == "PRIVATE" and caller not in [node for node, _ in path]:
+                paths.append(chain)
+            else:
+                found.append(chain)
+                if len(found) == k: break
+    return found
+
+
+def test_chains_through_private_callers():
+    extractor = make_extractor({"C": {
+        "helper()": {"type": "PRIVATE", "caller": calls("inner()", "api()")},
+        "inner()": {"type": "PRIVATE", "caller": calls("api2()")},
+        "api()": {"type": "PUBLIC", "caller": []},
+        "api2()": {"type": "PUBLIC", "caller": []},
+        "other()": {"type": "PRIVATE", "caller": calls("inner()")},
+    }})
+    assert chains(extractor, "helper()") == [["C#api()"], ["C#inner()", "C#api2()"]]
+    # the expansion of inner() is reused
+    assert "C#inner()" in extractor.expansion_cache
+    assert chains(extractor, "other()") == [["C#inner()", "C#api2()"]]
+
+
+def test_chains_in_call_cycles_match_breadth_first_search():
+    for seed in range(100):
+        rnd = random.Random(seed)
+        size = rnd.randint(3, 30)
+        data = {"C": {f"m{i}()": {"type": "PRIVATE" if rnd.random() < 0.7 else "PUBLIC",
+                                  "caller": calls(*[f"m{rnd.randrange(size)}()" for _ in range(rnd.randint(0, 3))])}
+                      for i in range(size)}}
+        extractor = make_extractor(data)
+        nodes = [node for node, node_type in extractor.call_graph.nodes(data="type") if node_type == "PRIVATE"]
+        rnd.shuffle(nodes)
+        for node in nodes:
+            assert extractor.get_call_chain(node) == shortest_chains(extractor, node), (seed, node)
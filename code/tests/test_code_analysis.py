@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from tools.code_analysis import JavaASTParser, JavaCodeEditor
+
+
+def make_test_class(cases:int) -> str:
+    lines = ["package a.b;", "import java.util.List;", "import java.io.File;", "", "public class BigTest {"]
+    for i in range(cases):
+        lines += ["    @Test", f"    public void test{i}() {{", f"        int x{i} = {i};", f"        assertEquals(x{i}, \"é{i}\");", "    }", ""]
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def test_imports_removed_and_added_in_one_batch():
+    editor = JavaCodeEditor()
+    editor.parse('package p;\nimport a.A;\nimport b.B;\nimport c.C;\nimport d.D;\npublic class T {\n}')
+    with editor.edits():
+        editor.remove_lines([1, 2])
+        editor.add_imports(['import z.Z;'])
+    assert editor.lines == ['package p;', 'import c.C;', 'import d.D;', 'import z.Z;', 'public class T {', '}']
+    assert editor.import_position == 4
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_incremental_edits_match_full_parse(batch):
+    rnd = random.Random(1)
+    source = make_test_class(40)
+    for _ in range(50):
+        editor = JavaCodeEditor()
+        editor.parse(source)
+
+        def edit():
+            for _ in range(rnd.randint(1, 5)):
+                length = editor.get_length()
+                choice = rnd.random()
+                if choice < 0.3:
+                    start = rnd.randrange(length)
+                    editor.remove_lines([rnd.randrange(length), [start, min(start + rnd.randrange(10), length - 1)]])
+                elif choice < 0.5:
+                    editor.comment_code([rnd.randrange(length), [length - 3, length - 1]])
+                elif choice < 0.7:
+                    editor.add_imports(["import x.Y;", "import z.W;"])
+                else:
+                    editor.add_exception([rnd.randrange(length)])
+        if batch:
+            with editor.edits(): edit()
+        else:
+            edit()
+
+        reference = JavaASTParser()
+        reference.parse(editor.get_code())
+        assert str(editor.tree.root_node) == str(reference.tree.root_node)
+        assert editor.get_test_case_position() == reference.get_test_case_position()
+        assert editor.import_position == reference.import_position
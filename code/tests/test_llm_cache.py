@@ -0,0 +1,17 @@
+from tools.llm_cache import LLMCache
+
+
+def test_repeated_prompt_is_a_new_sample(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    key = LLMCache.make_key("model", 0.5, None, "system", "prompt")
+    cache = LLMCache(db_path)
+    for response in ("first", "second"):
+        sample = cache.sample_key(key)
+        assert cache.get(sample) is None
+        cache.put(sample, "model", response)
+    cache.close()
+
+    # a re-executed run replays the samples in order
+    replay = LLMCache(db_path, mode="read-only")
+    assert [replay.get(replay.sample_key(key)) for _ in range(3)] == ["first", "second", None]
+    replay.close()
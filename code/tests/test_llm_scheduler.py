@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+from tools.llm_scheduler import AccountScheduler, TokenBucket, parse_duration
+
+
+def test_parse_duration():
+    assert parse_duration("20") == 20
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("6m0s") == 360
+    assert parse_duration(None) is None
+
+
+def test_server_rate_holds_until_reset():
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+    bucket.sync(0, 0.2)
+    assert bucket.rate == 300
+    time.sleep(0.3)
+    assert bucket.available() == 60
+    assert bucket.rate == bucket.base_rate
+
+
+def test_released_trial_can_be_acquired_again():
+    scheduler = AccountScheduler([{}], 60, 100000, cooldown=0.05)
+    for _ in range(AccountScheduler.FAILURE_THRESHOLD):
+        scheduler.report_failure(0)
+    assert scheduler.accounts[0].circuit == "open"
+    time.sleep(0.1)
+
+    async def trial():
+        await scheduler.acquire(10)
+        assert scheduler.accounts[0].trial_running
+        # e.g. a bad request: nothing is known about the account
+        scheduler.release(0)
+        return await asyncio.wait_for(scheduler.acquire(10), 1)
+    assert asyncio.run(trial()) == 0
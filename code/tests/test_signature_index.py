@@ -0,0 +1,24 @@
+from tools.signature_index import SignatureIndex, normalize_signature
+
+
+def test_normalize_signature():
+    assert normalize_signature("private static <T> List<T> orderFirst(org.jdom2.Namespace, List<Namespace>)") == "orderFirst(Namespace, List)"
+    assert normalize_signature("FilterList#size()") == "FilterList#size()"
+
+
+def test_find():
+    index = SignatureIndex()
+    index.add("a.ContentList", "public int size()", "size")
+    index.add("a.ContentList", "public void add(int, Content)", "add")
+    assert index.find("a.ContentList", "size()") == "size"
+    assert index.find("a.ContentList", "add(int, Element)") is None
+    # fuzzy: erased types match any type
+    index.add("a.ContentList", "public void put(Object)", "put")
+    assert index.find("a.ContentList", "put(String)") == "put"
+    assert index.find("a.ContentList", "put(String)", fuzzy=False) is None
+
+
+def test_inner_class_call_is_not_resolved_in_the_outer_class():
+    index = SignatureIndex()
+    index.add("a.ContentList", "public int size()", "size")
+    assert index.find("a.ContentList", "FilterList#size()") is None
@@ -0,0 +1,396 @@
+import jpype
+import logging
+from tree_sitter import Node
+from tools.code_analysis import JavaASTParser, JavaCodeEditor, LIFECYCLE_ANNOTATIONS, TEST_ANNOTATIONS
+
+TYPE_DECLARATIONS = ('class_declaration', 'interface_declaration', 'enum_declaration', 'record_declaration')
+COMMENTS = ('line_comment', 'block_comment')
+
+
+def _text(node:Node) -> str:
+    return node.text.decode('utf-8') # pyright: ignore[reportOptionalMemberAccess]
+
+
+def _indent(line:str) -> str:
+    return line[:len(line)-len(line.lstrip())]
+
+
+def _reindent(lines:list[str], from_indent:str, to_indent:str) -> list[str]:
+    return [to_indent + line[len(from_indent):] if line.startswith(from_indent) and line.strip() else line
+            for line in lines]
+
+
+def _char_col(line:str, byte_col:int) -> int:
+    return len(line.encode('utf-8')[:byte_col].decode('utf-8', errors='ignore'))
+
+
+def _normalize(text:str) -> str:
+    return ' '.join(text.split())
+
+
+def _annotations(node:Node) -> set:
+    modifiers = next((child for child in node.children if child.type == 'modifiers'), None)
+    if modifiers is None: return set()
+    return {_text(child.child_by_field_name('name')).split('.')[-1] for child in modifiers.children # pyright: ignore
+            if child.type in ('marker_annotation', 'annotation')}
+
+
+def _method_kind(node:Node) -> str:
+    annotations = _annotations(node)
+    if annotations & LIFECYCLE_ANNOTATIONS: return 'lifecycle'
+    if annotations & TEST_ANNOTATIONS: return 'test'
+    return 'helper'
+
+
+def _empty_body(body:Node|None) -> bool:
+    return body is None or all(child.type in COMMENTS for child in body.named_children)
+
+
+def _method_sig(node:Node) -> str:
+    # name and parameter types, overloads are different methods
+    params = node.child_by_field_name('parameters')
+    types = [_normalize(_text(param.child_by_field_name('type') or param)) for param in params.named_children # pyright: ignore
+             if param.type in ('formal_parameter', 'spread_parameter')]
+    return f"{_text(node.child_by_field_name('name'))}({', '.join(types)})" # pyright: ignore
+
+
+def _method_key(node:Node) -> str:
+    # a method without its name, to find the same test under another name
+    return _normalize(_text(node.child_by_field_name('parameters')) + _text(node.child_by_field_name('body') or node)) # pyright: ignore
+
+
+def _split_block(block:str, indent:str) -> list[str]:
+    """
+    lines of a block with the braces on their own lines, indent: of the closing brace if it's moved
+    """
+    lines = block.split('\n')
+    first = lines[0][1:].strip()
+    if len(lines) == 1:
+        first = first[:-1].strip()
+        return ['{'] + ([indent + '    ' + first] if first else []) + [indent + '}']
+    last = lines[-1].rstrip()[:-1].rstrip()
+    inner = lines[1:-1]
+    if first: inner = [_indent(next((line for line in inner if line.strip()), indent + '    ')) + first] + inner
+    if last.strip(): inner, last = inner + [last], _indent(last)
+    return ['{'] + inner + [last + '}']
+
+
+def _type_name(text:str) -> str:
+    # "java.util.List<String>" -> "List"
+    return text.split('<')[0].split('.')[-1].strip()
+
+
+class _ClassView:
+    """
+    top level class of a parsed test class and its members
+    """
+    def __init__(self, parser:JavaASTParser):
+        self.parser = parser
+        root = parser.tree.root_node # pyright: ignore[reportOptionalMemberAccess]
+        types = [child for child in root.children if child.type in TYPE_DECLARATIONS]
+        self.node = next((node for node in types if node.type == 'class_declaration'), None)
+        if self.node is None: raise ValueError("no class declaration")
+        self.other_types = [node for node in types if node is not self.node]
+        self.imports = [child for child in root.children if child.type == 'import_declaration']
+        self.package = next((child for child in root.children if child.type == 'package_declaration'), None)
+        self.body = self.node.child_by_field_name('body')
+        self.members = [child for child in self.body.named_children if child.type not in COMMENTS] # pyright: ignore
+        self.fields = [node for node in self.members if node.type == 'field_declaration']
+        self.types = [node for node in self.members if node.type in TYPE_DECLARATIONS]
+        self.methods = [node for node in self.members if node.type == 'method_declaration']
+
+    def top(self, node:Node) -> Node:
+        # the comments right above a member belong to it
+        while node.prev_named_sibling is not None and node.prev_named_sibling.type in COMMENTS:
+            comment = node.prev_named_sibling
+            before = comment.prev_sibling
+            if comment.end_point[0] < node.start_point[0] - 1: break
+            if before is not None and before.end_point[0] == comment.start_point[0]: break
+            node = comment
+        return node
+
+    def member_lines(self, node:Node) -> list[str]:
+        """
+        full lines of the member with its comments, the member must not share lines with other code
+        """
+        top = self.top(node)
+        lines = self.parser.lines
+        first, last = lines[top.start_point[0]], lines[node.end_point[0]]
+        suffix = last[_char_col(last, node.end_point[1]):].strip()
+        if first[:_char_col(first, top.start_point[1])].strip() or (suffix and not suffix.startswith('//')):
+            raise ValueError(f"member shares lines with other code: {first.strip()}")
+        return lines[top.start_point[0]:node.end_point[0]+1]
+
+    def member_indent(self) -> str:
+        if len(self.members) > 0:
+            return _indent(self.parser.lines[self.top(self.members[0]).start_point[0]])
+        return _indent(self.parser.lines[self.node.start_point[0]]) + '    ' # pyright: ignore
+
+    def field_name(self, node:Node) -> str:
+        return _text(node.child_by_field_name('declarator').child_by_field_name('name')) # pyright: ignore
+
+
+class TestClassMerger(JavaCodeEditor):
+    """
+    Merge the code of LLM responses into a test class with tree-sitter, the python counterpart of
+    editcode.TestClassUpdator. Imports, class annotations, super types, fields, inner classes and methods
+    of the added code are inserted by line edits, so the existing code keeps its format.
+    Methods are matched by name and parameter types: empty bodies are filled, identical methods are skipped,
+    different test methods are added with a new name and other methods keep the longer body.
+    force_update replaces the method bodies and super types and drops imports missing in the added code.
+    ValueError is raised for code that can't be merged safely (syntax errors, members sharing lines).
+    """
+    force_update: bool
+
+    def __init__(self, force_update=False):
+        super().__init__()
+        self.force_update = force_update
+        self.added = JavaASTParser()
+
+    def merge(self, exist_class:str, add_codes:list[str]) -> str:
+        """
+        merge the responses one after another, the existing class is parsed once and reparsed incrementally
+        """
+        self.parse(exist_class)
+        if self.tree.root_node.has_error: raise ValueError("syntax error in the existing class") # pyright: ignore
+        for code in add_codes:
+            self.added.parse(code)
+            if self.added.tree.root_node.has_error: raise ValueError("syntax error in the added code") # pyright: ignore
+            self._merge_class(_ClassView(self), _ClassView(self.added))
+        return self.get_code()
+
+    def _merge_class(self, exist:_ClassView, add:_ClassView):
+        self._inserts = {} # row -> lines inserted before the row
+        self._replaces = [] # (start row, end row, lines)
+        self._merge_imports(exist, add)
+        self._merge_header(exist, add)
+        self._merge_members(exist, add)
+        # (start row, is replacement, end row exclusive, lines)
+        edits = [(row, False, row, lines) for row, lines in self._inserts.items()]
+        edits += [(start, True, end+1, lines) for start, end, lines in self._replaces]
+        # bottom up, a replaced row before the insertion at the same row
+        edits.sort(key=lambda x: (x[0], x[1]), reverse=True)
+        with self.edits():
+            for start, _, end, lines in edits:
+                self._replace_lines(start, end, lines)
+        return
+
+    def _insert(self, row:int, lines:list[str]):
+        self._inserts.setdefault(row, []).extend(lines)
+        return
+
+    def _replace_span(self, start_point, end_point, new_text:str):
+        # replace the text between two points, the rest of the first and last lines is kept
+        first, last = self.lines[start_point[0]], self.lines[end_point[0]]
+        prefix = first[:_char_col(first, start_point[1])]
+        suffix = last[_char_col(last, end_point[1]):]
+        self._replaces.append((start_point[0], end_point[0], (prefix + new_text + suffix).split('\n')))
+        return
+
+    def _merge_imports(self, exist:_ClassView, add:_ClassView):
+        exist_keys = {_normalize(_text(node)) for node in exist.imports}
+        add_keys = {_normalize(_text(node)) for node in add.imports}
+        if self.force_update and len(add.imports) > 0:
+            for node in exist.imports:
+                if _normalize(_text(node)) not in add_keys:
+                    self._replaces.append((node.start_point[0], node.end_point[0], []))
+        new_imports = []
+        for node in add.imports:
+            key = _normalize(_text(node))
+            if key in exist_keys: continue
+            exist_keys.add(key)
+            new_imports.append(key)
+        if len(new_imports) == 0: return
+        if len(exist.imports) > 0:
+            self._insert(exist.imports[-1].end_point[0] + 1, new_imports)
+        elif exist.package is not None:
+            row = exist.package.end_point[0] + 1
+            self._insert(row, [''] + new_imports + ([''] if row < len(self.lines) and self.lines[row].strip() else []))
+        else:
+            self._insert(0, new_imports + [''])
+        return
+
+    def _merge_header(self, exist:_ClassView, add:_ClassView):
+        exist_node, add_node = exist.node, add.node
+        # class annotations
+        exist_annotations = _annotations(exist_node) # pyright: ignore
+        add_modifiers = next((child for child in add_node.children if child.type == 'modifiers'), None) # pyright: ignore
+        if add_modifiers is not None:
+            indent = _indent(self.lines[exist_node.start_point[0]]) # pyright: ignore
+            new_annotations = [indent + _text(child) for child in add_modifiers.children
+                               if child.type in ('marker_annotation', 'annotation')
+                               and _text(child.child_by_field_name('name')).split('.')[-1] not in exist_annotations] # pyright: ignore
+            if len(new_annotations) > 0:
+                self._insert(exist_node.start_point[0], new_annotations) # pyright: ignore
+        # extends and implements
+        superclass = exist_node.child_by_field_name('superclass') # pyright: ignore
+        interfaces = exist_node.child_by_field_name('interfaces') # pyright: ignore
+        exist_super = _text(superclass.named_children[0]) if superclass is not None else None
+        exist_ifaces = [_text(node) for node in interfaces.named_children[0].named_children] if interfaces is not None else []
+        new_super, new_ifaces = (None, []) if self.force_update else (exist_super, list(exist_ifaces))
+        add_superclass = add_node.child_by_field_name('superclass') # pyright: ignore
+        add_interfaces = add_node.child_by_field_name('interfaces') # pyright: ignore
+        if add_superclass is not None:
+            new_super = _text(add_superclass.named_children[0])
+        if add_interfaces is not None:
+            names = {_type_name(iface) for iface in new_ifaces}
+            for node in add_interfaces.named_children[0].named_children:
+                if _type_name(_text(node)) in names: continue
+                names.add(_type_name(_text(node)))
+                new_ifaces.append(_text(node))
+        if new_super == exist_super and new_ifaces == exist_ifaces: return
+        after = exist_node.child_by_field_name('type_parameters') or exist_node.child_by_field_name('name') # pyright: ignore
+        header = (f" extends {new_super}" if new_super else "") + (f" implements {', '.join(new_ifaces)}" if new_ifaces else "")
+        self._replace_span(after.end_point, exist.body.start_point, header + ' ') # pyright: ignore
+        return
+
+    def _merge_members(self, exist:_ClassView, add:_ClassView):
+        lines = self.lines
+        indent = exist.member_indent()
+        end_row = exist.body.end_point[0] # pyright: ignore
+        if lines[end_row][:_char_col(lines[end_row], exist.body.end_point[1]) - 1].strip(): # pyright: ignore
+            raise ValueError("the class body doesn't end on its own line")
+        def member_lines(node:Node) -> list[str]:
+            member = add.member_lines(node)
+            return _reindent(member, _indent(member[0]), indent)
+        # slots of new members
+        last_field = exist.fields[-1] if len(exist.fields) > 0 else None
+        field_row = last_field.end_point[0] + 1 if last_field is not None else exist.body.start_point[0] + 1 # pyright: ignore
+        tests = [node for node in exist.methods if _method_kind(node) == 'test']
+        others = [node for node in exist.methods if _method_kind(node) != 'lifecycle']
+        helper_row = exist.top(tests[0]).start_point[0] if len(tests) > 0 else end_row
+        lifecycle_row = exist.top(others[0]).start_point[0] if len(others) > 0 else helper_row
+        def add_member(row:int, member:list[str]):
+            if row == end_row or row == field_row: self._insert(row, [''] + member)
+            else: self._insert(row, member + [''])
+
+        # fields
+        field_names = {exist.field_name(node) for node in exist.fields}
+        for node in add.fields:
+            name = add.field_name(node)
+            if name in field_names: continue
+            field_names.add(name)
+            self._insert(field_row, member_lines(node))
+        # inner classes
+        # name -> existing inner class, None once it's added or replaced
+        exist_types = {_text(node.child_by_field_name('name')): node for node in exist.types} # pyright: ignore
+        for node in add.types + add.other_types:
+            name = _text(node.child_by_field_name('name')) # pyright: ignore
+            if name == _text(exist.node.child_by_field_name('name')): continue # pyright: ignore
+            old = exist_types.get(name)
+            if name not in exist_types:
+                add_member(field_row, member_lines(node))
+            elif old is not None and (self.force_update or len(_text(node)) > len(_text(old))):
+                self._replaces.append((exist.top(old).start_point[0], old.end_point[0], member_lines(node)))
+            else: continue
+            exist_types[name] = None
+        # methods
+        exist_methods = {}
+        for node in exist.methods:
+            exist_methods.setdefault(_method_sig(node), node)
+        lifecycles = {}
+        for node in exist.methods:
+            for annotation in _annotations(node) & LIFECYCLE_ANNOTATIONS:
+                lifecycles.setdefault(annotation, node)
+        taken = {_text(node.child_by_field_name('name')) for node in exist.methods} # pyright: ignore
+        test_keys = {_method_key(node) for node in exist.methods if _method_kind(node) == 'test'}
+        replaced = set()
+        appended = {} # existing lifecycle method id -> (method, statement lines)
+        for node in add.methods:
+            name = _text(node.child_by_field_name('name')) # pyright: ignore
+            kind = _method_kind(node)
+            body = node.child_by_field_name('body')
+            if _method_sig(node) not in exist_methods:
+                shared = [lifecycles[annotation] for annotation in _annotations(node) & LIFECYCLE_ANNOTATIONS if annotation in lifecycles]
+                if kind == 'lifecycle' and len(shared) > 0 and body is not None:
+                    # one method for each lifecycle annotation, as the Java updater sorts them
+                    target = shared[0]
+                    appended.setdefault(target.id, (target, []))[1].extend(self._statements(node))
+                    continue
+                if kind == 'test' and _method_key(node) in test_keys: continue
+                test_keys.add(_method_key(node))
+                taken.add(name)
+                add_member({'lifecycle': lifecycle_row, 'helper': helper_row, 'test': end_row}[kind], member_lines(node))
+                continue
+            exist_node = exist_methods[_method_sig(node)]
+            exist_body = exist_node.child_by_field_name('body')
+            if body is None or exist_node.id in replaced: continue
+            if self.force_update or _empty_body(exist_body):
+                replaced.add(exist_node.id)
+                self._replace_body(exist_node, node, add, indent)
+            elif _normalize(_text(node)) == _normalize(_text(exist_node)):
+                continue
+            elif kind == 'test':
+                # same name, different test: keep both
+                if _method_key(node) in test_keys: continue
+                test_keys.add(_method_key(node))
+                new_name = self._free_name(name, taken)
+                taken.add(new_name)
+                member = member_lines(node)
+                top = add.top(node).start_point[0]
+                name_node = node.child_by_field_name('name')
+                row = name_node.start_point[0] - top # pyright: ignore
+                line = add.parser.lines[name_node.start_point[0]] # pyright: ignore
+                col = _char_col(line, name_node.start_point[1]) + len(member[row]) - len(line) # pyright: ignore
+                member[row] = member[row][:col] + new_name + member[row][col+len(name):]
+                add_member(end_row, member)
+            elif len(_text(body)) > len(_text(exist_body)): # pyright: ignore
+                replaced.add(exist_node.id)
+                self._replace_body(exist_node, node, add, indent)
+        for target, statements in appended.values():
+            if target.id in replaced: continue
+            self._append_statements(target, statements, indent)
+        return
+
+    def _free_name(self, name:str, taken:set) -> str:
+        k = 1
+        while f"{name}_{k}" in taken:
+            k += 1
+        return f"{name}_{k}"
+
+    def _replace_body(self, exist_node:Node, add_node:Node, add:_ClassView, indent:str):
+        exist_body = exist_node.child_by_field_name('body')
+        body_lines = _text(add_node.child_by_field_name('body')).split('\n') # pyright: ignore
+        add_indent = _indent(add.parser.lines[add.top(add_node).start_point[0]])
+        body_lines = body_lines[:1] + _reindent(body_lines[1:], add_indent, indent)
+        if exist_body is None:
+            # declaration without body, the ";" is replaced
+            row, col = exist_node.end_point
+            self._replace_span((row, col-1), exist_node.end_point, ' ' + '\n'.join(body_lines))
+            return
+        self._replace_span(exist_body.start_point, exist_body.end_point, '\n'.join(body_lines))
+        return
+
+    def _statements(self, node:Node) -> list[str]:
+        # lines of the statements in the method body, without the indent of the first statement
+        body_lines = _split_block(_text(node.child_by_field_name('body')), '') # pyright: ignore
+        inner = body_lines[1:-1]
+        first = next((line for line in inner if line.strip()), '')
+        return _reindent(inner, _indent(first), '')
+
+    def _append_statements(self, target:Node, statements:list[str], indent:str):
+        body = target.child_by_field_name('body')
+        if _normalize('\n'.join(statements)) in _normalize(_text(body)): return # pyright: ignore
+        body_lines = _split_block(_text(body), indent) # pyright: ignore
+        first = next((line for line in body_lines[1:-1] if line.strip()), indent + '    ')
+        statements = [_indent(first) + line if line.strip() else line for line in statements]
+        body_lines = body_lines[:-1] + statements + body_lines[-1:]
+        self._replace_span(body.start_point, body.end_point, '\n'.join(body_lines)) # pyright: ignore
+        return
+
+
+def merge_test_class(exist_class:str, add_codes:list[str], force_update=False, info="") -> str:
+    """
+    merge the code of responses into the test class in python, code the python merger can't handle
+    is merged by the Java TestClassUpdator
+    info: printed by the Java updater on errors
+    """
+    try:
+        return TestClassMerger(force_update).merge(exist_class, add_codes)
+    except ValueError as e:
+        logging.getLogger(__name__).debug(f"merge test class in Java: {e}")
+    TestClassUpdator = jpype.JClass("editcode.TestClassUpdator")
+    for code in add_codes:
+        args = [exist_class, code] + (["true"] if force_update else []) + [info]
+        exist_class = str(TestClassUpdator.main(args))
+    return exist_class
@@ -1,7 +1,22 @@
 import re
+import threading
 import tree_sitter_java as ts_java
-from queue import Queue
-from tree_sitter import Language, Node, Parser
+from bisect import bisect_right
+from contextlib import contextmanager
+from itertools import accumulate
+from tree_sitter import Language, Parser, Query
+
+JAVA_LANGUAGE = Language(ts_java.language())
+# compiled once per process; the query cursor belongs to the query, so matching is serialized
+METHOD_QUERY = Query(JAVA_LANGUAGE, """
+(method_declaration name: (identifier) @name) @method
+(method_declaration (modifiers [(marker_annotation name: (_) @annotation) (annotation name: (_) @annotation)]))
+""")
+_query_lock = threading.Lock()
+
+TEST_ANNOTATIONS = {'Test', 'ParameterizedTest', 'RepeatedTest', 'TestFactory', 'TestTemplate'}
+LIFECYCLE_ANNOTATIONS = {'BeforeEach', 'AfterEach', 'BeforeAll', 'AfterAll'}
+
 
 class JavaASTParser:
     source_code: str
@@ -9,13 +24,20 @@ class JavaASTParser:
     tree = None
     lines:list
     import_position: int = 0
+    line_starts: list # byte offset of each line, the last item is the length of the source with a trailing newline
 
     def __init__(self):
-        self.parser = Parser(Language(ts_java.language()))
+        self.parser = Parser(JAVA_LANGUAGE)
+        self._methods = (None, [])
+        self._batch = 0
+        self._dirty = False
+        self._dirty_imp = False
         return
 
     def parse(self, source_code):
         self.lines = source_code.splitlines()
+        self.tree = None
+        self._index_lines()
         self._update_code()
         return
     
@@ -25,43 +47,118 @@ class JavaASTParser:
                 self.import_position = i + 1
         return
 
+    def _index_lines(self):
+        self.line_starts = [0] + list(accumulate(len(line.encode('utf-8')) + 1 for line in self.lines))
+        return
+
     def _update_code(self, up_imp=True):
         """
-        Update the source code and AST with the current lines
+        Update the source code and AST with the current lines, the edited old tree is reused if there is one
         """
         self.source_code = '\n'.join(self.lines)
         byte_code = self.source_code.encode('utf-8')
-        self.tree = self.parser.parse(byte_code, encoding='utf8')
+        if self.tree is None:
+            self.tree = self.parser.parse(byte_code, encoding='utf8')
+        else:
+            self.tree = self.parser.parse(byte_code, self.tree, encoding='utf8')
         if up_imp: self._get_import_position()
+        self._dirty = False
+        self._dirty_imp = False
+        return
+
+    def _sync(self):
+        # reparse the edits of an unfinished batch before reading the tree
+        if self._dirty: self._update_code(self._dirty_imp)
+        return
+
+    def _point(self, byte:int) -> tuple[int, int]:
+        row = min(bisect_right(self.line_starts, byte) - 1, max(len(self.lines) - 1, 0))
+        return (row, byte - self.line_starts[row])
+
+    def _replace_lines(self, start:int, end:int, new_lines:list[str], up_imp=True):
+        """
+        Replace lines[start:end] with new_lines as one byte range edit of the tree,
+        the tree is reparsed at once, or at the end of the batch in `edits()`
+        """
+        total = max(self.line_starts[-1] - 1, 0)
+        if end < len(self.lines):
+            start_byte, old_end_byte = self.line_starts[start], self.line_starts[end]
+            new_text = ''.join(line + '\n' for line in new_lines)
+        elif start > 0:
+            # the range reaches the last line, the newline before it belongs to the edit
+            start_byte, old_end_byte = self.line_starts[start] - 1, total
+            new_text = ''.join('\n' + line for line in new_lines)
+        else:
+            start_byte, old_end_byte = 0, total
+            new_text = '\n'.join(new_lines)
+        new_bytes = new_text.encode('utf-8')
+        start_point, old_end_point = self._point(start_byte), self._point(old_end_byte)
+        if b'\n' in new_bytes:
+            new_end_point = (start_point[0] + new_bytes.count(b'\n'), len(new_bytes) - new_bytes.rindex(b'\n') - 1)
+        else:
+            new_end_point = (start_point[0], start_point[1] + len(new_bytes))
+        if self.tree is not None:
+            self.tree.edit(start_byte, old_end_byte, start_byte + len(new_bytes), start_point, old_end_point, new_end_point)
+
+        lengths = [len(line.encode('utf-8')) + 1 for line in new_lines]
+        delta = sum(lengths) - (self.line_starts[end] - self.line_starts[start])
+        new_starts = [self.line_starts[start] + offset for offset in accumulate([0] + lengths[:-1])] if len(lengths) > 0 else []
+        self.line_starts[start:] = new_starts + [pos + delta for pos in self.line_starts[end:]]
+        self.lines[start:end] = new_lines
+        # keep the import position valid inside a batch, it's recomputed on reparse
+        if end <= self.import_position:
+            self.import_position += len(new_lines) - (end - start)
+        elif start < self.import_position:
+            self.import_position = start + len(new_lines)
+        self._dirty = True
+        self._dirty_imp = self._dirty_imp or up_imp
+        if self._batch == 0: self._sync()
         return
 
-    def _traverse_get(self, type):
-        node_list:list[Node] = []
-        bfs_queue = Queue[Node]()
-        if self.tree is None: return node_list
-        bfs_queue.put(self.tree.root_node)
-        while not bfs_queue.empty():
-            node = bfs_queue.get()
-            if node.type == type:
-                node_list.append(node)
-            else:
-                for child in node.children:
-                    bfs_queue.put(child)
-        return node_list
-
-    def _get_functions(self):
-        functions = []
-        # get method_declaration nodes
-        method_list = self._traverse_get('method_declaration')
-        for node in method_list:
-            # get function body
+    @contextmanager
+    def edits(self):
+        """
+        Batch the edits in the block into one transaction, the tree is reparsed once at the end
+        """
+        self._batch += 1
+        try:
+            yield self
+        finally:
+            self._batch -= 1
+            if self._batch == 0: self._sync()
+
+    def _get_methods(self) -> list[dict]:
+        """
+        method declarations in source order, methods declared inside other methods are skipped,
+        [{"node", "name", "annotations": [simple names], "start": first line with annotations, "end"}]
+        the result is cached for the current tree
+        """
+        self._sync()
+        if self.tree is None: return []
+        if self._methods[0] is self.tree: return self._methods[1]
+        with _query_lock:
+            captures = METHOD_QUERY.captures(self.tree.root_node)
+        annotations = {}
+        for name in captures.get('annotation', []):
+            # name <- annotation <- modifiers <- method_declaration
+            annotations.setdefault(name.parent.parent.parent.id, []).append(name.text.decode('utf-8').split('.')[-1]) # pyright: ignore
+        methods = []
+        last_end = -1
+        for node in sorted(captures.get('method', []), key=lambda x: x.start_byte):
+            if node.start_byte < last_end: continue
+            last_end = node.end_byte
             start_line = node.start_point[0]
-            end_line = node.end_point[0]
             while self.lines[start_line-1].lstrip().startswith('@'):
                 start_line -= 1
-            function_code = '\n'.join(self.lines[start_line:end_line+1])
-            functions.append(function_code)
-        return functions
+            methods.append({
+                "node": node,
+                "name": node.child_by_field_name('name').text.decode('utf-8'), # pyright: ignore[reportOptionalMemberAccess]
+                "annotations": annotations.get(node.id, []),
+                "start": start_line,
+                "end": node.end_point[0],
+            })
+        self._methods = (self.tree, methods)
+        return methods
 
     def _sort_line_number(self, positions:list[int|list[int]], rvs=False):
         lines = set[int]([pos for pos in positions if isinstance(pos, int)])
@@ -78,52 +175,26 @@ class JavaASTParser:
 
     def get_code(self, position:list|None=None):
         if position is None:
+            self._sync()
             return self.source_code
         lines = self._sort_line_number(position)
         code_lines = [self.lines[i] for i in lines]
         return '\n'.join(code_lines)
 
     def get_test_cases(self) -> list:
-        test_cases = []
-        test_annotations = ['@Test', '@ParameterizedTest', '@RepeatedTest']
-        functions = self._get_functions()
-        for func in functions:
-            flag = False
-            for annotation in test_annotations:
-                if func.find(annotation) > -1:
-                    flag = True
-                    break
-            if flag:
-                test_cases.append(func)
-        return test_cases
+        return ['\n'.join(self.lines[method["start"]:method["end"]+1]) for method in self._get_methods()
+                if TEST_ANNOTATIONS.intersection(method["annotations"])]
 
     def get_test_case_position(self):
         """
-        output format: [[start_lines], [end_lines], [method_name]]
+        output format: [[start_lines], [end_lines], [method_name]], lifecycle methods are excluded
         """
-        function_nodes = self._traverse_get('method_declaration')
-        test_cases = []
-        exclude_annotations = ['@BeforeEach', '@AfterEach', '@BeforeAll', '@AfterAll']
-        for node in function_nodes:
-            start_line = node.start_point[0]
-            end_line = node.end_point[0]
-            while self.lines[start_line-1].lstrip().startswith('@'):
-                start_line -= 1
-            func_code = '\n'.join(self.lines[start_line:end_line+1])
-            flag = True
-            for annotation in exclude_annotations:
-                if func_code.find(annotation) > -1:
-                    flag = False
-            if flag:
-                method_name = node.child_by_field_name('name').text.decode('utf-8') # pyright: ignore[reportOptionalMemberAccess]
-                test_cases.append([start_line, end_line, method_name])
-
-        sorted_data = sorted(test_cases, key=lambda x: x[0])
         test_cases_positions = [[],[],[]]
-        for obj in sorted_data:
-            test_cases_positions[0].append(obj[0])
-            test_cases_positions[1].append(obj[1])
-            test_cases_positions[2].append(obj[2])
+        for method in self._get_methods():
+            if LIFECYCLE_ANNOTATIONS.intersection(method["annotations"]): continue
+            test_cases_positions[0].append(method["start"])
+            test_cases_positions[1].append(method["end"])
+            test_cases_positions[2].append(method["name"])
         return test_cases_positions
 
 
@@ -133,10 +204,9 @@ class JavaCodeEditor(JavaASTParser):
 
     def comment_code(self, positions:list):
         comment_lines = self._sort_line_number(positions)
-        for line in comment_lines:
-            self.lines[line] = '// ' + self.lines[line]
-        self._update_code()
-        self.source_code = '\n'.join(self.lines)
+        with self.edits():
+            for line in comment_lines:
+                self._replace_lines(line, line+1, ['// ' + self.lines[line]])
         return
     
     def remove_lines(self, positions:list):
@@ -145,9 +215,15 @@ class JavaCodeEditor(JavaASTParser):
         param remove_lines: List of line numbers to be removed.
         """
         removed_lines = self._sort_line_number(positions, rvs=True)
-        for line in removed_lines:
-            self.lines.pop(line)
-        self._update_code()
+        with self.edits():
+            # consecutive lines are removed as one range, from the bottom up
+            i = 0
+            while i < len(removed_lines):
+                j = i
+                while j + 1 < len(removed_lines) and removed_lines[j+1] == removed_lines[j] - 1:
+                    j += 1
+                self._replace_lines(removed_lines[j], removed_lines[i]+1, [])
+                i = j + 1
         return
 
     def add_imports(self, import_lines:list[str]):
@@ -156,31 +232,32 @@ class JavaCodeEditor(JavaASTParser):
         :param import_lines: List of import lines to be added.
         """
         # Insert the new imports and Update the import position
-        self.lines = self.lines[:self.import_position] + import_lines + self.lines[self.import_position:]
-        self.import_position += len(import_lines)
-        self._update_code()
+        position = min(self.import_position, len(self.lines))
+        self._replace_lines(position, position, list(import_lines))
+        if self._dirty: self.import_position = position + len(import_lines)
         return
 
     def add_exception(self, lines:list[int]):
         lines.sort()
         cur = 0
         cur_line = lines[cur]
-        function_nodes = self._traverse_get('method_declaration')
-        for node in function_nodes:
-            start_line = node.start_point[0]
-            end_line = node.end_point[0]
-            if start_line<=cur_line and end_line>=cur_line:
-                decl_line = start_line
-                while self.lines[decl_line].lstrip().startswith('@'):
-                    decl_line += 1
-                decl = self.lines[decl_line]
-                decl = re.sub(r'(throws .*Exception)? \{', 'throws Exception {', decl)
-                self.lines[decl_line] = decl
-                while cur<len(lines) and start_line<=cur_line and end_line>=cur_line:
-                    cur += 1
-                    if cur<len(lines): cur_line = lines[cur]
-            if cur >= len(lines): break
-        self._update_code(up_imp=False)
+        methods = self._get_methods()
+        with self.edits():
+            for method in methods:
+                start_line = method["node"].start_point[0]
+                end_line = method["end"]
+                if start_line<=cur_line and end_line>=cur_line:
+                    decl_line = start_line
+                    while self.lines[decl_line].lstrip().startswith('@'):
+                        decl_line += 1
+                    decl = self.lines[decl_line]
+                    decl = re.sub(r'(throws .*Exception)? \{', 'throws Exception {', decl)
+                    if decl != self.lines[decl_line]:
+                        self._replace_lines(decl_line, decl_line+1, [decl], up_imp=False)
+                    while cur<len(lines) and start_line<=cur_line and end_line>=cur_line:
+                        cur += 1
+                        if cur<len(lines): cur_line = lines[cur]
+                if cur >= len(lines): break
         return
 
 
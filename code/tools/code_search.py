@@ -6,63 +6,28 @@ import jpype
 import logging
 
 import tools.io_utils as utils
-
-
-class SnippetReader:
-    project_path: str
-    cache:dict # {"<file_path>": ["line1", "line2"]}
-    def __init__(self, pj_path):
-        self.project_path = pj_path
-        self.cache = {}
-        pass
-
-    def _get_contents(self, file_path):
-        lines = self.cache.get(file_path)
-        if lines is None:
-            content:str = utils.load_text(f"{self.project_path}/{file_path}")
-            lines = content.splitlines()
-            self.cache[file_path] = lines
-        return lines
-
-    def read_single_line(self, file_path, line):
-        line = max(0, line)
-        lines = self._get_contents(file_path)
-        return lines[min(line, len(lines)-1)]
-
-    def read_lines(self, file_path, start_line, end_line):
-        start_line = max(0, start_line if start_line is not None else 0)
-        lines = self._get_contents(file_path)
-        end_line = min(max(start_line, end_line) + 1, len(lines))
-        return lines[start_line:end_line]
-
-    def read_incoherent_lines(self, file_path, read_lines:list):
-        extracted_contents = []
-        for line in read_lines:
-            if isinstance(line,int):
-                extracted_contents.append(self.read_single_line(file_path, line))
-            elif isinstance(line,list):
-                extracted_contents += (self.read_lines(file_path, line[0], line[1]))
-        return extracted_contents
+from tools.project_knowledge import ProjectKnowledge, SnippetReader
 
 
 class CodeSearcher:
     project_path: str
     top_k: str
     index_path: str
-    code_info: dict
-    invoke_pattern: dict
+    knowledge: ProjectKnowledge
     snippet_reader: SnippetReader
+    search_session: jpype.JObject | None
+    search_cache: dict # {"<query json>": [result]}
 
     def __init__(self, project_path: str, project_name: str, project_index_path: str, top_k):
         self.project_path = project_path
         self.top_k = top_k
+        self.search_session = None
+        self.search_cache = {}
         self.logger = logging.getLogger(__name__)
-        code_info_path = f"{project_index_path}/json/{project_name}.json"
         self.index_path = f"{project_index_path}/lucene/{project_name}"
-        invoke_pattern_path = f"{project_index_path}/codegraph/{project_name}_invoke.json"
-        self.logger.info(f"Loading code index for {project_name}")
-        self.code_info = utils.load_json(code_info_path)
-        self.invoke_pattern = utils.load_json(invoke_pattern_path)
+        # the index is loaded once for all searchers and stages
+        self.knowledge = ProjectKnowledge.for_project(project_path, project_name, project_index_path)
+        self.snippet_reader = self.knowledge.snippet_reader
 
     # todo: will be replaced by _get_class_info
     def _get_test_classes(self, class_url: str):
@@ -76,22 +41,13 @@ class CodeSearcher:
         return content
 
     def _get_class_info(self, class_name: str, istest=False) -> dict:
-        if istest:
-            return self.code_info["test"].get(class_name, None)
-        else:
-            return self.code_info["source"].get(class_name, None)
+        return self.knowledge.class_info(class_name, istest)
 
-    def _get_method_info(self, class_info: str, method_name: str) -> dict:
+    def _get_method_info(self, class_name: str, method_name: str) -> dict:
         '''
-        get the method info in the class info
+        get the method info of a source class by its signature, e.g. "renderOptions(StringBuffer, int, Options, int, int)"
         '''
-        method_info = next(
-            (m_info for method, m_infos in class_info["methods"].items()
-             if method_name.find(method) != -1
-             for m_info in m_infos if m_info["signature"].endswith(method_name)),
-            None
-        )
-        return method_info
+        return self.knowledge.method_info(class_name, method_name)
 
     def _extract_snippet(self, context:dict):
         full_context = {}
@@ -162,7 +118,6 @@ class CodeSearcher:
         processed_sig = re.sub(r"\w+\.", "", processed_sig, flags=re.DOTALL)
         return processed_sig
 
-    # todo: compress overlong context
     def collect_construct_context(self, class_name, method_name:str, class_url):
         '''
         content in construct context:
@@ -175,11 +130,10 @@ class CodeSearcher:
         class_info = self._get_class_info(class_name)
         if class_info is None:
             raise ValueError(f"Class `{class_name}` not found in code info")
-        method_info = self._get_method_info(class_info, method_name)
+        method_info = self._get_method_info(class_name, method_name)
         if method_info is None:
             raise ValueError(f"Method `{method_name}` not found in class `{class_name}`")
 
-        self.snippet_reader = SnippetReader(self.project_path)
         source_path = "/src/main/java/"+class_info["file"].replace("\\","/")
         context = {}
         pclass = {}
@@ -230,14 +184,12 @@ class CodeSearcher:
         test_url = class_url.replace("main","test").replace(".java", "Test.java")
         test_class = self._get_test_classes(test_url)
         if test_class is not None:
-            lines = test_class.splitlines()
-            if len(lines) > 150:
-                test_class = '\n'.join(lines[:100]) + "\n......\n" + '\n'.join(lines[-50:])
+            # overlong test class is trimmed by the context budgeter
             context["existing test class"] = f"```java\n{test_class}\n```"
         # get invoke patterns
         invoke_codes = []
         processed_sig = self._process_signature(method_name)
-        code_lines = self.invoke_pattern[class_name].get(processed_sig)
+        code_lines = self.knowledge.invoke_examples(class_name, processed_sig)
         if code_lines is not None:
             for i in range(len(code_lines)):
                 invoke_code = ""
@@ -255,6 +207,31 @@ class CodeSearcher:
         return context
 
 
+    def _build_usage_query(self, class_name, class_info:dict, method_info:dict) -> list[dict]:
+        '''
+        similarity queries for the focal method and the methods it calls
+        '''
+        method_sig = method_info["signature"]
+        return_type = method_info["return_type"].split('.')[-1] + " "
+        query_list = [{
+            "sig": class_name + "." + method_sig[method_sig.index(return_type)+len(return_type):],
+            "function": [cm["signature"] for cm in method_info["call_methods"]],
+            "field": [cf["name"] for cf in method_info["external_fields"]],
+        }]
+        for cmethod in method_info["call_methods"]:
+            call_sig = cmethod["signature"]
+            sig_split = call_sig.split(".")
+            cinfo = self._get_class_info('.'.join(sig_split[:-1]))
+            if cinfo is None: continue
+            minfo = self._get_method_info('.'.join(sig_split[:-1]), sig_split[-1])
+            if minfo is None: continue
+            query_list.append({
+                "sig": call_sig,
+                "function": [cm["signature"] for cm in minfo["call_methods"]],
+                "field":[cf["name"] for cf in minfo["external_fields"]],
+            })
+        return query_list
+
     def collect_usage_context(self, class_name, method_name:str):
         '''
         content in usage context:
@@ -269,19 +246,13 @@ class CodeSearcher:
         class_info = self._get_class_info(class_name)
         if class_info is None:
             raise ValueError(f"Class `{class_name}` not found in code info")
-        method_info = self._get_method_info(class_info, method_name)
+        method_info = self._get_method_info(class_name, method_name)
         if method_info is None:
             raise ValueError(f"Method `{method_name}` not found in class `{class_name}`")
         # collect the context
         context = {}
         depclass = self.DependentClassInfo()
-        method_sig = method_info["signature"]
-        return_type = method_info["return_type"].split('.')[-1] + " "
-        query_list = [{
-            "sig": class_name + "." + method_sig[method_sig.index(return_type)+len(return_type):],
-            "function": [cm["signature"] for cm in method_info["call_methods"]],
-            "field": [cf["name"] for cf in method_info["external_fields"]],
-        }]
+        query_list = self._build_usage_query(class_name, class_info, method_info)
         
         # api documents
         if "javadoc" in class_info:
@@ -310,18 +281,13 @@ class CodeSearcher:
             if cinfo is not None:
                 if "javadoc" in cinfo:
                     depclass.update_str(class_name, "APIdoc", cinfo["javadoc"])
-                minfo = self._get_method_info(cinfo, method_name)
+                minfo = self._get_method_info(class_name, method_name)
                 if minfo is not None:
                     api_doc = minfo.get("javadoc")
                     return_type = minfo["return_type"]
                     cmtext = f"method `{method_name}` returns `{return_type}`"
                     if api_doc is not None: cmtext += f", api document: {api_doc}"
                     depclass.update_list(class_name, "dep_func", cmtext)
-                    query_list.append({
-                        "sig": method_sig,
-                        "function": [cm["signature"] for cm in minfo["call_methods"]],
-                        "field":[cf["name"] for cf in minfo["external_fields"]],
-                    })
         # external field in focus method
         for field in method_info["external_fields"]:
             fqn = field["name"]
@@ -337,7 +303,7 @@ class CodeSearcher:
             method_sig = func["signature"]
             caller = func["related_func"]
             cinfo = self._get_class_info(class_fqn)
-            minfo = self._get_method_info(cinfo, method_sig)
+            minfo = self._get_method_info(class_fqn, method_sig)
             api_doc = minfo.get("javadoc")
             return_type = minfo["return_type"]
             cmtext = f"method `{method_sig}` returns `{return_type}`, related with `{'`, `'.join(caller)}`"
@@ -347,6 +313,53 @@ class CodeSearcher:
         # add more context here
         return context
 
+    def _get_search_session(self):
+        """
+        Open the Lucene index of the project once and reuse it for all focal methods.
+        """
+        if self.search_session is None:
+            JCodeSearcher = jpype.JClass("CodeSearcher")
+            self.search_session = JCodeSearcher.open(self.project_path, self.index_path, int(self.top_k))
+        return self.search_session
+
+    def close(self):
+        if self.search_session is not None:
+            self.search_session.close()
+            self.search_session = None
+        self.search_cache.clear()
+
+    def search_similar_function_batch(self, queries:list[list]) -> list[list[dict]]:
+        """
+        Search similar functions for many focal methods in one call.
+        Args:
+            queries: Query lists, one for each focal method.
+        Returns:
+            Search results in the same order as queries.
+        """
+        query_keys = [json.dumps(query) for query in queries]
+        batch = {key: query for key, query in zip(query_keys, queries) if key not in self.search_cache}
+        if len(batch) > 0:
+            session = self._get_search_session()
+            results = json.loads(str(session.searchBatch(json.dumps(batch))))
+            self.search_cache.update(results)
+        return [self.search_cache[key] for key in query_keys]
+
+    def prefetch_usage_search(self, focal_methods:list[tuple[str, str]]):
+        """
+        Search similar functions of all focal methods at once, results are cached for collect_usage_context.
+        Args:
+            focal_methods: List of (class_name, method_name).
+        """
+        queries = []
+        for class_name, method_name in focal_methods:
+            class_info = self._get_class_info(class_name)
+            if class_info is None: continue
+            method_info = self._get_method_info(class_name, method_name)
+            if method_info is None: continue
+            queries.append(self._build_usage_query(class_name, class_info, method_info))
+        self.search_similar_function_batch(queries)
+        return
+
     def search_similar_function(self, query:list) -> list[dict]:
         """
         Search the similar function in the Java project and extract the context.
@@ -355,10 +368,7 @@ class CodeSearcher:
         Returns:
             A list containing similar function information. Each element is a dictionary containing file path, line number, and context.
         """
-        CodeSearcher = jpype.JClass("CodeSearcher")
-        result_str = str(CodeSearcher.main([self.project_path, self.index_path, str(query), self.top_k]))
-        results = json.loads(result_str)
-        return results
+        return self.search_similar_function_batch([query])[0]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+import re
+import logging
+
+
+class ContextBudgeter:
+    """
+    Fit the context sections of a prompt into a token budget.
+    Sections with lower priority are trimmed first: whole items (examples, classes, constructors) are dropped
+    from the end, then long text keeps its head and tail. Sections that can't keep a useful part are dropped.
+    """
+    MIN_SECTION_TOKENS = 32
+    MARKER = "......"
+    # (key prefix, priority), higher priority is kept longer
+    PRIORITIES = [
+        ("return type", 100),
+        ("api document of method", 90),
+        ("constructors for class", 80),
+        ("parameters in constructors", 70),
+        ("api document of class", 60),
+        ("dependent classes", 55),
+        ("invoke examples", 50),
+        ("existing test class", 40),
+    ]
+    # item separators of sections, items after the separator can be dropped as a whole
+    ITEM_SEPARATORS = [
+        ("invoke examples", r"\n(?=example [0-9]+:\n)"),
+        ("dependent classes", r"\n(?=class `)"),
+        ("parameters in constructors", r"\n(?=class `)"),
+        ("constructors for class", r"\n(?=params: )"),
+    ]
+    token_pattern = re.compile(r"\w+|[^\w\s]")
+    budget: int
+
+    def __init__(self, budget:int):
+        self.budget = budget
+        self.logger = logging.getLogger(__name__)
+
+    def count_tokens(self, text:str) -> int:
+        # approximation of BPE tokens: words and punctuations
+        return len(self.token_pattern.findall(text))
+
+    def _priority(self, key:str) -> int:
+        return next((priority for prefix, priority in self.PRIORITIES if key.startswith(prefix)), 50)
+
+    def _separator(self, key:str) -> str|None:
+        return next((sep for prefix, sep in self.ITEM_SEPARATORS if key.startswith(prefix)), None)
+
+    def _truncate_lines(self, text:str, target:int) -> str:
+        target -= self.count_tokens(self.MARKER)
+        lines = text.splitlines()
+        head_budget = target * 2 // 3
+        tail_budget = target - head_budget
+        head, tail = [], []
+        for line in lines:
+            head_budget -= self.count_tokens(line)
+            if head_budget < 0: break
+            head.append(line)
+        for line in reversed(lines[len(head):]):
+            tail_budget -= self.count_tokens(line)
+            if tail_budget < 0: break
+            tail.append(line)
+        tail.reverse()
+        if len(head) + len(tail) >= len(lines):
+            return text
+        if len(head) == 0: # single long line, e.g. api document
+            words = list(self.token_pattern.finditer(text))
+            if target >= len(words): return text
+            return text[:words[max(target, 0)].start()] + self.MARKER
+        return '\n'.join(head) + f"\n{self.MARKER}\n" + '\n'.join(tail)
+
+    def _trim(self, key:str, text:str, target:int) -> str|None:
+        if target < self.MIN_SECTION_TOKENS:
+            return None
+        separator = self._separator(key)
+        if separator is not None:
+            items = re.split(separator, text)
+            kept = []
+            used = 0
+            for item in items:
+                tokens = self.count_tokens(item)
+                if used + tokens > target: break
+                kept.append(item)
+                used += tokens
+            if len(kept) > 0:
+                return '\n'.join(kept)
+        return self._truncate_lines(text, target)
+
+    def fit(self, context:dict) -> tuple[dict, list[dict]]:
+        """
+        return: (fitted context, record of trimmed/dropped sections)
+        """
+        tokens = {key: self.count_tokens(str(value)) for key, value in context.items()}
+        total = sum(tokens.values())
+        if total <= self.budget:
+            return context, []
+        fitted = context.copy()
+        records = []
+        for key in sorted(fitted.keys(), key=self._priority):
+            excess = total - self.budget
+            if excess <= 0: break
+            before = tokens[key]
+            new_text = self._trim(key, str(fitted[key]), before - excess)
+            if new_text is None:
+                fitted.pop(key)
+                after = 0
+                records.append({"section": key, "action": "dropped", "tokens": before})
+            else:
+                fitted[key] = new_text
+                after = self.count_tokens(new_text)
+                records.append({"section": key, "action": "trimmed", "tokens": before, "kept_tokens": after})
+            total -= before - after
+        self.logger.debug(f"context fitted into {total} tokens, budget {self.budget}: {records}")
+        return fitted, records
@@ -0,0 +1,197 @@
+import os
+import re
+import logging
+import threading
+import jpype
+
+
+class CoverageEngine:
+    """
+    Analyze jacoco.exec with the JaCoCo core API in the JPype JVM (jacococli.jar on the class path).
+    Class files under target/classes are read and identified once per project, only the classes of
+    interest are analyzed for each execution data file.
+    counters: {"<vm class name>": {"<method name><descriptor>": {"instruction": [missed, covered], "branch": [...], "line": [...]}}}
+    """
+    _engines = {}
+    _engines_lock = threading.Lock()
+    classes_dir: str
+    class_files: dict
+
+    def __init__(self, project_path:str):
+        self.classes_dir = f"{project_path}/target/classes"
+        self.class_files = {}
+        self.logger = logging.getLogger(__name__)
+        self.ExecFileLoader = jpype.JClass("org.jacoco.core.tools.ExecFileLoader")
+        self.CoverageBuilder = jpype.JClass("org.jacoco.core.analysis.CoverageBuilder")
+        self.Analyzer = jpype.JClass("org.jacoco.core.analysis.Analyzer")
+        self.JFile = jpype.JClass("java.io.File")
+        self._load_class_files()
+
+    @classmethod
+    def for_project(cls, project_path:str) -> "CoverageEngine|None":
+        """
+        shared engine of the project, None if the JVM is not started or JaCoCo is not on its class path
+        """
+        if not jpype.isJVMStarted(): return None
+        with cls._engines_lock:
+            if project_path not in cls._engines:
+                try:
+                    cls._engines[project_path] = CoverageEngine(project_path)
+                except Exception as e:
+                    logging.getLogger(__name__).warning(f"JaCoCo analysis is not available in JVM: {e}")
+                    cls._engines[project_path] = None
+            return cls._engines[project_path]
+
+    def _load_class_files(self):
+        # vm class name -> class file bytes, outer and inner classes of a source file are analyzed together
+        for root, _, files in os.walk(self.classes_dir):
+            for file in files:
+                if not file.endswith(".class"): continue
+                path = os.path.join(root, file)
+                name = os.path.relpath(path, self.classes_dir).replace("\\", "/")[:-len(".class")]
+                with open(path, "rb") as f:
+                    self.class_files[name] = jpype.JArray(jpype.JByte)(f.read())
+        self.logger.debug(f"loaded {len(self.class_files)} class files from {self.classes_dir}")
+        return
+
+    def _counter(self, counter) -> list:
+        return [int(counter.getMissedCount()), int(counter.getCoveredCount())]
+
+    def analyze(self, exec_file:str, class_names:list) -> dict:
+        """
+        class_names: vm names of top level classes, e.g. "org/apache/commons/cli/HelpFormatter", inner classes are included
+        """
+        loader = self.ExecFileLoader()
+        if os.path.exists(exec_file):
+            loader.load(self.JFile(exec_file))
+        store = loader.getExecutionDataStore()
+        return self.analyze_store(store, class_names)
+
+    def read_sessions(self, exec_file:str) -> dict:
+        """
+        execution data of each session in the file: {session id: ExecutionDataStore}
+        """
+        ExecutionDataReader = jpype.JClass("org.jacoco.core.data.ExecutionDataReader")
+        ExecutionDataStore = jpype.JClass("org.jacoco.core.data.ExecutionDataStore")
+        sessions = {}
+        current = {"store": ExecutionDataStore()}
+
+        @jpype.JImplements("org.jacoco.core.data.ISessionInfoVisitor")
+        class SessionVisitor:
+            @jpype.JOverride
+            def visitSessionInfo(self, info):
+                current["store"] = sessions.setdefault(str(info.getId()), ExecutionDataStore())
+
+        @jpype.JImplements("org.jacoco.core.data.IExecutionDataVisitor")
+        class DataVisitor:
+            @jpype.JOverride
+            def visitClassExecution(self, data):
+                current["store"].put(data)
+
+        if not os.path.exists(exec_file): return sessions
+        stream = jpype.JClass("java.io.BufferedInputStream")(jpype.JClass("java.io.FileInputStream")(exec_file))
+        try:
+            reader = ExecutionDataReader(stream)
+            reader.setSessionInfoVisitor(SessionVisitor())
+            reader.setExecutionDataVisitor(DataVisitor())
+            reader.read()
+        finally:
+            stream.close()
+        return sessions
+
+    def merge_sessions(self, sessions:dict, session_ids:list):
+        """
+        merge the execution data of the selected sessions offline, return an ExecutionDataStore
+        """
+        ExecutionDataStore = jpype.JClass("org.jacoco.core.data.ExecutionDataStore")
+        ExecutionData = jpype.JClass("org.jacoco.core.data.ExecutionData")
+        merged = ExecutionDataStore()
+        for session_id in session_ids:
+            if session_id not in sessions: continue
+            for data in sessions[session_id].getContents():
+                # copy the probes, merging changes the data in place
+                merged.put(ExecutionData(data.getId(), data.getName(), data.getProbes().clone()))
+        return merged
+
+    def analyze_store(self, store, class_names:list) -> dict:
+        builder = self.CoverageBuilder()
+        analyzer = self.Analyzer(store, builder)
+        for name in self.class_files:
+            outer = name.split("$")[0]
+            if outer in class_names:
+                analyzer.analyzeClass(self.class_files[name], name)
+        counters = {}
+        for class_cov in builder.getClasses():
+            methods = {}
+            for method in class_cov.getMethods():
+                methods[f"{method.getName()}{method.getDesc()}"] = {
+                    "instruction": self._counter(method.getInstructionCounter()),
+                    "branch": self._counter(method.getBranchCounter()),
+                    "line": self._counter(method.getLineCounter()),
+                }
+            counters[str(class_cov.getName())] = methods
+        return counters
+
+    @staticmethod
+    def vm_class_name(package:str, class_name:str) -> str:
+        """
+        e.g. ("a.b", "a.b.Outer.Inner") -> "a/b/Outer$Inner"
+        """
+        simple = class_name[len(package)+1:] if package and class_name.startswith(f"{package}.") else class_name
+        prefix = package.replace(".", "/") + "/" if package else ""
+        return prefix + simple.replace(".", "$")
+
+    @staticmethod
+    def _descriptor_params(desc:str) -> list:
+        params = []
+        primitives = {"Z": "boolean", "B": "byte", "C": "char", "S": "short", "I": "int", "J": "long", "F": "float", "D": "double"}
+        for dims, obj, prim in re.findall(r"(\[*)(?:L([^;]+);|([ZBCSIJFD]))", desc[1:desc.index(")")]):
+            name = obj.split("/")[-1].replace("$", ".") if obj else primitives[prim]
+            params.append(name + "[]" * len(dims))
+        return params
+
+    @staticmethod
+    def _source_params(signature:str) -> list:
+        params = signature[signature.index("(")+1:signature.rindex(")")]
+        while re.search(r"<[^<>]*>", params):
+            params = re.sub(r"<[^<>]*>", "", params)
+        result = []
+        for param in params.split(","):
+            param = param.strip()
+            if not param: continue
+            result.append(param.replace("...", "[]"))
+        return result
+
+    @staticmethod
+    def find_method(counters:dict, class_name:str, signature:str) -> dict|None:
+        """
+        counters of the method with a source signature, e.g. "renderOptions(StringBuffer, int, Options, int, int)"
+        parameter types are matched by simple names, erased type variables (Object) match any type
+        """
+        methods = counters.get(class_name, {})
+        name = signature.split("(")[0].strip()
+        if name == class_name.split("/")[-1].split("$")[-1]:
+            name = "<init>"
+        params = CoverageEngine._source_params(signature)
+        for key, counter in methods.items():
+            mname = key.split("(")[0]
+            if mname != name: continue
+            dparams = CoverageEngine._descriptor_params(key[len(mname):])
+            if len(dparams) != len(params): continue
+            if all(dp == sp or dp.split(".")[-1] == sp.split(".")[-1] or dp.startswith("Object")
+                   for dp, sp in zip(dparams, params)):
+                return counter
+        return None
+
+    @staticmethod
+    def coverage_score(counter:dict) -> tuple:
+        """
+        (instruction coverage, branch coverage); branch coverage of a method without branches is None ("n/a" in the report)
+        """
+        inst_missed, inst_covered = counter["instruction"]
+        bran_missed, bran_covered = counter["branch"]
+        inst_total = inst_missed + inst_covered
+        bran_total = bran_missed + bran_covered
+        inst_cov = inst_covered / inst_total if inst_total > 0 else 0.0
+        bran_cov = bran_covered / bran_total if bran_total > 0 else None
+        return (inst_cov, bran_cov)
@@ -1,20 +1,149 @@
 import os
 import re
+import json
+import queue
+import jpype
 import logging
+import threading
 import subprocess
 from typing import List, Tuple
 from bs4 import BeautifulSoup
 
 
+def split_classpath(classpath:str) -> list:
+    """
+    entries of a classpath string, separated by ";" (as in dependencies.txt) or by the path separator of the platform
+    """
+    return [entry.strip() for entry in re.split(f";|{re.escape(os.pathsep)}", classpath) if entry.strip()]
+
+
+class TestLauncher:
+    """
+    Client of the warm JUnit Platform launcher (execute.TestLauncherWorker) running in a forked JVM.
+    The worker is started on the first run and restarted after a timeout or a crash.
+    result: {"status": "completed"|"timeout"|"error", "summary": {"found", "started", "successful", "failed", "aborted", "skipped"},
+             "tests": [{"id", "name", "type", "class", "method", "status", "duration_ms", "exception", "children"}], "output"}
+    """
+    WORKER_JAR = "./Java/project-info-process.jar"
+    process: subprocess.Popen|None
+    lines: queue.Queue
+
+    def __init__(self, dependency_fd:str, jvm_options:list|None=None):
+        self.worker_cmd = [
+            'java',
+            *(jvm_options or []),
+            '-cp', os.pathsep.join([f"{dependency_fd}/*", os.path.abspath(self.WORKER_JAR)]),
+            'execute.TestLauncherWorker',
+        ]
+        self.process = None
+        self.lines = queue.Queue()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def available(cls) -> bool:
+        return os.path.exists(cls.WORKER_JAR)
+
+    def _start_worker(self):
+        self.process = subprocess.Popen(self.worker_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, encoding="utf-8", errors="ignore")
+        self.lines = queue.Queue()
+        def read(process:subprocess.Popen, lines:queue.Queue):
+            for line in process.stdout:
+                lines.put(line)
+            lines.put(None)
+        threading.Thread(target=read, args=(self.process, self.lines), daemon=True).start()
+        self.logger.debug(f"test launcher worker started, pid: {self.process.pid}")
+        return
+
+    def _stop_worker(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+        return
+
+    def run(self, project_path:str, classpath:list, classes:list|None=None, methods:list|None=None, timeout:int=600, coverage_file:str|None=None) -> dict:
+        """
+        coverage_file: write one JaCoCo session per test, the worker needs the JaCoCo agent
+        """
+        request = {"project": project_path, "classpath": classpath, "classes": classes or [], "methods": methods or [], "timeout": timeout}
+        if coverage_file is not None:
+            request["coverage_file"] = coverage_file
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self._start_worker()
+            try:
+                self.process.stdin.write(json.dumps(request) + "\n")
+                self.process.stdin.flush()
+                # the worker reports its own timeout, the extra time covers class loading & discovery
+                line = self.lines.get(timeout=timeout + 60)
+            except (OSError, queue.Empty):
+                line = None
+            try:
+                result = json.loads(line) if line is not None else None
+            except ValueError:
+                self.logger.warning(f"unexpected output of test launcher worker: {line.strip()}")
+                result = None
+            if result is None:
+                self._stop_worker()
+                return {"status": "error", "summary": {}, "tests": [], "output": "test launcher worker stopped"}
+            if result["status"] == "timeout":
+                # the worker exits after a timeout
+                self._stop_worker()
+        return result
+
+    def close(self):
+        with self.lock:
+            self._stop_worker()
+        return
+
+    @staticmethod
+    def iter_tests(nodes:list):
+        for node in nodes:
+            if node["type"] == "test":
+                yield node
+            yield from TestLauncher.iter_tests(node.get("children", []))
+
+    @staticmethod
+    def format_result(result:dict) -> str:
+        """
+        summary and failures in text, similar to the ConsoleLauncher output
+        """
+        summary = result.get("summary", {})
+        lines = [f"[{summary.get(key, 0):>6} tests {key}]" for key in ("found", "started", "successful", "failed", "aborted", "skipped")]
+        for test in TestLauncher.iter_tests(result.get("tests", [])):
+            if test.get("status") not in ("FAILED", "ABORTED"): continue
+            exception = test.get("exception", {})
+            lines.append(f"{test.get('class', '')}.{test.get('method', test['name'])}() => {exception.get('type', '')}: {exception.get('message', '')}")
+            lines.append(exception.get("trace", ""))
+        return "\n".join(lines)
+
+
 class JavaRunner:
     cd_cmd: list
     dependency_fd: str
+    compile_service: object
+    compile_diagnostics: list|None
+    launcher: TestLauncher|None
+    coverage_launcher: TestLauncher|None
+    test_result: dict|None
     logger: logging.Logger
     
-    def __init__(self, project_url:str, dep_fd=""):
+    def __init__(self, project_url:str, dep_fd="", workspace:str|None=None):
+        """
+        workspace: directory relative to the project for test sources, test classes and coverage data of this runner,
+        so that several runners can work on one project; target/classes and libs are shared read-only
+        """
         self.cd_cmd = ['cd', project_url, '&&']
         self.dependency_fd = dep_fd
-        test_dependencies = f"libs/*;target/test-classes;target/classes;{self.dependency_fd}/*"
+        self.workspace = workspace
+        self.test_classes_dir = f"{workspace}/test-classes" if workspace else "target/test-classes"
+        self.exec_file = f"{workspace}/jacoco.exec" if workspace else "target/jacoco.exec"
+        # classes compiled into the workspace shadow the ones in target/test-classes
+        test_classes = f"{self.test_classes_dir};target/test-classes" if workspace else self.test_classes_dir
+        test_dependencies = f"libs/*;{test_classes};target/classes;{self.dependency_fd}/*"
+        self.test_classpath = split_classpath(test_dependencies)
         self.test_base_cmd = [
             'java',
             '-cp', test_dependencies,
@@ -23,11 +152,61 @@ class JavaRunner:
             '--disable-ansi-colors',
             '--fail-if-no-tests',
         ]
+        self.compile_service = None
+        self.compile_diagnostics = None
+        self.launcher = TestLauncher(dep_fd) if TestLauncher.available() else None
+        # output=none: coverage sessions are written by the listener in the worker
+        coverage_agent = f"-javaagent:{self.dependency_fd}/jacocoagent.jar=output=none"
+        self.coverage_launcher = TestLauncher(dep_fd, [coverage_agent]) if TestLauncher.available() else None
+        self.test_result = None
         self.logger = logging.getLogger(__name__)
         return
-    
+
+    def test_source_path(self, test_path:str) -> str:
+        """
+        where a test class (path relative to the project) is placed for this runner
+        """
+        return f"{self.workspace}/{test_path}" if self.workspace else test_path
+
+    def use_launchers(self, launcher:TestLauncher|None, coverage_launcher:TestLauncher|None):
+        """
+        share launcher workers with other runners, the worker is independent of the project
+        """
+        self.launcher = launcher
+        self.coverage_launcher = coverage_launcher
+        return
+
+    def _get_compile_service(self):
+        # javac inside the JPype JVM, unavailable when the JVM is not started or has no compiler (JRE)
+        if self.compile_service is None:
+            self.compile_service = False
+            if jpype.isJVMStarted():
+                try:
+                    CompileService = jpype.JClass("execute.CompileService")
+                    self.compile_service = CompileService.forProject(self.cd_cmd[1])
+                except Exception as e:
+                    self.logger.warning(f"in-JVM compiler is not available, use javac instead: {e}")
+        return self.compile_service
+
     def compile_test(self, class_path):
-        compile_cmd = ["javac", "-cp", "@dependencies.txt","-d","target/test-classes", class_path]
+        """
+        return: (success, feedback in javac format)
+        the structured diagnostics of the in-JVM compiler are kept in self.compile_diagnostics:
+        [{"kind", "line", "column", "code", "message", "symbol"}], None if compiled by javac
+        """
+        self.compile_diagnostics = None
+        service = self._get_compile_service()
+        if service:
+            self.logger.info(f"compile {class_path} in JVM")
+            result = json.loads(str(service.compile(class_path, self.test_classes_dir)))
+            self.compile_diagnostics = result["diagnostics"]
+            if result["success"]:
+                return (True, "")
+            feedback = "\n".join(f"{class_path}:{diag['line']}: {diag['kind']}: {diag['message']}"
+                                 for diag in self.compile_diagnostics)
+            self.logger.error(f"error occured in compile test class, info:\n{feedback}")
+            return (False, feedback)
+        compile_cmd = ["javac", "-cp", "@dependencies.txt","-d",self.test_classes_dir, class_path]
         script = self.cd_cmd + compile_cmd
         self.logger.info(" ".join(compile_cmd))
         result = subprocess.run(script, capture_output=True, text=True, shell=True, encoding="utf-8")
@@ -36,6 +215,24 @@ class JavaRunner:
             return (False, result.stderr)
         return (True, "")
 
+    def run_test_structured(self, testclass:str|None=None, methods:list|None=None, timeout:int=600) -> dict|None:
+        """
+        run tests in the warm launcher worker, return the structured result (see TestLauncher), None if unavailable
+        """
+        if self.launcher is None: return None
+        classes = [testclass] if testclass is not None else []
+        project_path = os.path.abspath(self.cd_cmd[1])
+        return self.launcher.run(project_path, self.test_classpath, classes, methods, timeout)
+
+    def run_test_sessions(self, testclasses:list, exec_file:str, timeout:int=600) -> dict|None:
+        """
+        run the test classes once with coverage, one JaCoCo session per test is written to exec_file.
+        return: structured result (see TestLauncher), None if the launcher is unavailable
+        """
+        if self.coverage_launcher is None: return None
+        project_path = os.path.abspath(self.cd_cmd[1])
+        return self.coverage_launcher.run(project_path, self.test_classpath, testclasses, [], timeout, os.path.abspath(exec_file))
+
     def run_test_verbose(self, testclass):
         test_cmd = self.test_base_cmd.copy() + ['--details', 'verbose', '--select-class', testclass]
         # script = self.cd_cmd + test_cmd
@@ -63,9 +260,22 @@ class JavaRunner:
         - 2: No tests
         """
         self.logger.info(f"Running single unit test, testclass: {testclass}")
+        self.test_result = None
+        if not coverage and self.launcher is not None:
+            # the coverage agent can't be attached to the warm worker
+            result = self.run_test_structured(testclass)
+            if result["status"] != "error":
+                self.test_result = result
+                if result["status"] == "timeout":
+                    return (False, f"Time takes too long while executing test class {testclass}")
+                summary = result["summary"]
+                test_info = TestLauncher.format_result(result)
+                self.logger.info(f"test execution info: {test_info}")
+                return (summary["started"] > 0, test_info)
+            self.logger.warning(f"test launcher worker failed, run ConsoleLauncher instead: {result['output']}")
         test_cmd = self.test_base_cmd.copy() + ['--select-class', testclass]
         if coverage:
-            java_agent = f"-javaagent:{self.dependency_fd}/jacocoagent.jar=destfile=target/jacoco.exec"
+            java_agent = f"-javaagent:{self.dependency_fd}/jacocoagent.jar=destfile={self.exec_file}"
             test_cmd.insert(test_cmd.index('-cp'), java_agent)
         # script = self.cd_cmd + test_cmd
 
@@ -100,7 +310,7 @@ class JavaRunner:
             return (False, test_info)
 
     def run_selected_mehods(self, methods:list[str]):
-        java_agent = f"-javaagent:{self.dependency_fd}/jacocoagent.jar=destfile=target/jacoco.exec"
+        java_agent = f"-javaagent:{self.dependency_fd}/jacocoagent.jar=destfile={self.exec_file}"
         test_cmd = self.test_base_cmd.copy()
         test_cmd.insert(test_cmd.index('-cp'), java_agent)
         for method in methods:
@@ -119,7 +329,7 @@ class JavaRunner:
     def generate_report_single(self, html_report, csv_report=None):
         # generate report
         jacoco_cli = f"{self.dependency_fd}/jacococli.jar"
-        report_cmd = ['java', '-jar', jacoco_cli, "report", "target/jacoco.exec", '--classfiles', 'target/classes', '--sourcefiles', 'src/main/java', "--html", html_report]
+        report_cmd = ['java', '-jar', jacoco_cli, "report", self.exec_file, '--classfiles', 'target/classes', '--sourcefiles', 'src/main/java', "--html", html_report]
         self.logger.debug(' '.join(report_cmd))
         if csv_report is not None:
             report_cmd += ["--csv", csv_report]
@@ -132,7 +342,7 @@ class JavaRunner:
         return True
 
     def delete_jacoco_exec(self):
-        jacoco_path = f"{self.cd_cmd[1]}/target/jacoco.exec"
+        jacoco_path = f"{self.cd_cmd[1]}/{self.exec_file}"
         if os.path.exists(jacoco_path):
             os.remove(jacoco_path)
         return
@@ -177,7 +387,8 @@ class CoverageExtractor:
                 method_name = tds[0].a.string
             if self.check_method_name(method_name, method):
                 instruction_cov = float(tds[2].string.replace("%", ""))/100
-                branch_cov = float(tds[4].string.replace("%", ""))/100
+                # "n/a": the method has no branches
+                branch_cov = float(tds[4].string.replace("%", ""))/100 if tds[4].string != "n/a" else None
                 # coverage_score = {"inst_cov": instruction_cov, "bran_cov": branch_cov}
                 coverage_score = (instruction_cov, branch_cov)
                 break
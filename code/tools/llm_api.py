@@ -1,60 +1,250 @@
 from json.decoder import JSONDecodeError
 import re
 import json
+import asyncio
 import logging
-from openai import  OpenAI, Omit, omit
+import threading
+from openai import AsyncOpenAI, Omit, omit
+from openai import RateLimitError, APIConnectionError, InternalServerError, AuthenticationError, PermissionDeniedError
 from openai.types.chat.completion_create_params import ResponseFormat
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 
 from settings import LLMSettings as ST
+from tools.llm_cache import LLMCache
+from tools.llm_scheduler import AccountScheduler
+
+
+class CodeBlockStop:
+    """
+    Stop condition of a streamed response: the first fenced code block is closed.
+    Same pattern as LLMCaller._filter_code, so the cut-off response yields the same code.
+    """
+    pattern = re.compile(r"```(?:[jJ]ava)?\n+([\s\S]*?)\n```")
+
+    def __init__(self):
+        self.parts = []
+
+    def feed(self, delta:str) -> bool:
+        self.parts.append(delta)
+        if "`" not in delta: return False
+        text = "".join(self.parts)
+        return text.count("```") >= 2 and self.pattern.search(text) is not None
+
+
+class JsonObjectStop:
+    """
+    Stop condition of a streamed response: the first JSON object is balanced.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, delta:str) -> bool:
+        for char in delta:
+            if self.in_string:
+                if self.escape: self.escape = False
+                elif char == "\\": self.escape = True
+                elif char == '"': self.in_string = False
+            elif char == '"' and self.started:
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+                self.started = True
+            elif char == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0: return True
+        return False
+
+
+class LLMEngine:
+    """
+    Asyncio engine shared by all LLM callers of the process.
+    Requests from every project and stage run in one event loop, with one client (connection pool)
+    per account and a global limit of in-flight requests.
+    Each request is routed by the account scheduler to the account with the most rate limit headroom.
+    """
+    EST_COMPLETION_TOKENS = 1024
+    _instance = None
+    _instance_lock = threading.Lock()
+    loop: asyncio.AbstractEventLoop
+    semaphore: asyncio.Semaphore
+    clients: dict # {account_num: AsyncOpenAI}
+    scheduler: AccountScheduler
+
+    def __init__(self, max_concurrency:int) -> None:
+        self.max_concurrency = max_concurrency
+        self.clients = {}
+        self.scheduler = AccountScheduler(ST.API_ACCOUNTS, ST.DEFAULT_RPM, ST.DEFAULT_TPM)
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-engine", daemon=True)
+        self.thread.start()
+        self.logger = logging.getLogger(__name__)
+        self.logger.info(f"LLM engine started, max concurrency: {max_concurrency}.")
+
+    @classmethod
+    def get_engine(cls) -> "LLMEngine":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = LLMEngine(ST.MAX_CONCURRENCY)
+        return cls._instance
+
+    def _get_client(self, account_num:int) -> AsyncOpenAI:
+        # only called inside the engine loop, no lock needed
+        client = self.clients.get(account_num)
+        if client is None:
+            account = ST.API_ACCOUNTS[account_num]
+            # retries are handled by the caller, so that a retry can move to another account
+            client = AsyncOpenAI(api_key=account["api_key"], base_url=account["base_url"], max_retries=0)
+            self.clients[account_num] = client
+        return client
+
+    def _estimate_tokens(self, messages:list[dict]) -> float:
+        return sum(len(message["content"]) for message in messages) / 4 + self.EST_COMPLETION_TOKENS
+
+    async def _astream(self, raw, stop) -> str:
+        """
+        Read a streamed completion, close the stream as soon as the stop condition holds.
+        """
+        stream = raw.parse()
+        parts = []
+        try:
+            async for chunk in stream:
+                if len(chunk.choices) == 0: continue
+                delta = chunk.choices[0].delta.content
+                if not delta: continue
+                parts.append(delta)
+                if stop.feed(delta):
+                    self.logger.debug("Stream stopped early.")
+                    break
+        finally:
+            await stream.close()
+        return "".join(parts)
+
+    async def acomplete(self, stop=None, **params) -> str|None:
+        """
+        Request a completion. With a stop condition (CodeBlockStop/JsonObjectStop) the response is streamed
+        and cut off once the condition holds.
+        """
+        est_tokens = self._estimate_tokens(params["messages"])
+        used_tokens = None
+        async with self.semaphore:
+            account_num = await self.scheduler.acquire(est_tokens)
+            client = self._get_client(account_num)
+            try:
+                if stop is None:
+                    raw = await client.chat.completions.with_raw_response.create(**params)
+                    response = raw.parse()
+                    content = response.choices[0].message.content
+                    used_tokens = response.usage.total_tokens if response.usage else None
+                else:
+                    raw = await client.chat.completions.with_raw_response.create(stream=True, **params)
+                    content = await self._astream(raw, stop)
+            except RateLimitError as e:
+                self.scheduler.report_rate_limit(account_num, e.response.headers)
+                raise
+            except (APIConnectionError, InternalServerError, AuthenticationError, PermissionDeniedError):
+                self.scheduler.report_failure(account_num)
+                raise
+            except BaseException:
+                # bad requests, errors in the stream and cancellation must not keep the account in its trial
+                self.scheduler.release(account_num)
+                raise
+        if content:
+            self.scheduler.report_success(account_num, raw.headers, est_tokens, used_tokens)
+        else:
+            self.scheduler.report_failure(account_num)
+        return content
+
+    def run(self, coro):
+        """
+        Run a coroutine in the engine loop and wait for its result (sync entry point).
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def arun(self, coro):
+        """
+        Await a coroutine in the engine loop from any event loop (async entry point).
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def close(self):
+        async def close_clients():
+            for client in self.clients.values():
+                await client.close()
+            self.clients.clear()
+        self.run(close_clients())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        with LLMEngine._instance_lock:
+            if LLMEngine._instance is self:
+                LLMEngine._instance = None
+        return
+
 
 class LLMCaller:
-    account_num = 0
-    cur_account_num = 0
-    accounts = []
-    gpt:OpenAI
-    base_message = []
+    engine: LLMEngine
+    cache: LLMCache
+    sysprompt: str|None
+    base_message: list
     temperature:float = 0.5
+    stream: bool
     
     def __init__(self, sysprompt = None) -> None:
         self.model = ST.MODEL
-        self.accounts = ST.API_ACCOUNTS
-        self.account_num = len(ST.API_ACCOUNTS)
-        account = self.accounts[self.cur_account_num]
         self.temperature = ST.TEMPERATURE
-        self.gpt = OpenAI(api_key=account["api_key"],base_url=account["base_url"])
+        self.stream = ST.STREAM
+        self.engine = LLMEngine.get_engine()
+        self.cache = LLMCache.get_cache(ST)
+        self.sysprompt = sysprompt
+        self.base_message = []
         if sysprompt is not None:
             self.base_message.append({"role": "system", "content": sysprompt})
         self.logger = logging.getLogger(__name__)
         self.logger.info(f"LLM API initialized, model name: {self.model}.")
         pass
 
-    def change_account(self):
-        if self.account_num == 1:
-            # self.logger.error("Only one account info, can't change account.")
-            return
-        self.cur_account_num = (self.cur_account_num+1)%self.account_num
-        account = self.accounts[self.cur_account_num]
-        self.gpt = OpenAI(api_key=account["api_key"],base_url=account["base_url"])
-        self.logger.info(f"Change api_key successfully.")
-        return
-
     @retry(wait=wait_random_exponential(min=1, max=30), stop=stop_after_attempt(3))
-    def _generation(self, prompt:str, rps_format:dict|Omit=omit) -> str:
+    async def _arequest(self, prompt:str, rps_format:dict|Omit=omit) -> str:
         messages = self.base_message.copy()
         messages.append({"role": "user", "content": prompt})
-        response = self.gpt.chat.completions.create(
+        stop = None
+        if self.stream:
+            stop = JsonObjectStop() if isinstance(rps_format, dict) else CodeBlockStop()
+        content = await self.engine.acomplete(
+            stop=stop,
             model=self.model,
             messages=messages,
-            response_format = rps_format,  # pyright: ignore[reportArgumentType]
+            response_format = rps_format,
             temperature=self.temperature,
             # add more parameters
         )
-        if response.choices[0].message.content:
-            return response.choices[0].message.content 
+        if content:
+            return content
         else:
-            self.change_account()
+            # the engine has reported the account, the retry is routed by the scheduler
             raise ValueError("Empty response from API")
+
+    async def _ageneration(self, prompt:str, rps_format:dict|Omit=omit) -> str:
+        # identical requests are answered from the response cache, a repeated prompt in the run is a new sample
+        key = self.cache.sample_key(LLMCache.make_key(self.model, self.temperature, rps_format, self.sysprompt, prompt))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        content = await self._arequest(prompt, rps_format)
+        self.cache.put(key, self.model, content)
+        return content
+
+    def _generation(self, prompt:str, rps_format:dict|Omit=omit) -> str:
+        return self.engine.run(self._ageneration(prompt, rps_format))
         
     def _filter_code(self, output:str) -> str:
         # extract java code from output
@@ -80,8 +270,11 @@ class LLMCaller:
     
     # get response surrounded by ```java````
     def get_response_code(self, prompt:str) -> list:
+        return self.engine.run(self.aget_response_code(prompt))
+
+    async def aget_response_code(self, prompt:str) -> list:
         try:
-            response = self._generation(prompt)
+            response = await self.engine.arun(self._ageneration(prompt))
             code = self._filter_code(response)
             return [code, response]
         except Exception as e:
@@ -96,17 +289,24 @@ class LLMCaller:
         matches = re.findall(json_pattern, json_str, re.DOTALL)
         if len(matches)>0:
             json_str = max(matches, key=len)
+        else: # streamed response may be cut off before the closing fence
+            icp_matches = re.findall(r"```(?:[jJ]son)?\n+([\s\S]*?)$", json_str, re.DOTALL)
+            if len(icp_matches)>0:
+                json_str = icp_matches[0]
         obj = json.loads(json_str)
         self.logger.debug(f"Json object: {obj}")
         return obj
     
     # get response in json format
     def get_response_json(self, prompt:str):
+        return self.engine.run(self.aget_response_json(prompt))
+
+    async def aget_response_json(self, prompt:str):
         json_data = None
         response = ""
         try:
             response_format = { 'type': 'json_object' }
-            response = self._generation(prompt, response_format)
+            response = await self.engine.arun(self._ageneration(prompt, response_format))
             json_data = self._handle_json_response(response)
         except Exception as e:
             self.logger.error(f"{type(e)} occured while get json object from llm api: {e}")
@@ -114,6 +314,12 @@ class LLMCaller:
                 response = f"{e}\n{response}"
         return [json_data, response]
 
+    # get json responses of independent prompts concurrently, results keep the order of prompts
+    def get_response_json_batch(self, prompts:list) -> list:
+        async def gather():
+            return await asyncio.gather(*[self.aget_response_json(prompt) for prompt in prompts])
+        return self.engine.run(gather())
+
 
 # test
 if __name__ == '__main__':
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+
+class LLMCache:
+    """
+    Content-addressed cache of LLM responses, stored in a single SQLite file.
+    The key is a hash of (model, temperature, response_format, system prompt, prompt).
+    A prompt repeated in a run (e.g. a repair retry with unchanged feedback) is a new sample: the n-th request
+    of a key in the run uses "<key>#n", so retries aren't answered with the same response and a re-executed run
+    replays every sample.
+    modes:
+    - read-write: read cached responses, store new responses
+    - read-only: read cached responses only, for replaying a previous run
+    - bypass: the cache is not used
+    """
+    MODES = ("read-write", "read-only", "bypass")
+    EVICT_INTERVAL = 100 # check eviction every n writes
+    _instance = None
+    _instance_lock = threading.Lock()
+    mode: str
+    db_path: str
+    max_bytes: int
+    max_age: float
+    stats: dict
+
+    def __init__(self, db_path:str, mode:str="read-write", max_mb:float=1024, max_days:float=30) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cache mode `{mode}`, should be one of {self.MODES}")
+        self.mode = mode
+        self.db_path = db_path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_days * 24 * 3600
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.samples = {} # {key: requests in this run}
+        self.lock = threading.Lock()
+        self.conn = None
+        self.logger = logging.getLogger(__name__)
+        if mode == "bypass": return
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT,
+            size INTEGER,
+            created REAL,
+            accessed REAL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)")
+        self.conn.commit()
+        if mode == "read-write":
+            self.evict()
+        self.logger.info(f"LLM cache opened: {db_path}, mode: {mode}.")
+
+    @classmethod
+    def get_cache(cls, settings) -> "LLMCache":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = LLMCache(settings.CACHE_PATH, settings.CACHE_MODE, settings.CACHE_MAX_MB, settings.CACHE_MAX_DAYS)
+        return cls._instance
+
+    @classmethod
+    def close_cache(cls):
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.close()
+                cls._instance = None
+        return
+
+    @staticmethod
+    def make_key(model:str, temperature:float, rps_format, sysprompt:str|None, prompt:str) -> str:
+        rps_format = rps_format if isinstance(rps_format, dict) else None
+        content = json.dumps([model, temperature, rps_format, sysprompt, prompt], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def sample_key(self, key:str) -> str:
+        """
+        key of the next sample of the prompt in this run
+        """
+        with self.lock:
+            index = self.samples.get(key, 0)
+            self.samples[key] = index + 1
+        return key if index == 0 else f"{key}#{index}"
+
+    def get(self, key:str) -> str|None:
+        if self.conn is None: return None
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            if self.mode == "read-write":
+                self.conn.execute("UPDATE responses SET accessed=? WHERE key=?", (time.time(), key))
+                self.conn.commit()
+        return row[0]
+
+    def put(self, key:str, model:str, response:str):
+        if self.conn is None or self.mode != "read-write": return
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, model, response, len(response.encode("utf-8")), now, now))
+            self.conn.commit()
+            self.stats["writes"] += 1
+            check = self.stats["writes"] % self.EVICT_INTERVAL == 0
+        if check: self.evict()
+        return
+
+    def evict(self):
+        """
+        Remove responses older than max age, then the least recently used ones until the size limit holds.
+        """
+        if self.conn is None: return
+        with self.lock:
+            deadline = time.time() - self.max_age
+            removed = self.conn.execute("DELETE FROM responses WHERE accessed<?", (deadline,)).rowcount
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                drop_keys = []
+                for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    if total <= self.max_bytes: break
+                    drop_keys.append((key,))
+                    total -= size
+                self.conn.executemany("DELETE FROM responses WHERE key=?", drop_keys)
+                removed += len(drop_keys)
+            self.conn.commit()
+            self.stats["evictions"] += removed
+        if removed > 0:
+            self.logger.info(f"LLM cache evicted {removed} responses.")
+        return
+
+    def close(self):
+        if self.conn is None: return
+        self.logger.info(f"LLM cache statistics: {self.stats}")
+        with self.lock:
+            self.conn.close()
+            self.conn = None
+        return
@@ -0,0 +1,225 @@
+import re
+import time
+import asyncio
+import logging
+
+
+def parse_duration(value) -> float|None:
+    """
+    parse durations in rate limit headers, e.g. "20", "1.5", "20ms", "1s", "6m0s"
+    """
+    if value is None: return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"([0-9.]+)(ms|s|m|h)", value)
+    if len(parts) == 0: return None
+    return sum(float(num) * units[unit] for num, unit in parts)
+
+
+class TokenBucket:
+    capacity: float
+    base_rate: float # configured refill per second
+    rate: float # refill per second, reported by the server for the current window
+    rate_until: float|None
+    tokens: float
+    updated: float
+
+    def __init__(self, capacity_per_minute:float):
+        self.capacity = capacity_per_minute
+        self.base_rate = capacity_per_minute / 60
+        self.rate = self.base_rate
+        self.rate_until = None
+        self.tokens = capacity_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate_until is not None and now >= self.rate_until:
+            # the window of the server is over, refill at the configured rate again
+            self.tokens = min(self.capacity, self.tokens + (self.rate_until - self.updated) * self.rate)
+            self.updated = self.rate_until
+            self.rate = self.base_rate
+            self.rate_until = None
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def consume(self, amount:float):
+        # tokens may become negative when the real usage exceeds the estimation
+        self._refill()
+        self.tokens -= amount
+
+    def wait_time(self, amount:float) -> float:
+        missing = min(amount, self.capacity) - self.available()
+        return max(0.0, missing / self.rate)
+
+    def sync(self, remaining:float|None, reset:float|None=None):
+        """
+        align the local bucket with the remaining quota reported by the server
+        """
+        if remaining is None: return
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+        if reset is not None and reset > 0 and remaining < self.capacity:
+            # the server refills its quota within reset, the rate only holds until then
+            self.rate = max(self.base_rate, (self.capacity - remaining) / reset)
+            self.rate_until = self.updated + reset
+        return
+
+
+class AccountState:
+    """
+    Rate limit and circuit breaker state of one API account.
+    circuit states: closed (healthy), open (rejected until cooldown ends), half-open (one trial request)
+    """
+    index: int
+    requests: TokenBucket
+    tokens: TokenBucket
+    blocked_until: float
+    failures: int
+    circuit: str
+    open_until: float
+    cooldown: float
+    trial_running: bool
+
+    def __init__(self, index:int, rpm:float, tpm:float, cooldown:float):
+        self.index = index
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.circuit = "closed"
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.open_until = 0.0
+        self.trial_running = False
+
+    def headroom(self) -> float:
+        return min(self.requests.available() / self.requests.capacity,
+                   self.tokens.available() / self.tokens.capacity)
+
+    def wait_time(self, est_tokens:float) -> float:
+        now = time.monotonic()
+        if self.circuit == "open":
+            return max(0.0, self.open_until - now)
+        if self.circuit == "half-open" and self.trial_running:
+            return self.base_cooldown
+        return max(self.blocked_until - now, self.requests.wait_time(1), self.tokens.wait_time(est_tokens))
+
+
+class AccountScheduler:
+    """
+    Route every LLM request to the account with the most rate limit headroom.
+    Shared by all callers through the LLM engine, only used inside the engine event loop.
+    """
+    FAILURE_THRESHOLD = 3
+    MAX_COOLDOWN = 600
+    accounts: list[AccountState]
+
+    def __init__(self, account_infos:list[dict], default_rpm:float, default_tpm:float, cooldown:float=30):
+        self.accounts = [
+            AccountState(i, info.get("rpm", default_rpm), info.get("tpm", default_tpm), cooldown)
+            for i, info in enumerate(account_infos)
+        ]
+        self.logger = logging.getLogger(__name__)
+
+    def _refresh_circuit(self, account:AccountState):
+        if account.circuit == "open" and time.monotonic() >= account.open_until:
+            account.circuit = "half-open"
+            account.trial_running = False
+        return
+
+    async def acquire(self, est_tokens:float) -> int:
+        """
+        wait until an account can serve the request, reserve its quota and return the account index
+        """
+        while True:
+            candidates = []
+            for account in self.accounts:
+                self._refresh_circuit(account)
+                if account.wait_time(est_tokens) <= 0:
+                    candidates.append(account)
+            if len(candidates) > 0:
+                account = max(candidates, key=lambda acc: acc.headroom())
+                account.requests.consume(1)
+                account.tokens.consume(est_tokens)
+                if account.circuit == "half-open":
+                    account.trial_running = True
+                return account.index
+            wait = min(account.wait_time(est_tokens) for account in self.accounts)
+            await asyncio.sleep(min(max(wait, 0.05), 5))
+
+    def _sync_headers(self, account:AccountState, headers):
+        if headers is None: return
+        remaining_req = headers.get("x-ratelimit-remaining-requests")
+        remaining_tok = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_req is not None:
+            account.requests.sync(float(remaining_req), parse_duration(headers.get("x-ratelimit-reset-requests")))
+        if remaining_tok is not None:
+            account.tokens.sync(float(remaining_tok), parse_duration(headers.get("x-ratelimit-reset-tokens")))
+        return
+
+    def report_success(self, index:int, headers=None, est_tokens:float=0, used_tokens:float|None=None):
+        account = self.accounts[index]
+        if used_tokens is not None:
+            account.tokens.consume(used_tokens - est_tokens)
+        try:
+            self._sync_headers(account, headers)
+        except ValueError:
+            pass
+        if account.circuit != "closed":
+            self.logger.info(f"Account {index} recovered.")
+        account.failures = 0
+        account.circuit = "closed"
+        account.cooldown = account.base_cooldown
+        account.trial_running = False
+        return
+
+    def report_rate_limit(self, index:int, headers=None):
+        """
+        429 response: block the account until Retry-After (or the reset of its quota)
+        """
+        account = self.accounts[index]
+        retry_after = None
+        if headers is not None:
+            retry_ms = parse_duration(headers.get("retry-after-ms"))
+            retry_after = retry_ms / 1000 if retry_ms is not None else parse_duration(headers.get("retry-after"))
+            if retry_after is None:
+                retry_after = parse_duration(headers.get("x-ratelimit-reset-requests"))
+        if retry_after is None: retry_after = 60 / account.requests.capacity * 10
+        account.blocked_until = max(account.blocked_until, time.monotonic() + retry_after)
+        account.requests.sync(0)
+        if account.circuit == "half-open":
+            account.trial_running = False
+        self.logger.warning(f"Account {index} is rate limited, retry after {retry_after:.1f}s.")
+        return
+
+    def release(self, index:int):
+        """
+        the request ended without telling anything about the account (bad request, cancelled),
+        a trial request of a half-open circuit is given to the next caller
+        """
+        self.accounts[index].trial_running = False
+        return
+
+    def report_failure(self, index:int):
+        """
+        server error or empty response: open the circuit after consecutive failures
+        """
+        account = self.accounts[index]
+        account.failures += 1
+        if account.circuit == "half-open" or account.failures >= self.FAILURE_THRESHOLD:
+            if account.circuit == "half-open":
+                account.cooldown = min(account.cooldown * 2, self.MAX_COOLDOWN)
+            account.circuit = "open"
+            account.open_until = time.monotonic() + account.cooldown
+            account.trial_running = False
+            self.logger.warning(f"Circuit of account {index} is open for {account.cooldown:.0f}s.")
+        return
@@ -0,0 +1,131 @@
+import logging
+import threading
+
+import tools.io_utils as utils
+from tools.signature_index import SignatureIndex
+
+
+class SnippetReader:
+    project_path: str
+    cache:dict # {"<file_path>": ["line1", "line2"]}
+    def __init__(self, pj_path):
+        self.project_path = pj_path
+        self.cache = {}
+        pass
+
+    def _get_contents(self, file_path):
+        lines = self.cache.get(file_path)
+        if lines is None:
+            content:str = utils.load_text(f"{self.project_path}/{file_path}")
+            lines = content.splitlines()
+            self.cache[file_path] = lines
+        return lines
+
+    def read_single_line(self, file_path, line):
+        line = max(0, line)
+        lines = self._get_contents(file_path)
+        return lines[min(line, len(lines)-1)]
+
+    def read_lines(self, file_path, start_line, end_line):
+        start_line = max(0, start_line if start_line is not None else 0)
+        lines = self._get_contents(file_path)
+        end_line = min(max(start_line, end_line) + 1, len(lines))
+        return lines[start_line:end_line]
+
+    def read_incoherent_lines(self, file_path, read_lines:list):
+        extracted_contents = []
+        for line in read_lines:
+            if isinstance(line,int):
+                extracted_contents.append(self.read_single_line(file_path, line))
+            elif isinstance(line,list):
+                extracted_contents += (self.read_lines(file_path, line[0], line[1]))
+        return extracted_contents
+
+
+class ProjectKnowledge:
+    """
+    Index of a project shared by the prompt, generation and repair stages of all threads.
+    Each section is loaded at its first use: code info (<project>.json), method index, invoke patterns
+    (<project>_invoke.json), import dictionary and source snippets. Sections are read only after loading.
+    """
+    _services = {}
+    _services_lock = threading.Lock()
+    project_path: str
+    project_name: str
+    code_info_file: str
+    invoke_file: str
+
+    def __init__(self, project_path:str, project_name:str, project_index_path:str):
+        self.project_path = project_path
+        self.project_name = project_name
+        self.code_info_file = f"{project_index_path}/json/{project_name}.json"
+        self.invoke_file = f"{project_index_path}/codegraph/{project_name}_invoke.json"
+        self.sections = {}
+        self.section_locks = {name: threading.Lock() for name in ("code_info", "method_index", "invoke_pattern", "snippet_reader")}
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def for_project(cls, project_path:str, project_name:str, project_index_path:str) -> "ProjectKnowledge":
+        """
+        shared service of the project, project_path is used by the first caller to read snippets
+        """
+        with cls._services_lock:
+            key = (project_index_path, project_name)
+            if key not in cls._services:
+                cls._services[key] = ProjectKnowledge(project_path, project_name, project_index_path)
+            return cls._services[key]
+
+    @classmethod
+    def release(cls, project_name:str):
+        """
+        drop the project when all its work is done, the sections are freed once no stage holds the service
+        """
+        with cls._services_lock:
+            for key in [key for key in cls._services if key[1] == project_name]:
+                cls._services.pop(key)
+        return
+
+    def _section(self, name:str, load):
+        section = self.sections.get(name)
+        if section is not None: return section
+        with self.section_locks[name]:
+            if name not in self.sections:
+                self.sections[name] = load()
+            return self.sections[name]
+
+    def _load_code_info(self) -> dict:
+        self.logger.info(f"Loading code index for {self.project_name}")
+        return utils.load_json(self.code_info_file)
+
+    @property
+    def code_info(self) -> dict:
+        return self._section("code_info", self._load_code_info)
+
+    @property
+    def method_index(self) -> SignatureIndex:
+        return self._section("method_index", lambda: SignatureIndex.from_code_info(self.code_info["source"], constructors=False))
+
+    @property
+    def invoke_pattern(self) -> dict:
+        return self._section("invoke_pattern", lambda: utils.load_json(self.invoke_file))
+
+    @property
+    def import_dict(self) -> dict:
+        # {"<simple class name>": ["import ...;"]}
+        return self.code_info["import_dict"]
+
+    @property
+    def snippet_reader(self) -> SnippetReader:
+        return self._section("snippet_reader", lambda: SnippetReader(self.project_path))
+
+    def class_info(self, class_name:str, istest=False) -> dict|None:
+        return self.code_info["test" if istest else "source"].get(class_name, None)
+
+    def method_info(self, class_name:str, method_name:str) -> dict|None:
+        '''
+        method info of a source class by its signature, e.g. "renderOptions(StringBuffer, int, Options, int, int)"
+        '''
+        return self.method_index.find(class_name, method_name)
+
+    def invoke_examples(self, class_name:str, processed_sig:str) -> list|None:
+        return self.invoke_pattern.get(class_name, {}).get(processed_sig)
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import tools.io_utils as io_utils
+
+
+class RunManifest:
+    """
+    Status of every (project, id, stage) of a run, with the hash of the stage inputs.
+    With resume enabled, a stage is skipped when its inputs are unchanged and its outputs exist.
+    entry: {"status": "done"|"failed", "input_hash", "output_hash", "outputs", "updated"}
+    """
+    manifest_path: str
+    resume: bool
+    entries: dict
+
+    def __init__(self, manifest_path:str, resume:bool=False):
+        self.manifest_path = manifest_path
+        self.resume = resume
+        self.entries = {}
+        self.digests = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        if os.path.exists(manifest_path):
+            self.entries = io_utils.load_json(manifest_path)
+            self.logger.info(f"Loaded run manifest with {len(self.entries)} entries: {manifest_path}")
+
+    @staticmethod
+    def key(project:str, tid:str, stage:str) -> str:
+        return f"{project}/{tid}/{stage}"
+
+    @staticmethod
+    def hash_inputs(*parts) -> str:
+        sha = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, str):
+                part = json.dumps(part, sort_keys=True, ensure_ascii=False)
+            sha.update(part.encode("utf-8"))
+            sha.update(b"\0")
+        return sha.hexdigest()
+
+    def file_digest(self, path:str, cached:bool=False) -> str:
+        """
+        hash of the file content, "" for missing files.
+        cached: reuse the digest computed earlier in this run, for large files that don't change during the run
+        """
+        if cached and path in self.digests:
+            return self.digests[path]
+        if not os.path.exists(path):
+            return ""
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            digest = self.hash_inputs(*[f"{name}:{self.file_digest(f'{path}/{name}')}" for name in names])
+        else:
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        if cached:
+            self.digests[path] = digest
+        return digest
+
+    def get(self, project:str, tid:str, stage:str) -> dict:
+        with self.lock:
+            return self.entries.get(self.key(project, tid, stage), {})
+
+    def output_hash(self, project:str, tid:str, stage:str) -> str:
+        return self.get(project, tid, stage).get("output_hash", "")
+
+    def is_fresh(self, project:str, tid:str, stage:str, input_hash:str) -> bool:
+        if not self.resume: return False
+        entry = self.get(project, tid, stage)
+        if entry.get("status") != "done" or entry.get("input_hash") != input_hash:
+            return False
+        return all(os.path.exists(path) for path in entry.get("outputs", []))
+
+    def mark(self, project:str, tid:str, stage:str, input_hash:str, outputs:list, status:str="done", error:str|None=None):
+        entry = {
+            "status": status,
+            "input_hash": input_hash,
+            "output_hash": self.file_digest(outputs[0]) if status == "done" and len(outputs) > 0 else "",
+            "outputs": outputs,
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        if error is not None: entry["error"] = error
+        with self.lock:
+            self.entries[self.key(project, tid, stage)] = entry
+            self._save()
+        return
+
+    def _save(self):
+        manifest_dir = os.path.dirname(self.manifest_path)
+        if manifest_dir and not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        # write to a temporary file first, so that a killed run never leaves a broken manifest
+        temp_path = f"{self.manifest_path}.tmp"
+        io_utils.write_json(temp_path, self.entries)
+        os.replace(temp_path, self.manifest_path)
+        return
+
+    def run_stage(self, project:str, tid:str, stage:str, input_hash:str, outputs:list, func, *args, **kwargs) -> bool:
+        """
+        run func unless the stage is fresh, record the result in the manifest
+        return: whether the stage is executed
+        """
+        if self.is_fresh(project, tid, stage, input_hash):
+            self.logger.debug(f"Skip stage {stage} of {tid}, inputs unchanged.")
+            return False
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            self.mark(project, tid, stage, input_hash, outputs, "failed", str(e))
+            raise
+        self.mark(project, tid, stage, input_hash, outputs)
+        return True
@@ -0,0 +1,91 @@
+import re
+
+
+def normalize_signature(signature:str) -> str:
+    """
+    "private static <T> List<T> orderFirst(org.jdom2.Namespace, List<Namespace>)" -> "orderFirst(Namespace, List)"
+    generics are stripped, qualified names are simplified, modifiers and return type are dropped
+    """
+    sig = signature
+    while re.search(r"<[^<>]*>", sig, flags=re.DOTALL):
+        sig = re.sub(r"<[^<>]*>", "", sig, flags=re.DOTALL)
+    sig = re.sub(r"\w+\.", "", sig, flags=re.DOTALL)
+    # an inner class qualifier ("Inner#method(...)") is kept, it never matches a method of the indexed class
+    name = re.search(r"([\w$#]+)\s*\(", sig)
+    if name is None: return sig.strip()
+    params = sig[name.end():sig.rindex(")")] if ")" in sig else sig[name.end():]
+    params = [" ".join(param.split()) for param in params.split(",") if param.strip()]
+    return f"{name.group(1)}({', '.join(params)})"
+
+
+def split_signature(signature:str) -> tuple[str, list]:
+    """
+    normalized signature -> (method name, parameter types)
+    """
+    name, _, params = signature.partition("(")
+    params = params.rstrip(")")
+    return name, [param.strip() for param in params.split(",") if param.strip()]
+
+
+def similar_params(candidate:list, target:list) -> bool:
+    """
+    parameters of a candidate match the target if they have the same number and each type is compatible:
+    erased types (Object) and type variables (single letter) match any type, otherwise the target starts with the candidate
+    """
+    if len(candidate) != len(target): return False
+    for item_c, item_t in zip(candidate, target):
+        if item_c.startswith("Object"): continue
+        if len(item_t) == 1: continue
+        if not item_t.startswith(item_c): return False
+    return True
+
+
+class SignatureIndex:
+    """
+    Items (method info, CFG, ...) keyed by class and normalized signature.
+    Exact lookups are dict accesses, the fuzzy fallback only compares the overloads of a method name.
+    The first item added for a signature is kept, as the linear scans it replaces returned the first match.
+    """
+    exact: dict # {"<class_fqn>#<normalized sig>": item}
+    overloads: dict # {"<class_fqn>#<method name>": [(params, item)]}
+
+    def __init__(self):
+        self.exact = {}
+        self.overloads = {}
+
+    def __len__(self):
+        return len(self.exact)
+
+    def add(self, class_fqn:str, signature:str, item):
+        sig = normalize_signature(signature)
+        key = f"{class_fqn}#{sig}"
+        if key in self.exact: return
+        self.exact[key] = item
+        name, params = split_signature(sig)
+        self.overloads.setdefault(f"{class_fqn}#{name}", []).append((params, item))
+        return
+
+    def find(self, class_fqn:str, signature:str, fuzzy=True):
+        sig = normalize_signature(signature)
+        item = self.exact.get(f"{class_fqn}#{sig}")
+        if item is not None or not fuzzy: return item
+        name, params = split_signature(sig)
+        for cand_params, cand_item in self.overloads.get(f"{class_fqn}#{name}", []):
+            if similar_params(cand_params, params):
+                return cand_item
+        return None
+
+    @classmethod
+    def from_code_info(cls, class_infos:dict, constructors=True) -> "SignatureIndex":
+        """
+        class_infos: "source" or "test" part of the code info, {class_fqn: class info}
+        """
+        index = cls()
+        for class_fqn, cinfo in class_infos.items():
+            for _, m_infos in cinfo["methods"].items():
+                for m_info in m_infos:
+                    index.add(class_fqn, m_info["signature"], m_info)
+            if not constructors: continue
+            for m_info in cinfo["constructors"]:
+                index.add(class_fqn, m_info["signature"], m_info)
+        return index